@@ -10,20 +10,35 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 import json as json_module
 
+# Load environment variables（须在导入服务模块之前：各模块在导入时读取配置）
+load_dotenv()
+
 from services.llm_service import LLMFactory
+from services.http_client import http_clients
+from services.response_cache import response_cache
+from services.provider_stats import provider_latency
+from services.resilience import resilience, CircuitOpenError
+from services.rate_limit import rate_limiters, RateLimitExceeded
+from services.context_window import context_manager
+from services.prompt_cache import prompt_cache
+from services import project_service
+from services.project_cache import project_cache
+from services.usage import UsageScope, usage_tracker
+from services.sse_framer import sse_framer, encode_event
+from services.stream_monitor import stream_monitor
+from services.stream_resume import resumable_streams
+from services.metrics import metrics, MetricsMiddleware, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from services.tracing import tracer, RequestIdMiddleware, REQUEST_ID_HEADER
 from routers.project import router as project_router
 from routers.tikhub import router as tikhub_router
 from routers.generation import router as generation_router
 
-# Load environment variables
-load_dotenv()
-
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -34,6 +49,14 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown
     print("👋 Backend shutting down...")
+    await http_clients.aclose()
+    if response_cache.disk is not None:
+        response_cache.disk.close()
+    if usage_tracker.log is not None:
+        await usage_tracker.log.aclose()
+    await project_cache.aclose()
+    await project_service.db.aclose()
+    tracer.close()
 
 
 app = FastAPI(
@@ -50,14 +73,91 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[REQUEST_ID_HEADER],
 )
 
+# Per-route request latency for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# X-Request-ID and sampled request traces (outermost, so the root span covers everything)
+app.add_middleware(RequestIdMiddleware)
+
 # Include routers
 app.include_router(project_router)
 app.include_router(tikhub_router)
 app.include_router(generation_router)
 
 
+# ============== Scrape-time Metrics ==============
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+metrics.callback(
+    "sse_streams_active",
+    "Streaming responses currently being sent",
+    lambda: {(): len(stream_monitor.active)},
+)
+metrics.callback(
+    "sse_streams_total",
+    "Finished streaming responses by outcome",
+    lambda: {(reason,): count for reason, count in stream_monitor.outcomes.items()},
+    ("reason",),
+    type="counter",
+)
+metrics.callback(
+    "resumable_streams_running",
+    "Generations running in the background for resumable streams",
+    lambda: {(): resumable_streams.snapshot()["running"]},
+)
+metrics.callback(
+    "resumable_streams_buffered_bytes",
+    "Bytes buffered for stream resumption",
+    lambda: {(): resumable_streams.total_bytes},
+)
+metrics.callback(
+    "response_cache_requests_total",
+    "Response cache lookups by namespace and result",
+    lambda: {
+        (namespace, result): stats[result]
+        for namespace, stats in response_cache.stats()["namespaces"].items()
+        for result in ("hits", "misses")
+    },
+    ("namespace", "result"),
+    type="counter",
+)
+metrics.callback(
+    "response_cache_hit_ratio",
+    "Response cache hit ratio since start",
+    lambda: {(): response_cache.stats()["hit_ratio"]},
+)
+metrics.callback(
+    "prompt_cache_requests_total",
+    "Compiled system prompt cache lookups by result",
+    lambda: {("hits",): prompt_cache.hits, ("misses",): prompt_cache.misses},
+    ("result",),
+    type="counter",
+)
+metrics.callback(
+    "project_cache_requests_total",
+    "Parsed project cache lookups by result",
+    lambda: {("hits",): project_cache.hits, ("misses",): project_cache.misses},
+    ("result",),
+    type="counter",
+)
+metrics.callback(
+    "llm_prompt_cache_hit_ratio",
+    "Share of prompt tokens served from the provider's prompt cache",
+    lambda: {(name,): stats.get("cache_hit_ratio") for name, stats in provider_latency.snapshot().items()},
+    ("provider",),
+)
+metrics.callback(
+    "llm_circuit_state",
+    "Circuit breaker state per provider (0 closed, 1 half open, 2 open)",
+    lambda: {(name,): CIRCUIT_STATES.get(state["state"], 0) for name, state in resilience.snapshot().items()},
+    ("provider",),
+)
+
+
 # ============== Request/Response Models ==============
 
 class GenerateRequest(BaseModel):
@@ -65,7 +165,7 @@ class GenerateRequest(BaseModel):
     prompt: str = Field(..., description="The input prompt for generation")
     model_type: str = Field(
         default="deepseek",
-        description="LLM model type: 'deepseek', 'claude', or 'doubao'"
+        description="LLM model type: 'deepseek', 'claude', 'doubao', or 'auto' (failover routing)"
     )
     system_prompt: Optional[str] = Field(
         default=None,
@@ -87,6 +187,11 @@ class GenerateRequest(BaseModel):
         default=False,
         description="Enable streaming response"
     )
+    cache: Optional[bool] = Field(
+        default=None,
+        description="Response cache: true to opt in, false to opt out, "
+                    "unset to cache only temperature-0 requests"
+    )
 
     model_config = {
         "json_schema_extra": {
@@ -108,7 +213,7 @@ class GenerateResponse(BaseModel):
     success: bool = Field(..., description="Whether the request was successful")
     content: str = Field(..., description="Generated content")
     model_type: str = Field(..., description="The LLM model used")
-    usage: Optional[dict] = Field(default=None, description="Token usage statistics")
+    usage: Optional[dict] = Field(default=None, description="Token usage and latency (None when served from the response cache)")
 
 
 class ErrorResponse(BaseModel):
@@ -156,8 +261,68 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint."""
-    return {"status": "healthy"}
+    """
+    Health check endpoint.
+    
+    Includes per-provider circuit breaker state. Returns 503 when every
+    provider in use is open, so the load balancer can drain this instance.
+    """
+    providers = resilience.snapshot()
+    if resilience.all_open():
+        return JSONResponse(
+            status_code=503,
+            content={"status": "unavailable", "providers": providers}
+        )
+    return {"status": "healthy", "providers": providers}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus text exposition of request, upstream, stream, cache and SQLite metrics."""
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Get response cache hit/miss statistics."""
+    return {"success": True, "cache": response_cache.stats()}
+
+
+@app.get("/api/providers/stats")
+async def get_provider_stats():
+    """Get per-provider latency percentiles, error counts, rate limiter queues, chat history trimming, compiled prompt cache and project cache."""
+    return {
+        "success": True,
+        "providers": provider_latency.snapshot(),
+        "rate_limits": rate_limiters.snapshot(),
+        "context": context_manager.snapshot(),
+        "prompts": prompt_cache.snapshot(),
+        "projects": project_cache.snapshot()
+    }
+
+
+@app.get("/api/streams/stats")
+async def get_stream_stats():
+    """Get active stream count, stream outcomes, interrupted streams and resume buffers."""
+    return {
+        "success": True,
+        "streams": stream_monitor.snapshot(),
+        "resumable": resumable_streams.snapshot()
+    }
+
+
+@app.get("/api/usage/stats")
+async def get_usage_stats(
+    group_by: str = Query(default="all", pattern="^(all|project|agent|model)$", description="汇总维度：all/project/agent/model")
+):
+    """Get token usage and latency aggregated per project, agent and model, ordered by total tokens."""
+    return {
+        "success": True,
+        "group_by": group_by,
+        "usage": usage_tracker.snapshot(group_by)
+    }
 
 
 @app.get("/api/models")
@@ -291,6 +456,10 @@ async def get_current_user(request: Request):
     }
 
 
+# Pre-encoded end-of-stream marker for /api/generate
+STREAM_DONE = b"data: [DONE]\n\n"
+
+
 @app.post(
     "/api/generate",
     response_model=GenerateResponse,
@@ -299,7 +468,7 @@ async def get_current_user(request: Request):
         500: {"model": ErrorResponse}
     }
 )
-async def generate_content(request: GenerateRequest):
+async def generate_content(request: GenerateRequest, http_request: Request):
     """
     Generate content using the specified LLM model.
     
@@ -311,6 +480,25 @@ async def generate_content(request: GenerateRequest):
     - **temperature**: Controls randomness (0.0-2.0)
     - **max_tokens**: Maximum length of generated content
     - **stream**: Enable streaming response (returns SSE)
+    - **cache**: Opt in/out of the response cache (cached streams are replayed)
+    
+    Streams are cancelled upstream as soon as the client disconnects.
+    """
+    return await run_generation(request, cache_namespace="generate", http_request=http_request)
+
+
+async def run_generation(
+    request: GenerateRequest,
+    cache_namespace: str,
+    http_request: Optional[Request] = None,
+):
+    """
+    Shared implementation of the generation endpoints.
+    
+    Args:
+        request: The generation request.
+        cache_namespace: Endpoint name for response cache opt-out and stats.
+        http_request: The raw request, used to detect client disconnects while streaming.
     """
     try:
         # Validate model type
@@ -323,22 +511,31 @@ async def generate_content(request: GenerateRequest):
             )
         
         # Create LLM instance using factory
-        llm = LLMFactory.create(request.model_type)
+        with tracer.span("llm.factory.create", **{"llm.model_type": request.model_type}):
+            llm = LLMFactory.create(request.model_type)
+        usage_scope = UsageScope(cache_namespace)
         
         # Handle streaming response
         if request.stream:
+            session = stream_monitor.open(cache_namespace, request.model_type)
+            
             async def generate_stream():
-                async for chunk in llm.generate_stream(
+                chunks = session.tap(llm.generate_stream(
                     prompt=request.prompt,
                     system_prompt=request.system_prompt,
                     temperature=request.temperature,
-                    max_tokens=request.max_tokens
-                ):
-                    yield f"data: {chunk}\n\n"
-                yield "data: [DONE]\n\n"
+                    max_tokens=request.max_tokens,
+                    cache=request.cache,
+                    cache_namespace=cache_namespace,
+                    usage_scope=usage_scope
+                ))
+                # Newlines in the text are sent as multi-line data fields
+                async for frame in sse_framer.frame(chunks, encode_event):
+                    yield frame
+                yield STREAM_DONE
             
             return StreamingResponse(
-                generate_stream(),
+                stream_monitor.guard(session, generate_stream(), http_request),
                 media_type="text/event-stream",
                 headers={
                     "Cache-Control": "no-cache",
@@ -351,15 +548,23 @@ async def generate_content(request: GenerateRequest):
             prompt=request.prompt,
             system_prompt=request.system_prompt,
             temperature=request.temperature,
-            max_tokens=request.max_tokens
+            max_tokens=request.max_tokens,
+            cache=request.cache,
+            cache_namespace=cache_namespace,
+            usage_scope=usage_scope
         )
         
         return GenerateResponse(
             success=True,
             content=content,
-            model_type=request.model_type
+            model_type=request.model_type,
+            usage=usage_scope.summary()
         )
         
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -376,7 +581,8 @@ async def generate_copywriting(
     topic: str = Query(..., description="文案主题"),
     style: str = Query(default="营销", description="文案风格：营销/种草/科普/故事"),
     model_type: str = Query(default="deepseek", description="模型类型"),
-    max_tokens: int = Query(default=1024, description="最大长度")
+    max_tokens: int = Query(default=1024, description="最大长度"),
+    cache: Optional[bool] = Query(default=None, description="是否使用响应缓存")
 ):
     """
     Generate marketing copywriting for the given topic.
@@ -397,10 +603,11 @@ async def generate_copywriting(
         prompt=prompt,
         model_type=model_type,
         system_prompt=system_prompt,
-        max_tokens=max_tokens
+        max_tokens=max_tokens,
+        cache=cache
     )
     
-    return await generate_content(request)
+    return await run_generation(request, cache_namespace="copywriting")
 
 
 @app.post("/api/generate/script")
@@ -408,7 +615,8 @@ async def generate_script(
     topic: str = Query(..., description="视频主题"),
     duration: str = Query(default="60秒", description="视频时长：30秒/60秒/3分钟"),
     model_type: str = Query(default="deepseek", description="模型类型"),
-    max_tokens: int = Query(default=2048, description="最大长度")
+    max_tokens: int = Query(default=2048, description="最大长度"),
+    cache: Optional[bool] = Query(default=None, description="是否使用响应缓存")
 ):
     """
     Generate video script for digital human.
@@ -430,10 +638,11 @@ async def generate_script(
         prompt=prompt,
         model_type=model_type,
         system_prompt=system_prompt,
-        max_tokens=max_tokens
+        max_tokens=max_tokens,
+        cache=cache
     )
     
-    return await generate_content(request)
+    return await run_generation(request, cache_namespace="script")
 
 
 # ============== Run Server ==============
@@ -5,7 +5,7 @@ Project Model - 项目（IP）数据模型
 """
 
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 from uuid import UUID, uuid4
 from pydantic import BaseModel, Field
 
@@ -66,6 +66,15 @@ class ProjectListResponse(BaseModel):
     success: bool = True
     projects: List[Project] = Field(default_factory=list, description="项目列表")
     active_project_id: Optional[UUID] = Field(None, description="当前激活的项目ID")
+    next_cursor: Optional[str] = Field(None, description="下一页游标，没有更多项目时为空")
+
+
+class ProjectFieldsListResponse(BaseModel):
+    """指定 fields 时的项目列表响应模型（项目只包含所选字段，不补全默认值）"""
+    success: bool = True
+    projects: List[Dict[str, Any]] = Field(default_factory=list, description="只包含所选字段的项目列表")
+    active_project_id: Optional[UUID] = Field(None, description="当前激活的项目ID")
+    next_cursor: Optional[str] = Field(None, description="下一页游标，没有更多项目时为空")
 
 
 class ProjectResponse(BaseModel):
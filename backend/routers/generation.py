@@ -4,21 +4,51 @@ Generation Router - 对话式创作生成接口
 提供智能体驱动的流式对话生成功能
 """
 
-import json
 from typing import List, Dict, Any, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 from services.llm_service import LLMFactory
-from services.project_service import get_project_by_id
+from services.resilience import CircuitOpenError
+from services.rate_limit import RateLimitExceeded
+from services.sse_framer import sse_framer, encode_json_event
+from services.stream_monitor import stream_monitor
+from services.stream_resume import resumable_streams, parse_last_event_id, StreamGone
+from services.context_window import context_manager
+from services.prompt_cache import prompt_cache, build_system_segments
+from services.usage import UsageScope
+from services.tracing import tracer
 from constants.agents import get_agent_config, get_all_agents, AgentType
 
 
 router = APIRouter(prefix="/api/generate", tags=["Generation"])
 
+# 预编码的完成事件
+DONE_EVENT = encode_json_event({"done": True})
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",  # 禁用nginx缓冲
+}
+
+
+def encode_content_event(text: str) -> bytes:
+    """编码内容分片事件"""
+    return encode_json_event({"content": text})
+
+
+def sse_response(body, stream_id: Optional[str] = None) -> StreamingResponse:
+    """构建 SSE 流式响应，可续传的流通过 X-Stream-ID 返回流ID"""
+    headers = dict(SSE_HEADERS)
+    if stream_id:
+        headers["X-Stream-ID"] = stream_id
+    return StreamingResponse(body, media_type="text/event-stream", headers=headers)
+
 
 # ============== Request/Response Models ==============
 
@@ -44,7 +74,7 @@ class ChatRequest(BaseModel):
     )
     model_type: str = Field(
         default="deepseek",
-        description="LLM模型类型: 'deepseek', 'claude', 'doubao'"
+        description="LLM模型类型: 'deepseek', 'claude', 'doubao', 'auto'（自动路由与故障转移）"
     )
     temperature: Optional[float] = Field(
         default=None,
@@ -62,6 +92,14 @@ class ChatRequest(BaseModel):
         default=True,
         description="是否启用流式输出"
     )
+    cache: Optional[bool] = Field(
+        default=None,
+        description="响应缓存开关：true 启用，false 关闭，不设置则仅缓存 temperature 为 0 的请求"
+    )
+    resumable: Optional[bool] = Field(
+        default=None,
+        description="流式输出是否可断线续传，不设置则使用 STREAM_RESUME_ENABLED（默认关闭）"
+    )
     
     model_config = {
         "json_schema_extra": {
@@ -86,6 +124,7 @@ class ChatResponse(BaseModel):
     content: str = Field(..., description="生成的内容")
     agent_type: str = Field(..., description="使用的智能体类型")
     model_type: str = Field(..., description="使用的模型类型")
+    usage: Optional[Dict[str, Any]] = Field(default=None, description="tokens 用量与耗时（命中响应缓存时为空）")
 
 
 class AgentInfo(BaseModel):
@@ -104,53 +143,6 @@ class AgentListResponse(BaseModel):
 
 # ============== Helper Functions ==============
 
-def build_ip_persona_prompt(project) -> str:
-    """
-    从项目信息构建IP人设提示词
-    
-    Args:
-        project: 项目对象
-        
-    Returns:
-        IP人设提示词字符串
-    """
-    if not project:
-        return ""
-    
-    persona = project.persona_settings
-    parts = []
-    
-    parts.append(f"【IP信息】")
-    parts.append(f"- IP名称：{project.name}")
-    parts.append(f"- 所属赛道：{project.industry}")
-    
-    if persona.introduction:
-        parts.append(f"- IP简介：{persona.introduction}")
-    
-    if persona.tone:
-        parts.append(f"- 语气风格：{persona.tone}")
-    
-    if persona.target_audience:
-        parts.append(f"- 目标受众：{persona.target_audience}")
-    
-    if persona.content_style:
-        parts.append(f"- 内容风格：{persona.content_style}")
-    
-    if persona.catchphrase:
-        parts.append(f"- 常用口头禅：{persona.catchphrase}")
-    
-    if persona.keywords:
-        parts.append(f"- 常用关键词：{', '.join(persona.keywords)}")
-    
-    if persona.taboos:
-        parts.append(f"- 内容禁忌：{', '.join(persona.taboos)}")
-    
-    if persona.benchmark_accounts:
-        parts.append(f"- 对标账号：{', '.join(persona.benchmark_accounts)}")
-    
-    return "\n".join(parts)
-
-
 def build_final_system_prompt(
     agent_system_prompt: str,
     ip_persona_prompt: str,
@@ -165,63 +157,31 @@ def build_final_system_prompt(
     Returns:
         融合后的最终系统提示词
     """
-    parts = [agent_system_prompt]
-    
-    if ip_persona_prompt:
-        parts.append("\n\n" + "=" * 40)
-        parts.append("\n在创作时，请严格遵循以下IP人设设定，确保内容符合该IP的风格特点：\n")
-        parts.append(ip_persona_prompt)
-        parts.append("\n" + "=" * 40)
-        parts.append("\n请在保持智能体专业能力的同时，融入以上IP的人设特点进行创作。")
-    
-    return "".join(parts)
+    return "".join(build_system_segments(agent_system_prompt, ip_persona_prompt))
 
 
-def format_messages_for_llm(messages: List[ChatMessage]) -> str:
-    """
-    将消息列表格式化为用于LLM的prompt
-    
-    Args:
-        messages: 消息列表
-        
-    Returns:
-        格式化后的prompt字符串
+def build_chat_turns(messages: List[ChatMessage]) -> List[Dict[str, str]]:
     """
-    # 返回最后一条用户消息作为prompt
-    # 历史消息将作为上下文添加到system prompt中
-    for msg in reversed(messages):
-        if msg.role == "user":
-            return msg.content
+    将消息列表转换为LLM原生多轮对话消息
     
-    return messages[-1].content if messages else ""
-
-
-def build_conversation_context(messages: List[ChatMessage]) -> str:
-    """
-    构建对话上下文，用于多轮对话
+    对话历史按原样逐轮发送，system prompt 中不包含历史，保持请求前缀稳定，
+    便于命中 DeepSeek 上下文缓存和 Anthropic 提示词缓存。
+    末尾的非用户消息会被去掉，保证最后一轮是用户的最新请求。
     
     Args:
         messages: 消息列表
         
     Returns:
-        对话上下文字符串
+        [{"role": "user" | "assistant", "content": "..."}]，无用户消息时为空列表
     """
-    if len(messages) <= 1:
-        return ""
-    
-    # 只取最近的历史消息（不包括最后一条）
-    history = messages[:-1]
-    if not history:
-        return ""
-    
-    context_parts = ["\n【对话历史】"]
-    for msg in history[-6:]:  # 最多保留最近6条历史记录
-        role_name = "用户" if msg.role == "user" else "助手"
-        context_parts.append(f"{role_name}：{msg.content}")
-    
-    context_parts.append("\n请基于以上对话历史，继续回复用户的最新请求。")
-    
-    return "\n".join(context_parts)
+    turns = [
+        {"role": msg.role, "content": msg.content}
+        for msg in messages
+        if msg.role in ("user", "assistant") and msg.content
+    ]
+    while turns and turns[-1]["role"] != "user":
+        turns.pop()
+    return turns
 
 
 # ============== API Endpoints ==============
@@ -241,7 +201,7 @@ async def list_agents():
 
 
 @router.post("/chat")
-async def generate_chat(request: ChatRequest):
+async def generate_chat(request: ChatRequest, http_request: Request):
     """
     对话式创作接口
     
@@ -250,7 +210,7 @@ async def generate_chat(request: ChatRequest):
     **工作流程**:
     1. 根据 project_id 获取IP人设信息
     2. 根据 agent_type 获取智能体基础System Prompt
-    3. 融合 "IP画像" + "智能体人设" + "对话历史"
+    3. 融合 "IP画像" + "智能体人设"，对话历史以原生多轮消息发送
     4. 调用LLM进行生成
     
     **参数说明**:
@@ -259,6 +219,73 @@ async def generate_chat(request: ChatRequest):
     - **messages**: 对话历史消息列表
     - **model_type**: LLM模型类型
     - **stream**: 是否启用流式输出（默认true）
+    - **cache**: 是否使用响应缓存（流式请求命中时按原SSE格式回放）
+    - **resumable**: 流式输出是否可断线续传
+    
+    **断线续传**: 可续传的流式事件带有 `id`（`<stream_id>:<序号>`），断线后携带
+    `Last-Event-ID` 请求头重新请求，会回放缺失的事件并继续接收仍在进行的生成，
+    不会重新调用LLM。所有连接断开超过宽限期后取消上游生成。
+    """
+    last_event_id = http_request.headers.get("last-event-id")
+    if last_event_id and request.stream:
+        try:
+            stream_id, after = parse_last_event_id(last_event_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return resume_chat_stream(stream_id, after, http_request)
+    
+    return await run_chat(request, cache_namespace="chat", http_request=http_request)
+
+
+@router.get("/chat/streams/{stream_id}")
+async def resume_chat(
+    stream_id: str,
+    http_request: Request,
+    after: Optional[int] = Query(default=None, description="已收到的最后事件序号，不设置则从头回放"),
+):
+    """
+    续传对话生成流
+    
+    供 EventSource 等客户端使用：优先读取 `Last-Event-ID` 请求头，其次使用 `after` 参数。
+    流不存在、已过期或所需事件已被淘汰时返回 410。
+    """
+    last_event_id = http_request.headers.get("last-event-id")
+    if last_event_id:
+        try:
+            header_stream_id, after = parse_last_event_id(last_event_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if header_stream_id != stream_id:
+            raise HTTPException(status_code=400, detail="Last-Event-ID 与流ID不匹配")
+    
+    return resume_chat_stream(stream_id, -1 if after is None else after, http_request)
+
+
+def resume_chat_stream(stream_id: str, after: int, http_request: Request) -> StreamingResponse:
+    """
+    订阅已有的生成流，回放序号 after 之后的事件
+    
+    Raises:
+        HTTPException: 流不可续传时返回 410
+    """
+    try:
+        stream = resumable_streams.get(stream_id)
+        body = stream.subscribe(after, sse_framer.heartbeat_interval)
+    except StreamGone as e:
+        raise HTTPException(status_code=410, detail=f"生成流已失效，请重新发起请求: {str(e)}")
+    
+    # 生成的输出和结束原因由创建流时的会话记录，这里只检测本连接是否断开
+    return sse_response(stream_monitor.watch(body, http_request), stream.id)
+
+
+async def run_chat(request: ChatRequest, cache_namespace: str, http_request: Optional[Request] = None):
+    """
+    对话式创作的共享实现
+    
+    Args:
+        request: 对话请求
+        cache_namespace: 响应缓存命名空间（用于按接口关闭缓存和统计）
+        http_request: 原始请求，用于流式输出时检测客户端断开
     """
     try:
         # 1. 验证模型类型
@@ -275,32 +302,25 @@ async def generate_chat(request: ChatRequest):
         except ValueError as e:
             raise HTTPException(status_code=400, detail=str(e))
         
-        # 3. 获取项目IP画像（如果提供了project_id）
-        ip_persona_prompt = ""
+        # 3. 获取编译后的System Prompt（智能体提示词 + 项目IP画像，按项目版本缓存）
+        project_uuid = None
         if request.project_id:
             try:
                 project_uuid = UUID(request.project_id)
-                project = get_project_by_id(project_uuid)
-                if project:
-                    ip_persona_prompt = build_ip_persona_prompt(project)
-                else:
-                    print(f"[Warning] 项目不存在: {request.project_id}")
             except ValueError:
                 print(f"[Warning] 无效的项目ID格式: {request.project_id}")
         
-        # 4. 构建最终System Prompt
-        base_system_prompt = agent_config["system_prompt"]
-        conversation_context = build_conversation_context(request.messages)
-        
-        final_system_prompt = build_final_system_prompt(
-            agent_system_prompt=base_system_prompt + conversation_context,
-            ip_persona_prompt=ip_persona_prompt,
-        )
+        # 4. 最终System Prompt（分段用于提示词缓存断点）
+        with tracer.span("prompt.compile", **{"agent.type": request.agent_type, "project.id": str(project_uuid or "")}) as span:
+            compiled_prompt = await prompt_cache.get_async(request.agent_type, agent_config["system_prompt"], project_uuid)
+            if span is not None:
+                span.set(**{"prompt.tokens": compiled_prompt.tokens, "prompt.segments": len(compiled_prompt.segments)})
+        system_segments = compiled_prompt.segments
         
-        # 5. 获取用户最新消息作为prompt
-        user_prompt = format_messages_for_llm(request.messages)
+        # 5. 构建多轮对话消息（最后一轮为用户最新消息）
+        turns = build_chat_turns(request.messages)
         
-        if not user_prompt:
+        if not turns:
             raise HTTPException(status_code=400, detail="消息列表不能为空")
         
         # 6. 确定生成参数
@@ -308,56 +328,97 @@ async def generate_chat(request: ChatRequest):
         max_tokens = request.max_tokens or agent_config.get("max_tokens", 2048)
         
         # 7. 创建LLM实例
-        llm = LLMFactory.create(request.model_type)
+        with tracer.span("llm.factory.create", **{"llm.model_type": request.model_type}):
+            llm = LLMFactory.create(request.model_type)
+        
+        # 8. 按模型上下文窗口裁剪对话历史
+        turns = context_manager.fit(
+            turns,
+            system_prompt=compiled_prompt.text,
+            system_tokens=compiled_prompt.tokens,
+            context_window=llm.context_window(),
+            max_tokens=max_tokens,
+            label=request.model_type.lower()
+        )
         
-        # 8. 生成响应
+        # 9. 生成响应（用量按项目/智能体/模型汇总）
+        usage_scope = UsageScope(
+            cache_namespace,
+            project_id=str(project_uuid) if project_uuid else None,
+            agent_type=request.agent_type,
+        )
         if request.stream:
             # 流式响应
+            session = stream_monitor.open(cache_namespace, request.model_type)
+            
             async def generate_stream():
                 try:
-                    async for chunk in llm.generate_stream(
-                        prompt=user_prompt,
-                        system_prompt=final_system_prompt,
+                    chunks = session.tap(llm.generate_stream(
+                        prompt="",
+                        messages=turns,
+                        system_prompt=system_segments,
                         temperature=temperature,
-                        max_tokens=max_tokens
-                    ):
-                        # SSE格式输出
-                        yield f"data: {json.dumps({'content': chunk}, ensure_ascii=False)}\n\n"
+                        max_tokens=max_tokens,
+                        cache=request.cache,
+                        cache_namespace=cache_namespace,
+                        usage_scope=usage_scope
+                    ))
+                    # SSE格式输出（按时间窗口/字节数合并分片）
+                    async for frame in sse_framer.frame(chunks, encode_content_event):
+                        yield frame
                     
-                    # 发送完成标记
-                    yield f"data: {json.dumps({'done': True}, ensure_ascii=False)}\n\n"
+                    # 发送完成标记（附带本次用量）
+                    usage = usage_scope.summary()
+                    yield encode_json_event({"done": True, "usage": usage}) if usage else DONE_EVENT
                     
                 except Exception as e:
                     error_msg = f"生成错误: {str(e)}"
-                    yield f"data: {json.dumps({'error': error_msg}, ensure_ascii=False)}\n\n"
+                    yield encode_json_event({'error': error_msg})
             
-            return StreamingResponse(
-                generate_stream(),
-                media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "X-Accel-Buffering": "no",  # 禁用nginx缓冲
-                }
-            )
+            resumable = resumable_streams.enabled if request.resumable is None else request.resumable
+            if resumable:
+                # 生成在后台运行，连接断开后可携带 Last-Event-ID 续传；
+                # 会话记录整次生成，宽限期内无人重连时记为客户端断开
+                def abandon():
+                    session.disconnected = True
+                
+                stream = resumable_streams.create(
+                    stream_monitor.guard(session, generate_stream()),
+                    on_abandon=abandon,
+                    endpoint=cache_namespace,
+                    model_type=request.model_type
+                )
+                body = stream.subscribe(-1, sse_framer.heartbeat_interval)
+                return sse_response(stream_monitor.watch(body, http_request), stream.id)
+            
+            return sse_response(stream_monitor.guard(session, generate_stream(), http_request))
         else:
             # 非流式响应
             content = await llm.generate_text(
-                prompt=user_prompt,
-                system_prompt=final_system_prompt,
+                prompt="",
+                messages=turns,
+                system_prompt=system_segments,
                 temperature=temperature,
-                max_tokens=max_tokens
+                max_tokens=max_tokens,
+                cache=request.cache,
+                cache_namespace=cache_namespace,
+                usage_scope=usage_scope
             )
             
             return ChatResponse(
                 success=True,
                 content=content,
                 agent_type=request.agent_type,
-                model_type=request.model_type
+                model_type=request.model_type,
+                usage=usage_scope.summary()
             )
     
     except HTTPException:
         raise
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"模型服务暂不可用: {str(e)}")
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=f"请求过于频繁，请稍后再试: {str(e)}")
     except Exception as e:
         print(f"[ERROR] Chat generation failed: {str(e)}")
         raise HTTPException(
@@ -372,6 +433,7 @@ async def quick_generate(
     agent_type: str = Query(default=AgentType.EFFICIENT_ORAL, description="智能体类型"),
     project_id: Optional[str] = Query(default=None, description="项目ID"),
     model_type: str = Query(default="deepseek", description="模型类型"),
+    cache: Optional[bool] = Query(default=None, description="是否使用响应缓存"),
 ):
     """
     快速创作接口（简化版）
@@ -382,6 +444,7 @@ async def quick_generate(
     - **agent_type**: 智能体类型
     - **project_id**: 项目ID（可选）
     - **model_type**: 模型类型
+    - **cache**: 是否使用响应缓存
     """
     # 构建请求并调用chat接口
     request = ChatRequest(
@@ -389,8 +452,9 @@ async def quick_generate(
         agent_type=agent_type,
         messages=[ChatMessage(role="user", content=content)],
         model_type=model_type,
-        stream=False
+        stream=False,
+        cache=cache
     )
     
-    return await generate_chat(request)
+    return await run_chat(request, cache_namespace="chat_quick")
 
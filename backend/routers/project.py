@@ -7,6 +7,8 @@ Project Router - 项目管理 API 路由
 from typing import Optional
 from uuid import UUID
 from fastapi import APIRouter, HTTPException, Request, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 
 from models.project import (
     Project,
@@ -14,19 +16,23 @@ from models.project import (
     ProjectUpdate,
     ProjectSwitchRequest,
     ProjectListResponse,
+    ProjectFieldsListResponse,
     ProjectResponse,
     PersonaSettings,
     INDUSTRY_OPTIONS,
     TONE_OPTIONS
 )
 from services.project_service import (
-    get_projects_by_user,
-    get_project_by_id,
-    create_project,
-    update_project,
-    delete_project,
-    get_active_project,
-    set_active_project
+    ProjectNotFound,
+    ProjectForbidden,
+    get_projects_with_active_async,
+    get_projects_page_async,
+    get_project_by_id_async,
+    create_project_async,
+    update_owned_project_async,
+    delete_owned_project_async,
+    get_active_project_detail_async,
+    activate_owned_project_async
 )
 
 
@@ -51,21 +57,47 @@ def get_user_id_from_request(request: Request) -> str:
 
 
 @router.get("", response_model=ProjectListResponse)
-async def list_projects(request: Request):
+async def list_projects(
+    request: Request,
+    limit: Optional[int] = Query(default=None, ge=1, le=200, description="每页条数，不传时返回全部项目"),
+    cursor: Optional[str] = Query(default=None, description="上一页返回的 next_cursor"),
+    fields: Optional[str] = Query(
+        default=None,
+        description="返回字段：summary（不含人设配置）或逗号分隔的字段名，如 id,name,updated_at"
+    )
+):
     """
-    获取当前用户的所有项目列表
+    获取当前用户的项目列表
     
-    按最后修改时间倒序排列
+    按最后修改时间倒序排列；传入 limit 时按 (updated_at, id) 游标分页，
+    传入 fields 时只返回所选字段（不选 persona_settings 时不解析人设配置），
+    响应格式为 ProjectFieldsListResponse
     """
     user_id = get_user_id_from_request(request)
     
-    projects = get_projects_by_user(user_id)
-    active_project_id = get_active_project(user_id)
+    next_cursor = None
+    if limit is None and cursor is None and fields is None:
+        projects, active_project_id = await get_projects_with_active_async(user_id)
+    else:
+        try:
+            projects, next_cursor, active_project_id = await get_projects_page_async(user_id, limit, cursor, fields)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    if fields is not None:
+        # 投影结果不经过 ProjectListResponse 校验（否则会被补全为完整项目）
+        return JSONResponse(jsonable_encoder(ProjectFieldsListResponse(
+            success=True,
+            projects=projects,
+            active_project_id=active_project_id,
+            next_cursor=next_cursor
+        )))
     
     return ProjectListResponse(
         success=True,
         projects=projects,
-        active_project_id=active_project_id
+        active_project_id=active_project_id,
+        next_cursor=next_cursor
     )
 
 
@@ -81,7 +113,7 @@ async def create_new_project(request: Request, data: ProjectCreate):
     user_id = get_user_id_from_request(request)
     
     try:
-        project = create_project(user_id, data)
+        project = await create_project_async(user_id, data)
         return ProjectResponse(success=True, project=project)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"创建项目失败: {str(e)}")
@@ -94,11 +126,10 @@ async def get_active_project_info(request: Request):
     """
     user_id = get_user_id_from_request(request)
     
-    active_id = get_active_project(user_id)
+    active_id, project = await get_active_project_detail_async(user_id)
     if not active_id:
         raise HTTPException(status_code=404, detail="没有激活的项目")
     
-    project = get_project_by_id(active_id)
     if not project:
         raise HTTPException(status_code=404, detail="激活的项目不存在")
     
@@ -114,17 +145,14 @@ async def switch_project(request: Request, data: ProjectSwitchRequest):
     """
     user_id = get_user_id_from_request(request)
     
-    # 验证项目是否存在
-    project = get_project_by_id(data.project_id)
-    if not project:
+    # 验证项目存在且属于当前用户（与切换在同一条语句中完成）
+    try:
+        project = await activate_owned_project_async(user_id, data.project_id)
+    except ProjectNotFound:
         raise HTTPException(status_code=404, detail="项目不存在")
-    
-    # 验证项目属于当前用户
-    if project.user_id != user_id:
+    except ProjectForbidden:
         raise HTTPException(status_code=403, detail="无权访问此项目")
     
-    set_active_project(user_id, data.project_id)
-    
     return {
         "success": True,
         "message": f"已切换到项目: {project.name}",
@@ -153,7 +181,7 @@ async def get_project(request: Request, project_id: UUID):
     """
     user_id = get_user_id_from_request(request)
     
-    project = get_project_by_id(project_id)
+    project = await get_project_by_id_async(project_id)
     if not project:
         raise HTTPException(status_code=404, detail="项目不存在")
     
@@ -171,18 +199,14 @@ async def update_project_info(request: Request, project_id: UUID, data: ProjectU
     """
     user_id = get_user_id_from_request(request)
     
-    # 验证项目存在且属于当前用户
-    existing = get_project_by_id(project_id)
-    if not existing:
+    # 验证项目存在且属于当前用户（与更新在同一条语句中完成）
+    try:
+        project = await update_owned_project_async(project_id, user_id, data)
+    except ProjectNotFound:
         raise HTTPException(status_code=404, detail="项目不存在")
-    
-    if existing.user_id != user_id:
+    except ProjectForbidden:
         raise HTTPException(status_code=403, detail="无权修改此项目")
     
-    project = update_project(project_id, data)
-    if not project:
-        raise HTTPException(status_code=500, detail="更新项目失败")
-    
     return ProjectResponse(success=True, project=project)
 
 
@@ -193,19 +217,17 @@ async def delete_project_by_id(request: Request, project_id: UUID):
     """
     user_id = get_user_id_from_request(request)
     
-    # 验证项目存在且属于当前用户
-    existing = get_project_by_id(project_id)
-    if not existing:
+    # 验证项目存在且属于当前用户（与删除在同一条语句中完成）
+    try:
+        await delete_owned_project_async(project_id, user_id)
+    except ProjectNotFound:
         raise HTTPException(status_code=404, detail="项目不存在")
-    
-    if existing.user_id != user_id:
+    except ProjectForbidden:
         raise HTTPException(status_code=403, detail="无权删除此项目")
     
-    success = delete_project(project_id)
-    
     return {
-        "success": success,
-        "message": "项目已删除" if success else "删除失败"
+        "success": True,
+        "message": "项目已删除"
     }
 
 
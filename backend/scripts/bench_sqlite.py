@@ -0,0 +1,185 @@
+"""
+项目数据库并发基准测试
+
+在临时数据库上模拟并发的 /api/projects 读写（默认 90% 读、10% 写），对比：
+- legacy: 原实现（每次调用新建连接、rollback journal、synchronous=FULL，
+  在事件循环中同步执行）
+- legacy-threads: 原实现的连接方式放到线程中并发执行（相当于多个 worker 同时访问，
+  用于观察 "database is locked"）
+- pooled: services.database（连接池 + WAL + 调优 pragma，读走数据库线程池，
+  写走单写线程队列并合并事务）
+
+读操作为 get_project_by_id / get_projects_by_user，写操作为 set_active_project / update_project。
+
+运行：
+    cd backend
+    python scripts/bench_sqlite.py
+    python scripts/bench_sqlite.py --clients 64 --ops 200 --write-ratio 0.3
+"""
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from models.project import ProjectCreate, ProjectUpdate, PersonaSettings  # noqa: E402
+from services import project_service  # noqa: E402
+from services.database import Database  # noqa: E402
+
+
+def seed(path: str, users: int, projects_per_user: int, journal_mode: str) -> List[Tuple[str, str]]:
+    """创建表并写入测试数据，返回 (user_id, project_id) 列表"""
+    database = Database(path, pool_size=1, journal_mode=journal_mode)
+    try:
+        project_service.init_db(database)
+        persona = PersonaSettings(introduction="专注家常菜的美食博主", tone="亲切", keywords=["家常菜", "快手菜"])
+        pairs = []
+        with database.connection() as conn:
+            for user in range(users):
+                user_id = f"user_{user}"
+                for index in range(projects_per_user):
+                    project = project_service.new_project(
+                        user_id, ProjectCreate(name=f"项目{index}", industry="美食", persona_settings=persona)
+                    )
+                    project_service._insert_project(conn, project)
+                    pairs.append((user_id, str(project.id)))
+        return pairs
+    finally:
+        database.close()
+
+
+def legacy_call(path: str, func: Callable, *args):
+    """原实现：每次调用新建连接，默认 pragma，执行后提交并关闭"""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        result = func(conn, *args)
+        conn.commit()
+        return result
+    finally:
+        conn.close()
+
+
+def make_ops(pairs: List[Tuple[str, str]], count: int, write_ratio: float, seed_value: int):
+    from uuid import UUID
+    rng = random.Random(seed_value)
+    ops = []
+    for _ in range(count):
+        user_id, project_id = rng.choice(pairs)
+        project_uuid = UUID(project_id)
+        if rng.random() < write_ratio:
+            if rng.random() < 0.5:
+                ops.append(("write", project_service._upsert_active_project, (user_id, project_uuid)))
+            else:
+                update = ProjectUpdate(industry=rng.choice(["美食", "旅行", "科技"]))
+                ops.append(("write", project_service._update_project, (project_uuid, update)))
+        elif rng.random() < 0.7:
+            ops.append(("read", project_service._select_project, (project_uuid,)))
+        else:
+            ops.append(("read", project_service._select_projects_by_user, (user_id,)))
+    return ops
+
+
+class Result:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {"read": [], "write": []}
+        self.errors: Dict[str, int] = {}
+
+    def error(self, e: Exception) -> None:
+        key = str(e).split(":")[0][:40]
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+
+async def run_mode(mode: str, path: str, pairs, clients: int, ops_per_client: int, write_ratio: float) -> Tuple[Result, float]:
+    result = Result()
+    database = Database(path, pool_size=4) if mode == "pooled" else None
+    threads = ThreadPoolExecutor(max_workers=clients) if mode == "legacy-threads" else None
+    loop = asyncio.get_running_loop()
+
+    async def client(index: int) -> None:
+        for kind, func, args in make_ops(pairs, ops_per_client, write_ratio, index):
+            started = time.perf_counter()
+            try:
+                if mode == "pooled":
+                    if kind == "write":
+                        await database.write(func, *args)
+                    else:
+                        await database.run(func, *args)
+                elif mode == "legacy-threads":
+                    await loop.run_in_executor(threads, legacy_call, path, func, *args)
+                else:
+                    legacy_call(path, func, *args)
+                    await asyncio.sleep(0)
+            except Exception as e:
+                result.error(e)
+                continue
+            result.latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(index) for index in range(clients)))
+    elapsed = time.perf_counter() - started
+    if database is not None:
+        batches = database.snapshot()
+        await database.aclose()
+        print(f"  pooled write batches: {batches['write_batches']}, avg {batches['avg_write_batch']}, max {batches['max_write_batch']}")
+    if threads is not None:
+        threads.shutdown()
+    return result, elapsed
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+async def main(args) -> None:
+    modes = ("legacy", "legacy-threads", "pooled")
+    print(
+        f"clients: {args.clients}, ops per client: {args.ops}, write ratio: {args.write_ratio}, "
+        f"projects: {args.users * args.projects}\n"
+    )
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in modes:
+            path = os.path.join(tmp, f"{mode}.db")
+            # 原实现未设置任何 pragma：rollback journal + synchronous=FULL
+            pairs = seed(path, args.users, args.projects, "DELETE" if mode.startswith("legacy") else "WAL")
+            print(f"[{mode}]")
+            result, elapsed = await run_mode(mode, path, pairs, args.clients, args.ops, args.write_ratio)
+            rows.append((mode, result, elapsed))
+
+    print()
+    print(
+        f"{'mode':<16}{'reads/s':>10}{'writes/s':>10}{'read p50':>10}{'read p99':>10}"
+        f"{'write p50':>11}{'write p99':>11}{'errors':>8}"
+    )
+    for mode, result, elapsed in rows:
+        reads, writes = result.latencies["read"], result.latencies["write"]
+        print(
+            f"{mode:<16}{len(reads) / elapsed:>10.0f}{len(writes) / elapsed:>10.0f}"
+            f"{percentile(reads, 0.5):>8.2f}ms{percentile(reads, 0.99):>8.2f}ms"
+            f"{percentile(writes, 0.5):>9.2f}ms{percentile(writes, 0.99):>9.2f}ms"
+            f"{sum(result.errors.values()):>8}"
+        )
+        for error, count in result.errors.items():
+            print(f"  {error}: {count}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="projects.db concurrency benchmark")
+    parser.add_argument("--clients", type=int, default=32, help="并发客户端数")
+    parser.add_argument("--ops", type=int, default=100, help="每个客户端的操作数")
+    parser.add_argument("--write-ratio", type=float, default=0.1, help="写操作比例")
+    parser.add_argument("--users", type=int, default=50, help="用户数")
+    parser.add_argument("--projects", type=int, default=10, help="每个用户的项目数")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,164 @@
+"""
+SSE 解析微基准测试
+
+对比上游流式响应的两种解析方式：
+- legacy: response.aiter_lines() + startswith("data: ") + json.loads（原实现）
+- decoder: response.aiter_bytes() + SSEDecoder + json_loads（orjson 可用时使用 orjson）
+
+流数据为按 DeepSeek（OpenAI 兼容）和 Anthropic Messages 格式录制结构生成的样本，
+并按随机大小切分为字节块以模拟网络分包（包括在中文字符中间切断）。
+
+运行：
+    cd backend
+    python scripts/bench_sse.py
+    python scripts/bench_sse.py --tokens 4000 --rounds 50
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Callable, List
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.sse import JSON_BACKEND, SSEDecoder, json_loads  # noqa: E402
+
+
+SAMPLE_TEXT = "开头三秒决定完播率，先抛出反常识观点，再用真实案例建立信任，最后给出可执行的行动建议。"
+
+
+def _pieces(tokens: int) -> List[str]:
+    rng = random.Random(7)
+    pieces = []
+    for _ in range(tokens):
+        start = rng.randrange(len(SAMPLE_TEXT))
+        pieces.append(SAMPLE_TEXT[start:start + rng.randint(1, 3)] or "。")
+    return pieces
+
+
+def deepseek_stream(tokens: int) -> bytes:
+    """DeepSeek /chat/completions 流式响应"""
+    lines = []
+    for piece in _pieces(tokens):
+        chunk = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 1718000000,
+            "model": "deepseek-chat",
+            "choices": [{"index": 0, "delta": {"content": piece}, "logprobs": None, "finish_reason": None}],
+        }
+        lines.append("data: " + json.dumps(chunk, ensure_ascii=False) + "\n\n")
+    lines.append("data: [DONE]\n\n")
+    return "".join(lines).encode("utf-8")
+
+
+def anthropic_stream(tokens: int) -> bytes:
+    """Anthropic Messages API 流式响应（含 event 行和 ping 事件）"""
+    events = [
+        ("message_start", {"type": "message_start", "message": {"id": "msg_bench", "role": "assistant", "content": []}}),
+        ("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}),
+        ("ping", {"type": "ping"}),
+    ]
+    for piece in _pieces(tokens):
+        events.append(("content_block_delta", {
+            "type": "content_block_delta",
+            "index": 0,
+            "delta": {"type": "text_delta", "text": piece},
+        }))
+    events.append(("content_block_stop", {"type": "content_block_stop", "index": 0}))
+    events.append(("message_stop", {"type": "message_stop"}))
+    body = "".join(
+        f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n" for name, data in events
+    )
+    return body.encode("utf-8")
+
+
+def split_chunks(body: bytes, seed: int = 42) -> List[bytes]:
+    """按 200B-4KB 的随机大小切分，模拟网络分包"""
+    rng = random.Random(seed)
+    chunks, pos = [], 0
+    while pos < len(body):
+        size = rng.randint(200, 4096)
+        chunks.append(body[pos:pos + size])
+        pos += size
+    return chunks
+
+
+class _Body(httpx.AsyncByteStream):
+    def __init__(self, chunks: List[bytes]):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def make_response(chunks: List[bytes]) -> httpx.Response:
+    return httpx.Response(200, stream=_Body(chunks))
+
+
+async def parse_legacy(response: httpx.Response) -> int:
+    count = 0
+    async for line in response.aiter_lines():
+        if line.startswith("data: "):
+            data_str = line[6:]
+            if data_str == "[DONE]":
+                break
+            try:
+                json.loads(data_str)
+                count += 1
+            except json.JSONDecodeError:
+                continue
+    return count
+
+
+async def parse_decoder(response: httpx.Response) -> int:
+    count = 0
+    decoder = SSEDecoder()
+    async for chunk in response.aiter_bytes():
+        for event in decoder.feed(chunk):
+            if event.data == "[DONE]":
+                return count
+            json_loads(event.data)
+            count += 1
+    return count
+
+
+async def bench(parser: Callable, chunks: List[bytes], rounds: int) -> float:
+    """返回每轮平均耗时（毫秒）"""
+    await parser(make_response(chunks))  # 预热
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await parser(make_response(chunks))
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+async def main(tokens: int, rounds: int) -> None:
+    print(f"JSON backend: {JSON_BACKEND}, tokens per stream: {tokens}, rounds: {rounds}\n")
+    print(f"{'stream':<12}{'size':>10}{'events':>8}{'legacy ms':>12}{'decoder ms':>12}{'speedup':>9}")
+    for name, body in (("deepseek", deepseek_stream(tokens)), ("anthropic", anthropic_stream(tokens))):
+        chunks = split_chunks(body)
+        legacy_events = await parse_legacy(make_response(chunks))
+        decoder_events = await parse_decoder(make_response(chunks))
+        legacy = await bench(parse_legacy, chunks, rounds)
+        decoder = await bench(parse_decoder, chunks, rounds)
+        print(
+            f"{name:<12}{len(body) // 1024:>8}KB{decoder_events:>8}"
+            f"{legacy:>12.2f}{decoder:>12.2f}{legacy / decoder:>8.2f}x"
+        )
+        if legacy_events != decoder_events:
+            print(f"  [Warning] event count mismatch: legacy={legacy_events}, decoder={decoder_events}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SSE parser micro-benchmark")
+    parser.add_argument("--tokens", type=int, default=2000, help="每个流的分片数")
+    parser.add_argument("--rounds", type=int, default=30, help="每种解析方式的测试轮数")
+    args = parser.parse_args()
+    asyncio.run(main(args.tokens, args.rounds))
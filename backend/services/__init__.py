@@ -1,6 +1,6 @@
 # Services package
-from .llm_service import LLMFactory, BaseLLM, DeepSeekLLM, DoubaoLLM
+from .llm_service import LLMFactory, BaseLLM, OpenAICompatibleLLM, DeepSeekLLM, DoubaoLLM
 
-__all__ = ["LLMFactory", "BaseLLM", "DeepSeekLLM", "DoubaoLLM"]
+__all__ = ["LLMFactory", "BaseLLM", "OpenAICompatibleLLM", "DeepSeekLLM", "DoubaoLLM"]
 
 
@@ -0,0 +1,235 @@
+"""
+Request Coalescing - 相同并发请求合并（single-flight）
+
+活动期间大量用户会在几秒内用相同的智能体和主题发起请求。
+本模块让并发的相同请求共享同一次上游调用：
+- 非流式：所有调用方等待同一个 Task 的结果
+- 流式：由一个上游读取任务分发给多个订阅者，每个订阅者拥有独立缓冲区，
+  后加入的订阅者会先收到已生成的分片
+
+请求完成后立即移出合并表，之后的相同请求会重新调用上游（结果复用交给响应缓存）。
+
+合并键不含用量归属：跟随者的 UsageScope 登记到领头请求的 UsageScope.followers，
+上游调用结束时领头调用的用量会在每个跟随者的 scope 中各记录一份（标记为 coalesced），
+中途离开的跟随者不再记录。
+"""
+
+import asyncio
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Set
+
+from services.usage import UsageScope
+
+from services.settings import env_flag
+
+
+# 流结束标记
+_END = object()
+
+
+class _TextFlight:
+    """一次进行中的非流式上游调用"""
+
+    def __init__(self, task: asyncio.Task, scope: Optional[UsageScope]):
+        self.task = task
+        self.scope = scope
+        self.waiters = 0
+
+
+class _StreamFlight:
+    """一次进行中的流式上游调用，负责向所有订阅者分发分片"""
+
+    def __init__(
+        self,
+        coalescer: "RequestCoalescer",
+        key: str,
+        source: AsyncGenerator[str, None],
+        scope: Optional[UsageScope],
+    ):
+        self.coalescer = coalescer
+        self.key = key
+        self.scope = scope
+        self.chunks: List[str] = []
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncGenerator[str, None]) -> None:
+        """读取上游流并写入每个订阅者的缓冲区"""
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                for queue in self.subscribers:
+                    queue.put_nowait(chunk)
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            for queue in self.subscribers:
+                queue.put_nowait(_END)
+            self.coalescer._release_stream(self)
+
+    def subscribe(self) -> asyncio.Queue:
+        """新增订阅者，先补齐已生成的分片"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for chunk in self.chunks:
+            queue.put_nowait(chunk)
+        if self.done:
+            queue.put_nowait(_END)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        """移除订阅者；没有订阅者时取消上游读取，释放连接"""
+        self.subscribers.discard(queue)
+        if not self.subscribers and not self.done:
+            self.task.cancel()
+
+
+class RequestCoalescer:
+    """
+    相同请求合并器
+
+    配置（环境变量）：
+        LLM_COALESCE_ENABLED: 是否启用请求合并，默认 true
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._texts: Dict[str, _TextFlight] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+        self._stats = {"leaders": 0, "followers": 0}
+
+    @classmethod
+    def from_env(cls) -> "RequestCoalescer":
+        """从环境变量构建合并器"""
+        return cls(enabled=env_flag("LLM_COALESCE_ENABLED", True))
+
+    async def run(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Any]],
+        scope: Optional[UsageScope] = None,
+    ) -> Any:
+        """
+        合并执行非流式调用
+
+        Args:
+            key: 请求键，相同键的并发调用共享结果
+            factory: 发起上游调用的协程工厂，仅由第一个调用方执行
+            scope: 调用方的用量归属，作为跟随者时共享领头调用的用量
+
+        Returns:
+            上游调用结果
+        """
+        if not self.enabled:
+            return await factory()
+
+        flight = self._texts.get(key)
+        if flight is not None and flight.task.done():
+            # 已完成、等待移出合并表：用量已记录，不再跟随
+            flight = None
+        following = flight is not None and self._follow(flight.scope, scope)
+        if flight is None:
+            task = asyncio.ensure_future(factory())
+            flight = self._texts[key] = _TextFlight(task, scope)
+            task.add_done_callback(lambda _: self._release_text(key, flight))
+            self._stats["leaders"] += 1
+        else:
+            self._stats["followers"] += 1
+
+        flight.waiters += 1
+        try:
+            # shield: 单个调用方取消（如客户端断开）不影响其它等待者
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if following and not flight.task.done():
+                self._unfollow(flight.scope, scope)
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    async def stream(
+        self,
+        key: str,
+        factory: Callable[[], AsyncGenerator[str, None]],
+        scope: Optional[UsageScope] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        合并执行流式调用
+
+        Args:
+            key: 请求键
+            factory: 返回上游异步生成器的工厂，仅由第一个订阅者触发
+            scope: 调用方的用量归属，作为跟随者时共享领头调用的用量
+
+        Yields:
+            文本分片
+        """
+        if not self.enabled:
+            async for chunk in factory():
+                yield chunk
+            return
+
+        flight = self._streams.get(key)
+        following = flight is not None and self._follow(flight.scope, scope)
+        if flight is None:
+            flight = self._streams[key] = _StreamFlight(self, key, factory(), scope)
+            self._stats["leaders"] += 1
+        else:
+            self._stats["followers"] += 1
+
+        queue = flight.subscribe()
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    break
+                yield item
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            if following and not flight.done:
+                self._unfollow(flight.scope, scope)
+            flight.unsubscribe(queue)
+
+    @staticmethod
+    def _follow(leader: Optional[UsageScope], scope: Optional[UsageScope]) -> bool:
+        """将跟随者的 scope 登记到领头请求的 scope"""
+        if leader is None or scope is None or scope is leader:
+            return False
+        leader.followers.append(scope)
+        return True
+
+    @staticmethod
+    def _unfollow(leader: UsageScope, scope: UsageScope) -> None:
+        if scope in leader.followers:
+            leader.followers.remove(scope)
+
+    def _release_text(self, key: str, flight: _TextFlight) -> None:
+        if self._texts.get(key) is flight:
+            del self._texts[key]
+        if flight.scope is not None:
+            flight.scope.followers.clear()
+
+    def _release_stream(self, flight: _StreamFlight) -> None:
+        if self._streams.get(flight.key) is flight:
+            del self._streams[flight.key]
+        if flight.scope is not None:
+            flight.scope.followers.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """返回合并统计"""
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._texts) + len(self._streams),
+            "leaders": self._stats["leaders"],
+            "followers": self._stats["followers"],
+        }
+
+
+# 进程级单例
+request_coalescer = RequestCoalescer.from_env()
@@ -0,0 +1,254 @@
+"""
+Context Window - 按模型上下文窗口裁剪对话历史
+
+按 tokens 而不是消息条数控制历史长度：
+- 用本地 CJK 感知的估算（与限流共用 estimate_tokens）计算每条消息的 tokens
+- 预算 = 模型上下文窗口 × (1 - 安全余量) - max_tokens - system prompt，
+  可再用 LLM_CONTEXT_HISTORY_MAX_TOKENS 限制每轮历史成本
+- 超出预算时从最早的消息开始丢弃；按 LLM_CONTEXT_DROP_STEP 条对齐丢弃位置，
+  使后续几轮的请求前缀保持不变，便于命中上游前缀缓存
+- 被丢弃的消息压缩为一条摘要（截取每条消息开头，不额外调用模型），
+  并入保留的第一条用户消息，不产生连续的两条用户消息
+- 每次裁剪都会记录日志，并按模型汇总统计
+
+配置（环境变量）：
+    DEEPSEEK_CONTEXT_WINDOW / CLAUDE_CONTEXT_WINDOW / ...: 覆盖模型上下文窗口（tokens）
+    LLM_CONTEXT_SAFETY_MARGIN: 估算误差安全余量，默认 0.1
+    LLM_CONTEXT_HISTORY_MAX_TOKENS: 历史消息 tokens 上限，0 表示仅受上下文窗口限制
+    LLM_CONTEXT_STRATEGY: summarize（默认）或 drop
+    LLM_CONTEXT_SUMMARY_TOKENS: 摘要最大 tokens，默认 300
+    LLM_CONTEXT_DROP_STEP: 丢弃消息的对齐步长，默认 4，1 表示逐条丢弃
+    LLM_CONTEXT_LOG_ALL: 为 true 时未裁剪的请求也记录日志
+"""
+
+import re
+from typing import Any, Dict, List, Optional
+
+from services.settings import env_float, env_int, env_flag, env_str
+from services.rate_limit import estimate_tokens
+
+
+# 每条消息的格式开销（角色标记等）
+MESSAGE_OVERHEAD = 4
+
+DEFAULT_CONTEXT_WINDOW = 32000
+
+# 按模型名称匹配的上下文窗口（先匹配先生效）
+MODEL_CONTEXT_WINDOWS = [
+    ("deepseek", 64000),
+    ("claude", 200000),
+    ("gpt-4o", 128000),
+    ("gpt-4", 8192),
+    ("qwen", 32000),
+]
+
+# 提供商默认值（模型名称无法识别时使用，例如豆包接入点 ID）
+PROVIDER_CONTEXT_WINDOWS = {
+    "deepseek": 64000,
+    "claude": 200000,
+    "doubao": 32000,
+}
+
+SUMMARY_HEADER = "【较早的对话摘要】"
+SUMMARY_SNIPPET_CHARS = 40
+
+
+def context_window_for(provider: str, model: Optional[str]) -> int:
+    """
+    解析模型的上下文窗口（tokens）
+
+    优先级：{PROVIDER}_CONTEXT_WINDOW 环境变量 > 模型名称中的 "-32k" 等后缀 >
+    模型名称表 > 提供商默认值 > 32000
+    """
+    configured = env_int(f"{provider.upper()}_CONTEXT_WINDOW", 0)
+    if configured > 0:
+        return configured
+    name = (model or "").lower()
+    match = re.search(r"(\d+)k\b", name)
+    if match:
+        return int(match.group(1)) * 1000
+    for prefix, window in MODEL_CONTEXT_WINDOWS:
+        if prefix in name:
+            return window
+    return PROVIDER_CONTEXT_WINDOWS.get(provider, DEFAULT_CONTEXT_WINDOW)
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    """估算一条消息的 tokens（含格式开销）"""
+    return estimate_tokens(message.get("content")) + MESSAGE_OVERHEAD
+
+
+class ContextWindowManager:
+    """按预算裁剪对话历史并记录裁剪决策"""
+
+    def __init__(
+        self,
+        safety_margin: float = 0.1,
+        history_max_tokens: int = 0,
+        strategy: str = "summarize",
+        summary_tokens: int = 300,
+        drop_step: int = 4,
+        log_all: bool = False,
+    ):
+        self.safety_margin = min(max(safety_margin, 0.0), 0.9)
+        self.history_max_tokens = history_max_tokens
+        self.strategy = strategy
+        self.summary_tokens = summary_tokens
+        self.drop_step = max(1, drop_step)
+        self.log_all = log_all
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    @classmethod
+    def from_env(cls) -> "ContextWindowManager":
+        strategy = env_str("LLM_CONTEXT_STRATEGY", "summarize").lower()
+        if strategy not in ("summarize", "drop"):
+            print(f"[Warning] Unknown LLM_CONTEXT_STRATEGY={strategy!r}, using 'summarize'")
+            strategy = "summarize"
+        return cls(
+            safety_margin=env_float("LLM_CONTEXT_SAFETY_MARGIN", 0.1),
+            history_max_tokens=env_int("LLM_CONTEXT_HISTORY_MAX_TOKENS", 0),
+            strategy=strategy,
+            summary_tokens=env_int("LLM_CONTEXT_SUMMARY_TOKENS", 300),
+            drop_step=env_int("LLM_CONTEXT_DROP_STEP", 4),
+            log_all=env_flag("LLM_CONTEXT_LOG_ALL", False),
+        )
+
+    def budget(
+        self,
+        context_window: int,
+        max_tokens: int,
+        system_prompt: Optional[str],
+        system_tokens: Optional[int] = None,
+    ) -> int:
+        """历史消息（含最新用户消息）可用的 tokens 预算"""
+        if system_tokens is None:
+            system_tokens = estimate_tokens(system_prompt)
+        available = int(context_window * (1 - self.safety_margin)) - max_tokens - system_tokens
+        if self.history_max_tokens > 0:
+            available = min(available, self.history_max_tokens)
+        return max(0, available)
+
+    def fit(
+        self,
+        turns: List[Dict[str, str]],
+        system_prompt: Optional[str],
+        context_window: int,
+        max_tokens: int,
+        label: str = "default",
+        system_tokens: Optional[int] = None,
+    ) -> List[Dict[str, str]]:
+        """
+        将对话消息裁剪到预算内
+
+        最后一条（用户最新消息）始终保留；其余消息从最早的开始丢弃，
+        丢弃的消息按策略压缩为摘要放在最前面：第一条保留的消息是用户消息时
+        并入该消息开头，否则作为单独的用户消息，保证 user / assistant 交替。
+
+        Args:
+            turns: user / assistant 消息列表，最后一条为最新用户消息
+            system_prompt: 系统提示词（计入预算）
+            context_window: 模型上下文窗口
+            max_tokens: 本次请求的最大生成 tokens（预留给输出）
+            label: 统计和日志使用的模型标识
+            system_tokens: 预先估算的 system prompt tokens（如编译缓存中的值），为空时现场估算
+
+        Returns:
+            裁剪后的消息列表
+        """
+        budget = self.budget(context_window, max_tokens, system_prompt, system_tokens)
+        costs = [message_tokens(turn) for turn in turns]
+        total = sum(costs)
+        stats = self._stats.setdefault(label, {
+            "requests": 0, "trimmed": 0, "dropped_turns": 0,
+            "history_tokens": 0, "sent_tokens": 0, "summary_tokens": 0,
+        })
+        stats["requests"] += 1
+        stats["history_tokens"] += total
+
+        if total <= budget or len(turns) <= 1:
+            stats["sent_tokens"] += total
+            if total > budget:
+                print(f"[Warning] Context {label}: latest message ~{total} tokens exceeds budget {budget}")
+            elif self.log_all:
+                print(f"[Context] {label}: {len(turns)} turns ~{total} tokens within budget {budget} (window {context_window})")
+            return turns
+
+        # 从最早的消息开始丢弃，丢弃数量按 drop_step 对齐（最新消息不丢弃）
+        summary_reserve = min(self.summary_tokens, budget // 10) if self.strategy == "summarize" else 0
+        suffix = [0] * (len(turns) + 1)
+        for index in range(len(turns) - 1, -1, -1):
+            suffix[index] = suffix[index + 1] + costs[index]
+        drop = len(turns) - 1
+        for candidate in range(self.drop_step, len(turns) - 1, self.drop_step):
+            if suffix[candidate] + summary_reserve <= budget:
+                drop = candidate
+                break
+        else:
+            # 对齐位置都放不下时逐条丢弃
+            for candidate in range(1, len(turns)):
+                if suffix[candidate] + summary_reserve <= budget:
+                    drop = candidate
+                    break
+
+        kept = turns[drop:]
+        sent = suffix[drop]
+        summary_cost = 0
+        if summary_reserve > 0:
+            summary = self._summarize(turns[:drop], summary_reserve)
+            if summary is not None:
+                summary_cost = message_tokens(summary)
+                if kept[0]["role"] == "user":
+                    # 并入时不重复计算消息开销
+                    summary_cost -= MESSAGE_OVERHEAD
+                    kept = [{**kept[0], "content": summary["content"] + "\n\n" + kept[0]["content"]}] + kept[1:]
+                else:
+                    kept = [summary] + kept
+                sent += summary_cost
+
+        stats["trimmed"] += 1
+        stats["dropped_turns"] += drop
+        stats["sent_tokens"] += sent
+        stats["summary_tokens"] += summary_cost
+        print(
+            f"[Context] {label}: history ~{total} tokens > budget {budget} "
+            f"(window {context_window}, max_tokens {max_tokens}); dropped {drop}/{len(turns)} turns, "
+            f"summary ~{summary_cost} tokens, sending ~{sent} tokens"
+        )
+        return kept
+
+    @staticmethod
+    def _summarize(dropped: List[Dict[str, str]], max_tokens: int) -> Optional[Dict[str, str]]:
+        """将被丢弃的消息压缩为摘要（保留最近的消息片段）"""
+        lines: List[str] = []
+        used = estimate_tokens(SUMMARY_HEADER) + MESSAGE_OVERHEAD
+        for turn in reversed(dropped):
+            role = "用户" if turn["role"] == "user" else "助手"
+            text = " ".join(turn["content"].split())
+            if len(text) > SUMMARY_SNIPPET_CHARS:
+                text = text[:SUMMARY_SNIPPET_CHARS] + "…"
+            line = f"{role}：{text}"
+            cost = estimate_tokens(line) + 1
+            if used + cost > max_tokens:
+                break
+            lines.append(line)
+            used += cost
+        if not lines:
+            return None
+        lines.reverse()
+        return {"role": "user", "content": SUMMARY_HEADER + "\n" + "\n".join(lines)}
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """按模型返回裁剪统计"""
+        result = {}
+        for label, stats in self._stats.items():
+            requests = stats["requests"] or 1
+            result[label] = {
+                **stats,
+                "avg_history_tokens": round(stats["history_tokens"] / requests, 1),
+                "avg_sent_tokens": round(stats["sent_tokens"] / requests, 1),
+            }
+        return result
+
+
+# 进程级单例
+context_manager = ContextWindowManager.from_env()
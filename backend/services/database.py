@@ -0,0 +1,396 @@
+"""
+Database - SQLite 连接池、专用数据库线程与单写线程队列
+
+project_service 原先每次调用都在事件循环线程中新建连接、查询、关闭，
+磁盘 I/O 会阻塞事件循环，并且每次都要重新解析 SQL。本模块提供：
+- 固定大小的长连接池，连接在进程生命周期内复用
+- 每个连接的预编译语句缓存（sqlite3 按 SQL 文本缓存已编译的语句，
+  因此查询应使用固定的 SQL 文本和参数占位符）
+- 专用的数据库线程池（线程数与连接数相同），异步代码通过 run() 在其中执行查询，
+  不阻塞事件循环；同步代码通过 connection() 直接借用连接
+- bootstrap() 启用 WAL，读写互不阻塞；每个连接设置 synchronous / cache_size /
+  mmap_size / busy_timeout
+- 异步写操作通过 write() 进入单写线程队列：同一时刻只有一个写事务，
+  排队中的写操作（最多 DB_WRITE_BATCH 个）合并为一个事务提交，
+  每个写操作使用独立的 SAVEPOINT，单个失败不影响同批的其它写操作
+- changed_externally() 基于 PRAGMA data_version 检测其它进程的提交；
+  本进程连接的提交在提交前后记录 data_version，不会被视为外部修改
+
+配置（环境变量）：
+    DB_POOL_SIZE: 连接数（同时也是数据库线程数），默认 4
+    DB_STATEMENT_CACHE: 每个连接缓存的预编译语句数，默认 128
+    DB_POOL_TIMEOUT: 等待空闲连接的超时（秒），默认 30
+    DB_JOURNAL_MODE: 日志模式，默认 WAL
+    DB_SYNCHRONOUS: 同步级别，默认 NORMAL（WAL 下断电最多丢失最近提交，不会损坏数据库）
+    DB_CACHE_SIZE_KB: 每个连接的页缓存（KB），默认 16384
+    DB_MMAP_SIZE_MB: 内存映射读取大小（MB），默认 256，0 表示关闭
+    DB_BUSY_TIMEOUT_MS: 等待其它进程释放锁的时间（毫秒），默认 5000
+    DB_WRITE_BATCH: 单个写事务最多合并的写操作数，默认 64
+"""
+
+import queue
+import sqlite3
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar, Union
+
+from services.settings import env_float, env_int, env_str
+
+
+T = TypeVar("T")
+
+
+class PoolTimeout(Exception):
+    """等待空闲连接超时"""
+
+
+# 写队列中的一项：(func, args, kwargs, future, on_commit)
+_Write = Tuple[Callable[..., Any], tuple, Dict[str, Any], "asyncio.Future", Optional[Callable[[Any], None]]]
+
+
+class Database:
+    """
+    SQLite 连接池 + 专用线程池
+
+    Usage:
+        db = Database.from_env(DB_PATH)
+
+        # 异步：在数据库线程中执行，func 的第一个参数为连接
+        project = await db.run(_get_project_by_id, project_id)
+
+        # 异步写：进入单写线程队列，与排队中的其它写操作合并提交
+        project = await db.write(_insert_project, project)
+
+        # 同步：在当前线程借用连接
+        with db.connection() as conn:
+            project = _get_project_by_id(conn, project_id)
+
+    连接在 func 正常返回后提交，抛出异常时回滚。
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        pool_size: int = 4,
+        statement_cache: int = 128,
+        timeout: float = 30.0,
+        journal_mode: str = "WAL",
+        synchronous: str = "NORMAL",
+        cache_size_kb: int = 16384,
+        mmap_size_mb: int = 256,
+        busy_timeout_ms: int = 5000,
+        write_batch: int = 64,
+    ):
+        self.path = str(path)
+        self.pool_size = max(1, pool_size)
+        self.statement_cache = max(0, statement_cache)
+        self.timeout = timeout
+        self.opened = 0
+        self.waits = 0
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._all: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.journal_mode = journal_mode.upper()
+        self.busy_timeout_ms = max(0, busy_timeout_ms)
+        self.pragmas = {
+            "synchronous": synchronous.upper(),
+            "cache_size": -max(0, cache_size_kb),
+            "mmap_size": max(0, mmap_size_mb) * 1024 * 1024,
+            "busy_timeout": self.busy_timeout_ms,
+        }
+        self.write_batch = max(1, write_batch)
+        self.writes = 0
+        self.write_batches = 0
+        self.max_write_batch = 0
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._writer_conn: Optional[sqlite3.Connection] = None
+        self._write_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._write_queue: Optional["asyncio.Queue[Optional[_Write]]"] = None
+        self._write_task: Optional[asyncio.Task] = None
+        self._version_conn: Optional[sqlite3.Connection] = None
+        self._version_lock = threading.Lock()
+        # 已计入的 data_version（本进程的提交和上次检查时的值）
+        self._seen_version: Optional[int] = None
+
+    @classmethod
+    def from_env(cls, path: Union[str, Path]) -> "Database":
+        return cls(
+            path,
+            pool_size=env_int("DB_POOL_SIZE", 4),
+            statement_cache=env_int("DB_STATEMENT_CACHE", 128),
+            timeout=env_float("DB_POOL_TIMEOUT", 30.0),
+            journal_mode=env_str("DB_JOURNAL_MODE", "WAL"),
+            synchronous=env_str("DB_SYNCHRONOUS", "NORMAL"),
+            cache_size_kb=env_int("DB_CACHE_SIZE_KB", 16384),
+            mmap_size_mb=env_int("DB_MMAP_SIZE_MB", 256),
+            busy_timeout_ms=env_int("DB_BUSY_TIMEOUT_MS", 5000),
+            write_batch=env_int("DB_WRITE_BATCH", 64),
+        )
+
+    def _connect(self, autocommit: bool = False) -> sqlite3.Connection:
+        # 连接在线程之间传递，但同一时刻只被一个线程使用
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.statement_cache,
+            isolation_level=None if autocommit else "",
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def bootstrap(self) -> str:
+        """
+        设置数据库文件级别的日志模式（WAL 会持久保存在数据库文件中）
+
+        Returns:
+            生效的日志模式；文件系统不支持 WAL 时 SQLite 会保持原模式
+        """
+        with self.connection() as conn:
+            mode = conn.execute(f"PRAGMA journal_mode = {self.journal_mode}").fetchone()[0]
+        if mode.upper() != self.journal_mode:
+            print(f"[Warning] SQLite journal_mode={self.journal_mode} not applied to {self.path}, using {mode}")
+        return mode
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.pool_size:
+                conn = self._connect()
+                self._all.append(conn)
+                self.opened += 1
+                return conn
+        self.waits += 1
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"No idle SQLite connection within {self.timeout}s ({self.path})")
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        if conn not in self._all:
+            # 连接池已在借出期间关闭
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """在当前线程借用一个连接（事务在退出时提交，异常时回滚）"""
+        conn = self._acquire()
+        try:
+            yield conn
+            if conn.in_transaction:
+                self._commit(conn.commit)
+            else:
+                conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._release(conn)
+
+    def _call(self, func: Callable[..., T], args: tuple, kwargs: Dict[str, Any]) -> T:
+        with self.connection() as conn:
+            return func(conn, *args, **kwargs)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.pool_size, thread_name_prefix="sqlite"
+                    )
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """在数据库线程中以池中连接执行 func(conn, *args, **kwargs)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), self._call, func, args, kwargs)
+
+    def _read_version(self) -> int:
+        """调用方需持有 _version_lock；始终在同一个专用连接上查询"""
+        if self._version_conn is None:
+            self._version_conn = self._connect(autocommit=True)
+        return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def data_version(self) -> int:
+        """PRAGMA data_version：其它连接（含本进程的其它连接）提交修改后变化"""
+        with self._version_lock:
+            return self._read_version()
+
+    def _commit(self, commit: Callable[[], Any]) -> None:
+        """
+        提交写事务，并把本次提交计入已观察的 data_version
+
+        提交前持有写锁，其它连接无法在此期间提交；提交前的 data_version 与上次记录
+        一致时，提交后的变化只来自本次提交。不一致说明有尚未检查到的外部提交，
+        保留旧值，由下一次 changed_externally() 报告。
+        """
+        with self._version_lock:
+            before = self._read_version()
+            commit()
+            after = self._read_version()
+            if self._seen_version is None or before == self._seen_version:
+                self._seen_version = after
+
+    def changed_externally(self) -> bool:
+        """自上次检查以来是否有其它进程提交过修改（本进程的提交不计入）"""
+        with self._version_lock:
+            version = self._read_version()
+            changed = self._seen_version is not None and version != self._seen_version
+            self._seen_version = version
+            return changed
+
+    async def changed_externally_async(self) -> bool:
+        """在数据库线程中执行 changed_externally()，不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), self.changed_externally)
+
+    async def write(
+        self,
+        func: Callable[..., T],
+        *args: Any,
+        on_commit: Optional[Callable[[T], None]] = None,
+        **kwargs: Any,
+    ) -> T:
+        """
+        在单写线程中执行 func(conn, *args, **kwargs)
+
+        排队中的写操作合并为一个事务，func 返回时其修改尚未提交，
+        本协程在事务提交后才返回结果。
+
+        Args:
+            on_commit: 事务提交后在事件循环中以 func 的返回值调用（如失效缓存）；
+                即使等待结果的协程已被取消也会执行，func 抛出异常时不调用
+        """
+        loop = asyncio.get_running_loop()
+        if self._write_loop is not loop or self._write_task is None or self._write_task.done():
+            self._write_loop = loop
+            self._write_queue = asyncio.Queue()
+            self._write_task = loop.create_task(self._write_worker(self._write_queue))
+        future = loop.create_future()
+        self._write_queue.put_nowait((func, args, kwargs, future, on_commit))
+        return await future
+
+    async def _write_worker(self, queue: "asyncio.Queue[Optional[_Write]]") -> None:
+        loop = asyncio.get_running_loop()
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < self.write_batch and not queue.empty():
+                item = queue.get_nowait()
+                if item is None:
+                    queue.put_nowait(None)
+                    break
+                batch.append(item)
+            batch = [item for item in batch if not item[3].cancelled()]
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(self._writer, self._write_batch, batch)
+            except Exception as e:
+                results = [(False, e)] * len(batch)
+            for (_, _, _, future, on_commit), (ok, value) in zip(batch, results):
+                if ok and on_commit is not None:
+                    try:
+                        on_commit(value)
+                    except Exception as e:
+                        print(f"[Warning] Database on_commit callback failed: {e}")
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _write_batch(self, batch: List[_Write]) -> List[Tuple[bool, Any]]:
+        """在写线程中以一个事务执行一批写操作，每项使用独立的 SAVEPOINT"""
+        if self._writer_conn is None:
+            self._writer_conn = self._connect(autocommit=True)
+        conn = self._writer_conn
+        results: List[Tuple[bool, Any]] = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for func, args, kwargs, _, _ in batch:
+                conn.execute("SAVEPOINT write")
+                try:
+                    value = func(conn, *args, **kwargs)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    conn.execute("RELEASE write")
+                    results.append((False, e))
+                else:
+                    conn.execute("RELEASE write")
+                    results.append((True, value))
+            self._commit(lambda: conn.execute("COMMIT"))
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return [(False, e)] * len(batch)
+        self.writes += len(batch)
+        self.write_batches += 1
+        self.max_write_batch = max(self.max_write_batch, len(batch))
+        return results
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "journal_mode": self.journal_mode,
+            "pool_size": self.pool_size,
+            "open": len(self._all),
+            "idle": self._idle.qsize(),
+            "waits": self.waits,
+            "statement_cache": self.statement_cache,
+            "writes": self.writes,
+            "write_batches": self.write_batches,
+            "avg_write_batch": round(self.writes / self.write_batches, 2) if self.write_batches else None,
+            "max_write_batch": self.max_write_batch,
+        }
+
+    async def aclose(self) -> None:
+        """处理完排队中的写操作后关闭"""
+        task = self._write_task
+        if task is not None and not task.done() and self._write_loop is asyncio.get_running_loop():
+            self._write_queue.put_nowait(None)
+            await task
+        self._write_task = None
+        self.close()
+
+    def close(self) -> None:
+        """关闭线程池和所有连接（之后再次使用时重新创建）"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+        if self._writer_conn is not None:
+            self._writer_conn.close()
+            self._writer_conn = None
+        with self._version_lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
+            self._seen_version = None
+        with self._lock:
+            for conn in self._all:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._all.clear()
+        while not self._idle.empty():
+            self._idle.get_nowait()
@@ -0,0 +1,125 @@
+"""
+HTTP Client Registry - 上游 LLM 服务的共享连接池
+
+为每个 LLM 提供商维护一个进程级的 httpx.AsyncClient，复用 keep-alive 连接，
+避免每次请求都重新进行 DNS 解析、TCP 握手和 TLS 握手。
+
+由 main.py 中的 FastAPI lifespan 负责在关闭时统一释放连接。
+"""
+
+import asyncio
+from typing import Dict, Optional
+
+import httpx
+
+from services.settings import provider_setting
+
+
+# 默认连接池配置（可通过环境变量覆盖）
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE = 20
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_TIMEOUT = 120.0
+
+
+def _http2_available() -> bool:
+    """HTTP/2 需要安装 h2 (pip install httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class HTTPClientRegistry:
+    """
+    按提供商划分的 httpx.AsyncClient 注册表。
+
+    每个提供商拥有独立的连接池，配置项按以下优先级读取：
+        {PROVIDER}_HTTP_MAX_CONNECTIONS > LLM_HTTP_MAX_CONNECTIONS > 默认值
+
+    Usage:
+        client = http_clients.get("deepseek")
+        response = await client.post(url, json=payload)
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _setting(self, provider: str, key: str, default, cast=str):
+        """读取提供商级别配置，回退到全局配置，最后使用默认值"""
+        return provider_setting(provider, f"HTTP_{key}", default, cast)
+
+    def _build_limits(self, provider: str) -> httpx.Limits:
+        """构建连接池限制"""
+        return httpx.Limits(
+            max_connections=self._setting(provider, "MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS, int),
+            max_keepalive_connections=self._setting(provider, "MAX_KEEPALIVE", DEFAULT_MAX_KEEPALIVE, int),
+            keepalive_expiry=self._setting(provider, "KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY, float),
+        )
+
+    def _build_timeout(self, provider: str) -> httpx.Timeout:
+        """构建超时配置（LLM 调用不再按请求覆盖，{PROVIDER}_HTTP_TIMEOUT 即实际生效的超时）"""
+        return httpx.Timeout(
+            self._setting(provider, "TIMEOUT", DEFAULT_TIMEOUT, float),
+            connect=self._setting(provider, "CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT, float),
+        )
+
+    def _use_http2(self, provider: str) -> bool:
+        """是否启用 HTTP/2（未安装 h2 时自动降级为 HTTP/1.1）"""
+        value = self._setting(provider, "HTTP2", "")
+        enabled = value.lower() in ("true", "1", "yes")
+        if enabled and not _http2_available():
+            print(f"[Warning] HTTP/2 requested for '{provider}' but h2 is not installed, falling back to HTTP/1.1")
+            return False
+        return enabled
+
+    def get(self, provider: str) -> httpx.AsyncClient:
+        """
+        获取提供商对应的共享客户端，不存在时懒加载创建。
+
+        Args:
+            provider: 提供商名称，如 'deepseek'、'claude'、'doubao'
+
+        Returns:
+            复用连接池的 httpx.AsyncClient
+        """
+        provider = provider.lower()
+        client = self._clients.get(provider)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=self._build_limits(provider),
+                timeout=self._build_timeout(provider),
+                http2=self._use_http2(provider),
+            )
+            self._clients[provider] = client
+        return client
+
+    def providers(self) -> list:
+        """返回已创建连接池的提供商列表"""
+        return [name for name, client in self._clients.items() if not client.is_closed]
+
+    async def aclose(self, provider: Optional[str] = None) -> None:
+        """
+        关闭连接池。
+
+        Args:
+            provider: 指定提供商；为空时关闭全部
+        """
+        if provider is not None:
+            client = self._clients.pop(provider.lower(), None)
+            if client is not None:
+                await client.aclose()
+            return
+
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(
+            *(client.aclose() for client in clients),
+            return_exceptions=True
+        )
+
+
+# 进程级单例
+http_clients = HTTPClientRegistry()
@@ -5,122 +5,444 @@ This module provides a unified interface for different LLM providers:
 - DeepSeek (OpenAI compatible format)
 - Claude (Anthropic API)
 - Doubao (Volcengine/火山引擎 API)
+- Auto (routing with failover/hedging across the providers above)
 """
 
 import os
+import time
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Optional, Dict, Any, AsyncGenerator
+from typing import Optional, Dict, Any, AsyncGenerator, Awaitable, Callable, List, Tuple, Union
 import httpx
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+from services.settings import env_float, env_flag, parse_flag, provider_setting
+from services.http_client import http_clients
+from services.response_cache import response_cache, make_cache_key
+from services.coalescing import request_coalescer
+from services.provider_stats import provider_latency
+from services.resilience import resilience, CircuitOpenError
+from services.rate_limit import rate_limiters, estimate_tokens, RateLimitExceeded
+from services.context_window import context_window_for
+from services.usage import Usage, UsageScope, usage_tracker
+from services.tracing import Span, tracer
+from services.openai_compat import (
+    OpenAICompatTransport,
+    build_chat_payload,
+    iter_sse_json,
+    raise_for_status,
+)
+
+def stream_usage_enabled(provider: str) -> bool:
+    """Whether streaming requests ask for usage (`stream_options.include_usage`)."""
+    return provider_setting(provider, "STREAM_USAGE", True, cast=parse_flag)
+
+
+def system_segments(system_prompt: Optional[Union[str, List[str]]]) -> List[str]:
+    """
+    Normalize a system prompt into its segments.
+    
+    A system prompt may be given as a list of stable segments (e.g. agent
+    prompt, IP persona); joined without separators they form the full prompt.
+    Providers with prompt caching use each segment as a cache breakpoint.
+    """
+    if not system_prompt:
+        return []
+    if isinstance(system_prompt, str):
+        return [system_prompt]
+    return [segment for segment in system_prompt if segment]
+
+
+def join_system_prompt(system_prompt: Optional[Union[str, List[str]]]) -> Optional[str]:
+    """Full system prompt text, or None if empty."""
+    return "".join(system_segments(system_prompt)) or None
+
+
+def build_conversation(
+    prompt: str,
+    messages: Optional[List[Dict[str, str]]] = None,
+    system_prompt: Optional[Union[str, List[str]]] = None
+) -> Tuple[List[str], List[Dict[str, str]]]:
+    """
+    Normalize a request into system prompt segments and user/assistant turns.
+    
+    Args:
+        prompt: Latest user message; appended as the final turn when non-empty.
+        messages: Conversation turns ({"role", "content"}); system entries are
+            appended to the system prompt, empty turns are dropped.
+        system_prompt: Base system prompt, or a list of its segments.
+        
+    Returns:
+        Tuple of (system prompt segments, turns); "".join(segments) is the
+        full system prompt.
+    """
+    segments = system_segments(system_prompt)
+    turns: List[Dict[str, str]] = []
+    for message in messages or []:
+        role, content = message.get("role"), message.get("content")
+        if not content:
+            continue
+        if role == "system":
+            segments.append("\n\n" + content if segments else content)
+        elif role in ("user", "assistant"):
+            turns.append({"role": role, "content": content})
+    if prompt or not turns:
+        turns.append({"role": "user", "content": prompt})
+    return segments, turns
 
 
 class BaseLLM(ABC):
     """Abstract base class for LLM implementations."""
     
+    # Provider name, used to select the shared connection pool
+    provider_name: str = "default"
+    # Whether upstream calls go through rate limiting, circuit breaker and retries
+    resilient: bool = True
+    
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key
     
-    @abstractmethod
-    async def generate_text(self, prompt: str, **kwargs) -> str:
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared, pooled HTTP client for this provider (owned by the app lifespan)."""
+        return http_clients.get(self.provider_name)
+    
+    def context_window(self) -> int:
+        """Context window (tokens) of the configured model, used to budget chat history."""
+        return context_window_for(self.provider_name, getattr(self, "model", None))
+    
+    def cache_key(self, prompt: str, **kwargs) -> str:
+        """Stable hash of the normalized request payload, used by the response cache."""
+        return make_cache_key({
+            "provider": self.provider_name,
+            "base_url": getattr(self, "base_url", None),
+            "model": kwargs.get("model", getattr(self, "model", None)),
+            "system_prompt": join_system_prompt(kwargs.get("system_prompt")),
+            "messages": kwargs.get("messages"),
+            "prompt": prompt,
+            "temperature": kwargs.get("temperature"),
+            "max_tokens": kwargs.get("max_tokens"),
+        })
+    
+    async def generate_text(
+        self,
+        prompt: str,
+        cache: Optional[bool] = None,
+        cache_namespace: str = "default",
+        **kwargs
+    ) -> str:
         """
         Generate text based on the given prompt.
         
+        Identical requests are served from the response cache: temperature-0
+        requests are cached by default, others only when `cache=True`.
+        Concurrent identical requests are coalesced into one upstream call.
+        
         Args:
             prompt: The input prompt for text generation.
-            **kwargs: Additional parameters for the API call.
+            cache: Explicit cache opt-in/opt-out; None applies the default policy.
+            cache_namespace: Endpoint name used for per-endpoint opt-out and stats.
+            **kwargs: Additional parameters for the API call (system_prompt,
+                messages, temperature, max_tokens, model). `messages` carries
+                the conversation as native user/assistant turns; `usage_scope`
+                (a UsageScope) collects the usage of the upstream calls made.
             
         Returns:
             Generated text response.
         """
-        pass
+        key = self.cache_key(prompt, **kwargs)
+        use_cache = response_cache.should_cache(kwargs.get("temperature"), cache, cache_namespace)
+        if use_cache:
+            cached = await response_cache.get(key, cache_namespace)
+            if cached is not None:
+                return cached
+        
+        # Concurrent identical requests share a single upstream call; each
+        # follower's scope gets a coalesced copy of the leader's usage
+        scope = kwargs.get("usage_scope") or UsageScope(cache_namespace)
+        kwargs["usage_scope"] = scope
+        content = await request_coalescer.run(
+            key, lambda: self._call_text(prompt, **kwargs), scope
+        )
+        if use_cache:
+            await response_cache.set(key, content)
+        return content
     
-    @abstractmethod
-    async def generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
+    async def generate_stream(
+        self,
+        prompt: str,
+        cache: Optional[bool] = None,
+        cache_namespace: str = "default",
+        **kwargs
+    ) -> AsyncGenerator[str, None]:
         """
         Generate text in streaming mode.
         
+        Cacheable requests (same policy as `generate_text`) are replayed from
+        the response cache in paced chunks; otherwise the upstream stream is
+        relayed (shared with concurrent identical streams) and the full
+        completion recorded once it finishes.
+        
         Args:
             prompt: The input prompt for text generation.
+            cache: Explicit cache opt-in/opt-out; None applies the default policy.
+            cache_namespace: Endpoint name used for per-endpoint opt-out and stats.
             **kwargs: Additional parameters for the API call.
             
         Yields:
             Generated text chunks.
         """
+        key = self.cache_key(prompt, **kwargs)
+        use_cache = response_cache.should_cache(kwargs.get("temperature"), cache, cache_namespace)
+        if use_cache:
+            cached = await response_cache.get(key, cache_namespace)
+            if cached is not None:
+                async for chunk in response_cache.replay(cached):
+                    yield chunk
+                return
+        
+        # Concurrent identical streams fan out from a single upstream reader
+        parts = []
+        scope = kwargs.get("usage_scope") or UsageScope(cache_namespace)
+        kwargs["usage_scope"] = scope
+        async for chunk in request_coalescer.stream(
+            key, lambda: self._call_stream(prompt, **kwargs), scope
+        ):
+            parts.append(chunk)
+            yield chunk
+        # Only reached when the upstream stream completed normally
+        if use_cache:
+            await response_cache.set(key, "".join(parts))
+    
+    def _estimate_prompt_tokens(self, prompt: str, **kwargs) -> int:
+        """Estimated prompt tokens (system prompt, history and prompt)."""
+        return (
+            estimate_tokens(join_system_prompt(kwargs.get("system_prompt")))
+            + estimate_tokens(prompt)
+            + sum(estimate_tokens(message.get("content")) for message in kwargs.get("messages") or [])
+        )
+    
+    def _estimate_tokens(self, prompt: str, **kwargs) -> int:
+        """Estimated prompt + completion tokens, used for TPM rate limiting."""
+        return self._estimate_prompt_tokens(prompt, **kwargs) + kwargs.get("max_tokens", 2048)
+    
+    def _new_usage(self, stream: bool, **kwargs) -> Usage:
+        return Usage(self.provider_name, kwargs.get("model", getattr(self, "model", None)), stream=stream)
+    
+    async def _call_text(self, prompt: str, retry: bool = True, **kwargs) -> str:
+        """
+        Non-streaming upstream call, rate limited per provider and guarded by
+        the circuit breaker and retry policy. The call's usage is recorded
+        once it succeeds.
+        
+        Each attempt acquires its own limiter permit, so retry backoff
+        (including Retry-After waits) does not hold a concurrency slot.
+        """
+        if not self.resilient:
+            return await self._generate_text(prompt, **kwargs)
+        usage = self._new_usage(stream=False, **kwargs)
+        span = tracer.start_span("llm.upstream", "CLIENT")
+        limiter = rate_limiters.get(self.provider_name)
+        estimated_tokens = self._estimate_tokens(prompt, **kwargs)
+        
+        async def attempt() -> str:
+            async with limiter.acquire(estimated_tokens):
+                usage.start()
+                return await self._generate_text(prompt, usage=usage, **kwargs)
+        
+        try:
+            content = await resilience.call(self.provider_name, attempt, retry=retry)
+        except Exception as e:
+            if span is not None:
+                span.error(e)
+                self._end_upstream_span(span, usage)
+            raise
+        usage.finish(self._estimate_prompt_tokens(prompt, **kwargs), content)
+        usage_tracker.record(usage, kwargs.get("usage_scope"))
+        if span is not None:
+            self._end_upstream_span(span, usage)
+        return content
+    
+    async def _call_stream(self, prompt: str, retry: bool = True, **kwargs) -> AsyncGenerator[str, None]:
+        """
+        Streaming upstream call; each attempt holds a provider concurrency
+        slot for the whole stream (released during retry backoff) and is
+        guarded by the circuit breaker and retry policy. Usage is recorded
+        when the stream ends, including streams that failed or were cancelled
+        after producing output.
+        """
+        if not self.resilient:
+            async for chunk in self._generate_stream(prompt, **kwargs):
+                yield chunk
+            return
+        usage = self._new_usage(stream=True, **kwargs)
+        span = tracer.start_span("llm.upstream", "CLIENT")
+        parts: List[str] = []
+        status = "aborted"
+        limiter = rate_limiters.get(self.provider_name)
+        estimated_tokens = self._estimate_tokens(prompt, **kwargs)
+        
+        async def attempt() -> AsyncGenerator[str, None]:
+            async with limiter.acquire(estimated_tokens):
+                usage.start()
+                async for chunk in self._generate_stream(prompt, usage=usage, **kwargs):
+                    yield chunk
+        
+        try:
+            async for chunk in resilience.stream(self.provider_name, attempt, retry=retry):
+                if not parts:
+                    usage.first_token()
+                parts.append(chunk)
+                yield chunk
+            status = "ok"
+        except Exception as e:
+            status = "error"
+            if span is not None:
+                span.error(e)
+            raise
+        finally:
+            if parts or status == "ok":
+                usage.finish(self._estimate_prompt_tokens(prompt, **kwargs), "".join(parts), status)
+                usage_tracker.record(usage, kwargs.get("usage_scope"))
+            if span is not None:
+                usage.status = status
+                self._end_upstream_span(span, usage)
+    
+    def _end_upstream_span(self, span: Span, usage: Usage) -> None:
+        """Attach the upstream timeline (headers, first token, last byte) and usage to the span and end it."""
+        span.set(**{
+            "gen_ai.system": usage.provider,
+            "gen_ai.request.model": usage.model,
+            "llm.stream": usage.stream,
+            "llm.status": usage.status,
+        })
+        if usage.request_id:
+            span.set(**{"gen_ai.response.id": usage.request_id})
+        if usage.prompt_tokens is not None:
+            span.set(**{
+                "gen_ai.usage.input_tokens": usage.prompt_tokens,
+                "gen_ai.usage.output_tokens": usage.completion_tokens,
+                "gen_ai.usage.cached_tokens": usage.cached_tokens,
+                "llm.usage.estimated": usage.estimated,
+            })
+        span.event("rate_limit_acquired", at=usage.started)
+        if usage.connected_at is not None:
+            span.event("response_headers", at=usage.connected_at)
+        if usage.ttft is not None:
+            span.event("first_token", at=usage.started + usage.ttft)
+        span.end()
+    
+    @abstractmethod
+    async def _generate_text(self, prompt: str, **kwargs) -> str:
+        """Provider-specific non-streaming call."""
+        pass
+    
+    @abstractmethod
+    async def _generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
+        """Provider-specific streaming call."""
         pass
 
 
-class DeepSeekLLM(BaseLLM):
+class OpenAICompatibleLLM(BaseLLM):
     """
-    DeepSeek LLM implementation using OpenAI-compatible API format.
+    Base class for providers speaking the OpenAI /chat/completions protocol.
     
-    API Documentation: https://platform.deepseek.com/api-docs
+    Subclasses only declare their environment prefix, defaults and chat path;
+    headers, payloads, SSE decoding and error mapping live in the shared
+    transport (services/openai_compat.py). New providers can be added with
+    `LLMFactory.register(name, base_url=..., model=...)`.
     """
     
-    DEFAULT_BASE_URL = "https://api.deepseek.com"
-    DEFAULT_MODEL = "deepseek-chat"
+    ENV_PREFIX: str = ""
+    DISPLAY_NAME: str = "OpenAI-compatible"
+    DEFAULT_BASE_URL: str = ""
+    DEFAULT_MODEL: str = ""
+    CHAT_PATH = "/chat/completions"
     
     def __init__(
-        self, 
+        self,
         api_key: Optional[str] = None,
         base_url: Optional[str] = None,
         model: Optional[str] = None
     ):
-        super().__init__(api_key or os.getenv("DEEPSEEK_API_KEY"))
-        self.base_url = base_url or os.getenv("DEEPSEEK_BASE_URL", self.DEFAULT_BASE_URL)
-        self.model = model or os.getenv("DEEPSEEK_MODEL", self.DEFAULT_MODEL)
+        super().__init__(api_key or os.getenv(f"{self.ENV_PREFIX}_API_KEY"))
+        self.base_url = base_url or os.getenv(f"{self.ENV_PREFIX}_BASE_URL", self.DEFAULT_BASE_URL)
+        self.model = model or os.getenv(f"{self.ENV_PREFIX}_MODEL", self.DEFAULT_MODEL)
         
         if not self.api_key:
-            raise ValueError("DeepSeek API key is required. Set DEEPSEEK_API_KEY environment variable.")
+            raise ValueError(
+                f"{self.DISPLAY_NAME} API key is required. "
+                f"Set {self.ENV_PREFIX}_API_KEY environment variable."
+            )
+        
+        self.transport = OpenAICompatTransport(
+            self.provider_name,
+            f"{self.base_url.rstrip('/')}{self.CHAT_PATH}",
+            self.api_key
+        )
+        self.stream_usage = stream_usage_enabled(self.provider_name)
+    
+    @classmethod
+    def define(
+        cls,
+        name: str,
+        base_url: str,
+        model: str,
+        env_prefix: Optional[str] = None,
+        chat_path: Optional[str] = None
+    ) -> type:
+        """
+        Create a provider class for an OpenAI-compatible endpoint.
+        
+        Args:
+            name: Provider name, also used as model_type.
+            base_url: Default API base URL (overridable via {PREFIX}_BASE_URL).
+            model: Default model name (overridable via {PREFIX}_MODEL).
+            env_prefix: Environment variable prefix, defaults to the upper-cased name.
+            chat_path: Path appended to base_url, defaults to "/chat/completions".
+        """
+        prefix = env_prefix or name.upper()
+        return type(f"{name.title().replace('-', '').replace('_', '')}LLM", (cls,), {
+            "provider_name": name.lower(),
+            "ENV_PREFIX": prefix,
+            "DISPLAY_NAME": name,
+            "DEFAULT_BASE_URL": base_url,
+            "DEFAULT_MODEL": model,
+            "CHAT_PATH": chat_path or cls.CHAT_PATH,
+        })
     
-    async def generate_text(self, prompt: str, **kwargs) -> str:
+    def _payload(self, prompt: str, stream: bool, **kwargs) -> Dict[str, Any]:
+        segments, turns = build_conversation(prompt, kwargs.get("messages"), kwargs.get("system_prompt"))
+        return build_chat_payload(
+            model=kwargs.get("model", self.model),
+            prompt=prompt,
+            stream=stream,
+            system_prompt="".join(segments) or None,
+            temperature=kwargs.get("temperature", 0.7),
+            max_tokens=kwargs.get("max_tokens", 2048),
+            turns=turns,
+            stream_usage=self.stream_usage,
+        )
+    
+    async def _generate_text(self, prompt: str, **kwargs) -> str:
         """
-        Generate text using DeepSeek API (OpenAI compatible format).
+        Generate text using the OpenAI-compatible API.
         
         Args:
             prompt: The input prompt.
-            **kwargs: Additional parameters (temperature, max_tokens, etc.)
+            **kwargs: Additional parameters (system_prompt, temperature, max_tokens, model)
             
         Returns:
             Generated text response.
         """
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": kwargs.get("model", self.model),
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": kwargs.get("temperature", 0.7),
-            "max_tokens": kwargs.get("max_tokens", 2048),
-            "stream": False
-        }
-        
-        # Support system prompt
-        if "system_prompt" in kwargs:
-            payload["messages"].insert(0, {
-                "role": "system",
-                "content": kwargs["system_prompt"]
-            })
-        
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{self.base_url}/v1/chat/completions",
-                headers=headers,
-                json=payload
-            )
-            response.raise_for_status()
-            data = response.json()
-            return data["choices"][0]["message"]["content"]
+        return await self.transport.complete(
+            self.client, self._payload(prompt, stream=False, **kwargs),
+            usage=kwargs.get("usage")
+        )
     
-    async def generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
+    async def _generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
         """
-        Generate text in streaming mode using DeepSeek API.
+        Generate text in streaming mode using the OpenAI-compatible API.
         
         Args:
             prompt: The input prompt.
@@ -129,48 +451,26 @@ class DeepSeekLLM(BaseLLM):
         Yields:
             Generated text chunks.
         """
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": kwargs.get("model", self.model),
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": kwargs.get("temperature", 0.7),
-            "max_tokens": kwargs.get("max_tokens", 2048),
-            "stream": True
-        }
-        
-        if "system_prompt" in kwargs:
-            payload["messages"].insert(0, {
-                "role": "system",
-                "content": kwargs["system_prompt"]
-            })
-        
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            async with client.stream(
-                "POST",
-                f"{self.base_url}/v1/chat/completions",
-                headers=headers,
-                json=payload
-            ) as response:
-                response.raise_for_status()
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data = line[6:]
-                        if data == "[DONE]":
-                            break
-                        try:
-                            import json
-                            chunk = json.loads(data)
-                            content = chunk["choices"][0]["delta"].get("content", "")
-                            if content:
-                                yield content
-                        except (json.JSONDecodeError, KeyError, IndexError):
-                            continue
+        async for content in self.transport.stream(
+            self.client, self._payload(prompt, stream=True, **kwargs),
+            usage=kwargs.get("usage")
+        ):
+            yield content
+
+
+class DeepSeekLLM(OpenAICompatibleLLM):
+    """
+    DeepSeek LLM implementation using OpenAI-compatible API format.
+    
+    API Documentation: https://platform.deepseek.com/api-docs
+    """
+    
+    provider_name = "deepseek"
+    ENV_PREFIX = "DEEPSEEK"
+    DISPLAY_NAME = "DeepSeek"
+    DEFAULT_BASE_URL = "https://api.deepseek.com"
+    DEFAULT_MODEL = "deepseek-chat"
+    CHAT_PATH = "/v1/chat/completions"
 
 
 class ClaudeLLM(BaseLLM):
@@ -182,11 +482,19 @@ class ClaudeLLM(BaseLLM):
     Supports:
     - Official Anthropic API (api.anthropic.com)
     - OpenAI-compatible proxy services (one-api, new-api, etc.)
+    
+    In native mode prompt caching is enabled by default (CLAUDE_PROMPT_CACHE):
+    each system prompt segment and the latest user turn carry a cache_control
+    breakpoint, and cache read/creation tokens are recorded with the usage.
     """
     
+    provider_name = "claude"
     DEFAULT_BASE_URL = "https://api.anthropic.com"
     DEFAULT_MODEL = "claude-3-5-sonnet-20241022"
     API_VERSION = "2023-06-01"
+    # The Messages API allows at most 4 cache breakpoints per request
+    MAX_CACHE_BREAKPOINTS = 4
+    CACHE_CONTROL = {"type": "ephemeral"}
     
     def __init__(
         self,
@@ -197,13 +505,98 @@ class ClaudeLLM(BaseLLM):
         super().__init__(api_key or os.getenv("CLAUDE_API_KEY") or os.getenv("ANTHROPIC_API_KEY"))
         self.base_url = base_url or os.getenv("CLAUDE_BASE_URL", self.DEFAULT_BASE_URL)
         self.model = model or os.getenv("CLAUDE_MODEL", self.DEFAULT_MODEL)
-        # Check if using OpenAI-compatible format (env var or auto-detect)
-        self.use_openai_format = os.getenv("CLAUDE_USE_OPENAI_FORMAT", "").lower() in ("true", "1", "yes")
         
         if not self.api_key:
             raise ValueError("Claude API key is required. Set CLAUDE_API_KEY or ANTHROPIC_API_KEY environment variable.")
+        
+        # Use OpenAI-compatible format when forced via env var or when talking to a proxy
+        is_official_api = "api.anthropic.com" in self.base_url
+        self.use_openai_format = (
+            env_flag("CLAUDE_USE_OPENAI_FORMAT", False)
+            or not is_official_api
+        )
+        
+        self.prompt_cache = env_flag("CLAUDE_PROMPT_CACHE", True)
+        
+        base_url = self.base_url.rstrip("/")
+        if self.use_openai_format:
+            self.transport = OpenAICompatTransport(
+                self.provider_name, f"{base_url}/v1/chat/completions", self.api_key
+            )
+            self.stream_usage = stream_usage_enabled(self.provider_name)
+        else:
+            self.messages_url = f"{base_url}/v1/messages"
+            self.headers = {
+                "x-api-key": self.api_key,
+                "anthropic-version": self.API_VERSION,
+                "Content-Type": "application/json"
+            }
     
-    async def generate_text(self, prompt: str, **kwargs) -> str:
+    def _payload(self, prompt: str, stream: bool, **kwargs) -> Dict[str, Any]:
+        """Build the request payload for the configured API format."""
+        segments, turns = build_conversation(prompt, kwargs.get("messages"), kwargs.get("system_prompt"))
+        if self.use_openai_format:
+            return build_chat_payload(
+                model=kwargs.get("model", self.model),
+                prompt=prompt,
+                stream=stream,
+                system_prompt="".join(segments) or None,
+                temperature=kwargs.get("temperature", 0.7),
+                max_tokens=kwargs.get("max_tokens", 2048),
+                turns=turns,
+                stream_usage=self.stream_usage,
+            )
+        
+        # Native Anthropic format
+        messages = self._alternate_turns(turns)
+        payload = {
+            "model": kwargs.get("model", self.model),
+            "max_tokens": kwargs.get("max_tokens", 2048),
+            "messages": messages
+        }
+        if stream:
+            payload["stream"] = True
+        if kwargs.get("temperature") is not None:
+            payload["temperature"] = kwargs["temperature"]
+        if not self.prompt_cache:
+            if segments:
+                payload["system"] = "".join(segments)
+            return payload
+        
+        # Prompt caching: stable system segments first, then the conversation
+        # up to the latest user turn so the next turn reads it from cache
+        breakpoints = self.MAX_CACHE_BREAKPOINTS - 1
+        if segments:
+            payload["system"] = [
+                {"type": "text", "text": segment, **({"cache_control": self.CACHE_CONTROL} if index < breakpoints else {})}
+                for index, segment in enumerate(segments)
+            ]
+        if messages and messages[-1]["role"] == "user":
+            last = messages[-1]
+            messages[-1] = {
+                "role": "user",
+                "content": [{"type": "text", "text": last["content"], "cache_control": self.CACHE_CONTROL}]
+            }
+        return payload
+    
+    @staticmethod
+    def _alternate_turns(turns: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        The Messages API requires alternating roles starting with a user turn:
+        consecutive turns of the same role are merged, leading assistant turns dropped.
+        """
+        messages: List[Dict[str, str]] = []
+        for turn in turns:
+            if messages and messages[-1]["role"] == turn["role"]:
+                messages[-1] = {
+                    "role": turn["role"],
+                    "content": messages[-1]["content"] + "\n\n" + turn["content"]
+                }
+            elif messages or turn["role"] == "user":
+                messages.append(dict(turn))
+        return messages
+    
+    async def _generate_text(self, prompt: str, **kwargs) -> str:
         """
         Generate text using Claude API (supports both Anthropic and OpenAI-compatible formats).
         
@@ -214,71 +607,25 @@ class ClaudeLLM(BaseLLM):
         Returns:
             Generated text response.
         """
-        # Detect API type
-        is_official_api = "api.anthropic.com" in self.base_url
-        use_openai_format = self.use_openai_format or (not is_official_api)
+        payload = self._payload(prompt, stream=False, **kwargs)
+        usage: Optional[Usage] = kwargs.get("usage")
+        if self.use_openai_format:
+            return await self.transport.complete(self.client, payload, usage=usage)
         
-        # Build headers - proxy services use Bearer token
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        response = await self.client.post(
+            self.messages_url, headers=self.headers, json=payload
+        )
+        await raise_for_status(response, self.provider_name)
+        data = response.json()
+        if usage is not None:
+            usage.update(data.get("usage"))
+            usage.set_request_id(response, data.get("id"))
         
-        # Add Anthropic-specific headers for official API
-        if is_official_api and not use_openai_format:
-            headers = {
-                "x-api-key": self.api_key,
-                "anthropic-version": self.API_VERSION,
-                "Content-Type": "application/json"
-            }
-        
-        # Normalize base URL (remove trailing slash)
-        base_url = self.base_url.rstrip("/")
-        
-        # Build payload based on format
-        if use_openai_format:
-            # OpenAI-compatible format (used by most proxy services)
-            messages = []
-            if "system_prompt" in kwargs and kwargs["system_prompt"]:
-                messages.append({"role": "system", "content": kwargs["system_prompt"]})
-            messages.append({"role": "user", "content": prompt})
-            
-            payload = {
-                "model": kwargs.get("model", self.model),
-                "messages": messages,
-                "temperature": kwargs.get("temperature", 0.7),
-                "max_tokens": kwargs.get("max_tokens", 2048),
-                "stream": False
-            }
-            url = f"{base_url}/v1/chat/completions"
-        else:
-            # Native Anthropic format
-            payload = {
-                "model": kwargs.get("model", self.model),
-                "max_tokens": kwargs.get("max_tokens", 2048),
-                "messages": [{"role": "user", "content": prompt}]
-            }
-            if "temperature" in kwargs:
-                payload["temperature"] = kwargs["temperature"]
-            if "system_prompt" in kwargs and kwargs["system_prompt"]:
-                payload["system"] = kwargs["system_prompt"]
-            url = f"{base_url}/v1/messages"
-        
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Parse response based on format
-            if use_openai_format:
-                # OpenAI format: {"choices": [{"message": {"content": "..."}}]}
-                return data["choices"][0]["message"]["content"]
-            else:
-                # Anthropic format: {"content": [{"type": "text", "text": "..."}]}
-                content_blocks = data.get("content", [])
-                return "".join(block.get("text", "") for block in content_blocks if block.get("type") == "text")
-    
-    async def generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
+        # Anthropic format: {"content": [{"type": "text", "text": "..."}]}
+        content_blocks = data.get("content", [])
+        return "".join(block.get("text", "") for block in content_blocks if block.get("type") == "text")
+    
+    async def _generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
         """
         Generate text in streaming mode using Claude API (supports both formats).
         
@@ -289,202 +636,263 @@ class ClaudeLLM(BaseLLM):
         Yields:
             Generated text chunks.
         """
-        import json
+        payload = self._payload(prompt, stream=True, **kwargs)
+        usage = kwargs.get("usage") or Usage(self.provider_name, self.model, stream=True)
+        if self.use_openai_format:
+            async for content in self.transport.stream(self.client, payload, usage=usage):
+                yield content
+            return
         
-        # Detect API type
-        is_official_api = "api.anthropic.com" in self.base_url
-        use_openai_format = self.use_openai_format or (not is_official_api)
-        
-        # Build headers
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        if is_official_api and not use_openai_format:
-            headers = {
-                "x-api-key": self.api_key,
-                "anthropic-version": self.API_VERSION,
-                "Content-Type": "application/json"
-            }
-        
-        # Build payload based on format
-        if use_openai_format:
-            messages = []
-            if "system_prompt" in kwargs and kwargs["system_prompt"]:
-                messages.append({"role": "system", "content": kwargs["system_prompt"]})
-            messages.append({"role": "user", "content": prompt})
-            
-            payload = {
-                "model": kwargs.get("model", self.model),
-                "messages": messages,
-                "temperature": kwargs.get("temperature", 0.7),
-                "max_tokens": kwargs.get("max_tokens", 2048),
-                "stream": True
-            }
-            url = f"{self.base_url}/v1/chat/completions"
-        else:
-            payload = {
-                "model": kwargs.get("model", self.model),
-                "max_tokens": kwargs.get("max_tokens", 2048),
-                "messages": [{"role": "user", "content": prompt}],
-                "stream": True
-            }
-            if "temperature" in kwargs:
-                payload["temperature"] = kwargs["temperature"]
-            if "system_prompt" in kwargs and kwargs["system_prompt"]:
-                payload["system"] = kwargs["system_prompt"]
-            url = f"{self.base_url}/v1/messages"
-        
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            async with client.stream("POST", url, headers=headers, json=payload) as response:
-                response.raise_for_status()
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data = line[6:]
-                        if data == "[DONE]":
-                            break
-                        try:
-                            chunk = json.loads(data)
-                            if use_openai_format:
-                                # OpenAI format
-                                content = chunk["choices"][0]["delta"].get("content", "")
-                                if content:
-                                    yield content
-                            else:
-                                # Anthropic format
-                                if chunk.get("type") == "content_block_delta":
-                                    text = chunk.get("delta", {}).get("text", "")
-                                    if text:
-                                        yield text
-                        except (json.JSONDecodeError, KeyError, IndexError):
-                            continue
+        async with self.client.stream(
+            "POST", self.messages_url, headers=self.headers, json=payload
+        ) as response:
+            await raise_for_status(response, self.provider_name)
+            usage.set_request_id(response)
+            async for chunk in iter_sse_json(response, self.provider_name):
+                # Anthropic format
+                event_type = chunk.get("type")
+                if event_type == "content_block_delta":
+                    text = chunk.get("delta", {}).get("text", "")
+                    if text:
+                        yield text
+                elif event_type == "message_start":
+                    # Input and cache token counts arrive with message_start
+                    message = chunk.get("message", {})
+                    usage.update(message.get("usage"))
+                    usage.set_request_id(fallback=message.get("id"))
+                elif event_type == "message_delta":
+                    usage.update(chunk.get("usage"))
 
 
-class DoubaoLLM(BaseLLM):
+class DoubaoLLM(OpenAICompatibleLLM):
     """
     Doubao (豆包) LLM implementation using Volcengine (火山引擎) API.
     
     API Documentation: https://www.volcengine.com/docs/82379
     """
     
+    provider_name = "doubao"
+    ENV_PREFIX = "DOUBAO"
+    DISPLAY_NAME = "Doubao"
     DEFAULT_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
     DEFAULT_MODEL = "ep-20241226000000-00000"  # Replace with actual endpoint ID
+    CHAT_PATH = "/chat/completions"
+
+
+class RoutingLLM(BaseLLM):
+    """
+    Routing LLM that fails over across providers (model_type "auto").
+    
+    Providers are tried in order; connect errors, timeouts, 5xx and 429
+    responses move on to the next provider. With a hedge delay set, a second
+    streaming request is sent to the next provider when the first token has
+    not arrived within the latency budget, and the slower attempt is cancelled.
+    Non-streaming calls only fail over: their result arrives with the whole
+    completion, so a first-token budget would hedge nearly every request.
+    
+    Providers that cannot be constructed (e.g. missing API key) are logged
+    once and skipped until `LLMFactory.reload()`.
+    
+    Configuration (environment variables):
+        LLM_ROUTER_PROVIDERS: Ordered provider list, default "deepseek,doubao,claude"
+        LLM_ROUTER_HEDGE_DELAY: First-token budget in seconds before hedging a stream, 0 disables
+        LLM_ROUTER_ADAPTIVE: Reorder providers by observed p50 time-to-first-token
+    """
+    
+    provider_name = "auto"
+    # Each backend call is guarded individually; failover replaces retries
+    resilient = False
+    DEFAULT_PROVIDERS = "deepseek,doubao,claude"
+    ADAPTIVE_MIN_SAMPLES = 5
+    # Providers that failed to construct, with the error; cleared on LLMFactory.reload()
+    _unavailable: Dict[str, str] = {}
     
     def __init__(
         self,
         api_key: Optional[str] = None,
         base_url: Optional[str] = None,
-        model: Optional[str] = None
+        model: Optional[str] = None,
+        providers: Optional[List[str]] = None,
+        hedge_delay: Optional[float] = None,
+        adaptive: Optional[bool] = None
     ):
-        super().__init__(api_key or os.getenv("DOUBAO_API_KEY"))
-        self.base_url = base_url or os.getenv("DOUBAO_BASE_URL", self.DEFAULT_BASE_URL)
-        self.model = model or os.getenv("DOUBAO_MODEL", self.DEFAULT_MODEL)
+        super().__init__(api_key)
+        self.base_url = base_url
+        self.model = model
+        if providers is None:
+            providers = os.getenv("LLM_ROUTER_PROVIDERS", self.DEFAULT_PROVIDERS).split(",")
+        self.providers = [name.strip().lower() for name in providers if name.strip() and name.strip().lower() != self.provider_name]
+        if hedge_delay is None:
+            hedge_delay = env_float("LLM_ROUTER_HEDGE_DELAY", 0.0)
+        self.hedge_delay = hedge_delay if hedge_delay > 0 else None
+        if adaptive is None:
+            adaptive = env_flag("LLM_ROUTER_ADAPTIVE", True)
+        self.adaptive = adaptive
         
-        if not self.api_key:
-            raise ValueError("Doubao API key is required. Set DOUBAO_API_KEY environment variable.")
+        if not self.providers:
+            raise ValueError("Routing LLM requires at least one provider. Set LLM_ROUTER_PROVIDERS environment variable.")
+    
+    def _backend(self, name: str) -> Optional[BaseLLM]:
+        """Resolve a provider instance, skipping providers that are not configured."""
+        if name in self._unavailable:
+            return None
+        try:
+            return LLMFactory.create(name)
+        except ValueError as e:
+            self._unavailable[name] = str(e)
+            print(f"[Warning] Routing LLM skipping provider '{name}' until reload: {e}")
+            return None
     
-    async def generate_text(self, prompt: str, **kwargs) -> str:
+    def context_window(self) -> int:
+        """Smallest context window among the providers, since any of them may serve the request."""
+        windows = [
+            backend.context_window() for name in self.providers
+            if (backend := self._backend(name)) is not None
+        ]
+        return min(windows) if windows else super().context_window()
+    
+    def ordered_providers(self) -> List[str]:
+        """Provider order for the next request (adaptive when enough samples exist)."""
+        if not self.adaptive:
+            return list(self.providers)
+        latencies = [
+            provider_latency.ttft_percentile(name, 50, self.ADAPTIVE_MIN_SAMPLES)
+            for name in self.providers
+        ]
+        if any(latency is None for latency in latencies):
+            return list(self.providers)
+        return [name for _, name in sorted(zip(latencies, self.providers), key=lambda item: item[0])]
+    
+    async def _race(
+        self,
+        start_attempt: Callable[[str, BaseLLM], Tuple[Awaitable, Any]],
+        first_output: bool = True
+    ):
         """
-        Generate text using Volcengine Doubao API.
+        Run attempts across providers with failover and optional hedging.
         
         Args:
-            prompt: The input prompt.
-            **kwargs: Additional parameters.
-            
+            start_attempt: Returns (awaitable, context) for a provider.
+            first_output: The awaitable resolves once the provider has produced
+                its first output (streaming): hedging applies and the wait is
+                recorded as time-to-first-token. False when it resolves with the
+                complete response: failover only, nothing recorded here.
+                
         Returns:
-            Generated text response.
+            Tuple of (provider name, result, context, start time) for the winner.
         """
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        remaining = [
+            (name, backend) for name in self.ordered_providers()
+            if (backend := self._backend(name)) is not None
+        ]
+        if not remaining:
+            raise ValueError("No configured providers available for routing.")
         
-        payload = {
-            "model": kwargs.get("model", self.model),
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": kwargs.get("temperature", 0.7),
-            "max_tokens": kwargs.get("max_tokens", 2048),
-            "stream": False
-        }
+        pending: Dict[asyncio.Task, Tuple[str, Any, float]] = {}
+        errors: List[str] = []
+        hedged = False
         
-        if "system_prompt" in kwargs:
-            payload["messages"].insert(0, {
-                "role": "system",
-                "content": kwargs["system_prompt"]
-            })
+        def launch() -> None:
+            name, backend = remaining.pop(0)
+            awaitable, context = start_attempt(name, backend)
+            pending[asyncio.ensure_future(awaitable)] = (name, context, time.monotonic())
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=payload
-            )
-            response.raise_for_status()
-            data = response.json()
-            return data["choices"][0]["message"]["content"]
-    
-    async def generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
-        """
-        Generate text in streaming mode using Volcengine Doubao API.
-        
-        Args:
-            prompt: The input prompt.
-            **kwargs: Additional parameters.
+        launch()
+        try:
+            while pending:
+                can_hedge = first_output and self.hedge_delay and remaining and not hedged
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=self.hedge_delay if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # First token budget exceeded: hedge on the next provider
+                    hedged = True
+                    launch()
+                    continue
+                
+                for task in done:
+                    name, context, started = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        if first_output:
+                            provider_latency.record_first_token(name, time.monotonic() - started)
+                        return name, task.result(), context, started
+                    
+                    provider_latency.record_failure(name, error)
+                    errors.append(f"{name}: {error}")
+                    if not is_failover_error(error) and not pending:
+                        raise error
+                    print(f"[Warning] Provider '{name}' failed, failing over: {error}")
+                
+                if not pending and remaining:
+                    launch()
             
-        Yields:
-            Generated text chunks.
-        """
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": kwargs.get("model", self.model),
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": kwargs.get("temperature", 0.7),
-            "max_tokens": kwargs.get("max_tokens", 2048),
-            "stream": True
-        }
+            raise RuntimeError("All providers failed: " + "; ".join(errors))
+        finally:
+            # Cancel the losing attempts and release their upstream connections
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            for _, context, _ in pending.values():
+                if hasattr(context, "aclose"):
+                    await context.aclose()
+    
+    async def _generate_text(self, prompt: str, **kwargs) -> str:
+        """Generate text on the first provider that answers (failover, no hedging)."""
+        name, content, _, started = await self._race(
+            lambda name, backend: (backend._call_text(prompt, retry=False, **kwargs), None),
+            first_output=False
+        )
+        provider_latency.record_success(name, time.monotonic() - started)
+        return content
+    
+    async def _generate_stream(self, prompt: str, **kwargs) -> AsyncGenerator[str, None]:
+        """Stream from the first provider that produces a token."""
+        async def first_chunk(stream: AsyncGenerator[str, None]) -> Optional[str]:
+            try:
+                return await stream.__anext__()
+            except StopAsyncIteration:
+                return None
         
-        if "system_prompt" in kwargs:
-            payload["messages"].insert(0, {
-                "role": "system",
-                "content": kwargs["system_prompt"]
-            })
+        def start(name: str, backend: BaseLLM):
+            stream = backend._call_stream(prompt, retry=False, **kwargs)
+            return first_chunk(stream), stream
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            async with client.stream(
-                "POST",
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=payload
-            ) as response:
-                response.raise_for_status()
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data = line[6:]
-                        if data == "[DONE]":
-                            break
-                        try:
-                            import json
-                            chunk = json.loads(data)
-                            content = chunk["choices"][0]["delta"].get("content", "")
-                            if content:
-                                yield content
-                        except (json.JSONDecodeError, KeyError, IndexError):
-                            continue
+        name, first, stream, started = await self._race(start)
+        try:
+            if first is not None:
+                yield first
+                async for chunk in stream:
+                    yield chunk
+            provider_latency.record_success(name, time.monotonic() - started)
+        except Exception as e:
+            provider_latency.record_failure(name, e)
+            raise
+        finally:
+            await stream.aclose()
+
+
+def is_failover_error(error: BaseException) -> bool:
+    """Whether an upstream error should move the request to another provider."""
+    if isinstance(error, (CircuitOpenError, RateLimitExceeded)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, httpx.TransportError)
 
 
 class LLMFactory:
     """
     Factory class for creating LLM instances.
     
+    Instances are cached by (model_type, api_key, base_url, model), so the hot
+    path is a dict lookup and per-provider state lives on a long-lived object.
+    Call `invalidate()` or `reload()` after changing credentials or config.
+    
     Usage:
         llm = LLMFactory.create("deepseek")
         response = await llm.generate_text("Hello, world!")
@@ -494,15 +902,33 @@ class LLMFactory:
         "deepseek": DeepSeekLLM,
         "doubao": DoubaoLLM,
         "claude": ClaudeLLM,
+        "auto": RoutingLLM,
     }
     
+    _instances: Dict[Tuple, BaseLLM] = {}
+    _reload_hooks: List[Callable[[], None]] = []
+    
     @classmethod
-    def create(cls, model_type: str, **kwargs) -> BaseLLM:
+    def _cache_key(cls, model_type: str, kwargs: Dict[str, Any]) -> Optional[Tuple]:
+        """Build the instance cache key, or None if kwargs are not cacheable."""
+        extra = set(kwargs) - {"api_key", "base_url", "model"}
+        if extra:
+            return None
+        return (
+            model_type,
+            kwargs.get("api_key"),
+            kwargs.get("base_url"),
+            kwargs.get("model"),
+        )
+    
+    @classmethod
+    def create(cls, model_type: str, use_cache: bool = True, **kwargs) -> BaseLLM:
         """
-        Create an LLM instance based on the model type.
+        Create (or reuse) an LLM instance based on the model type.
         
         Args:
-            model_type: The type of LLM ('deepseek' or 'doubao').
+            model_type: The type of LLM ('deepseek', 'claude' or 'doubao').
+            use_cache: Reuse a cached instance for the same configuration.
             **kwargs: Additional arguments passed to the LLM constructor.
             
         Returns:
@@ -520,20 +946,83 @@ class LLMFactory:
                 f"Supported types: {supported}"
             )
         
-        return cls._registry[model_type](**kwargs)
+        key = cls._cache_key(model_type, kwargs) if use_cache else None
+        if key is not None:
+            instance = cls._instances.get(key)
+            if instance is not None:
+                return instance
+        
+        instance = cls._registry[model_type](**kwargs)
+        if key is not None:
+            cls._instances[key] = instance
+        return instance
+    
+    @classmethod
+    def invalidate(cls, model_type: Optional[str] = None) -> int:
+        """
+        Drop cached instances.
+        
+        Args:
+            model_type: Only drop instances of this type; all if None.
+            
+        Returns:
+            Number of instances removed.
+        """
+        if model_type is None:
+            count = len(cls._instances)
+            cls._instances.clear()
+            return count
+        
+        model_type = model_type.lower().strip()
+        keys = [key for key in cls._instances if key[0] == model_type]
+        for key in keys:
+            del cls._instances[key]
+        return len(keys)
     
     @classmethod
-    def register(cls, name: str, llm_class: type) -> None:
+    def add_reload_hook(cls, hook: Callable[[], None]) -> None:
+        """Register a callback invoked by `reload()` after the cache is cleared."""
+        cls._reload_hooks.append(hook)
+    
+    @classmethod
+    def reload(cls) -> None:
+        """Re-read the .env file, drop all cached instances and run reload hooks."""
+        load_dotenv(override=True)
+        cls.invalidate()
+        for hook in cls._reload_hooks:
+            hook()
+    
+    @classmethod
+    def register(
+        cls,
+        name: str,
+        llm_class: Optional[type] = None,
+        base_url: Optional[str] = None,
+        model: Optional[str] = None,
+        **options
+    ) -> None:
         """
         Register a new LLM class.
         
+        OpenAI-compatible providers (Qwen, Moonshot, ...) need no class:
+            LLMFactory.register("moonshot", base_url="https://api.moonshot.cn/v1", model="moonshot-v1-8k")
+        
         Args:
             name: The name to register the LLM under.
             llm_class: The LLM class to register.
+            base_url: Base URL of an OpenAI-compatible API (when llm_class is omitted).
+            model: Default model of an OpenAI-compatible API (when llm_class is omitted).
+            **options: Extra options for `OpenAICompatibleLLM.define` (env_prefix, chat_path).
         """
+        if llm_class is None:
+            if not base_url or not model:
+                raise ValueError("base_url and model are required to register an OpenAI-compatible provider")
+            llm_class = OpenAICompatibleLLM.define(name, base_url, model, **options)
         if not issubclass(llm_class, BaseLLM):
             raise TypeError(f"{llm_class} must be a subclass of BaseLLM")
         cls._registry[name.lower()] = llm_class
+        cls.invalidate(name)
+        RoutingLLM._unavailable.pop(name.lower(), None)
     
     @classmethod
     def get_supported_models(cls) -> list:
@@ -541,3 +1030,5 @@ class LLMFactory:
         return list(cls._registry.keys())
 
 
+# Providers skipped by the router (missing API key etc.) are retried after a reload
+LLMFactory.add_reload_hook(RoutingLLM._unavailable.clear)
@@ -0,0 +1,325 @@
+"""
+Metrics - Prometheus 文本格式指标
+
+不依赖 prometheus_client，/metrics 直接输出 text exposition format（0.0.4）：
+- Counter / Histogram 在调用点直接累加，标签组合首次出现时创建，之后只做
+  一次字典查找和数值累加，不加锁、不分配对象；流式输出的每个分片不采集指标，
+  首字延迟和输出速率在流结束时各记录一次
+- 可由快照计算的指标（活跃流、缓存命中、熔断状态等）在抓取时通过回调生成
+
+指标定义集中在本模块，采集点分布在各服务中。
+
+配置（环境变量）：
+    METRICS_ENABLED: 是否启用 /metrics 和请求耗时采集，默认 true
+"""
+
+import time
+import inspect
+import functools
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import httpx
+
+from services.settings import env_flag
+from services.tracing import tracer
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认耗时分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# 首字延迟分桶（秒）
+TTFT_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0)
+# 输出速率分桶（tokens/秒）
+RATE_BUCKETS = (1, 5, 10, 20, 30, 40, 60, 80, 120, 200)
+# SQLite 查询耗时分桶（秒）
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """单调递增计数器"""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class _HistogramChild:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    """
+    固定分桶直方图
+
+    counts 存储各分桶自身的计数（非累计），输出时再累加为 Prometheus 的累计分桶。
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[Tuple[str, ...], _HistogramChild] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children[labels] = _HistogramChild(len(self.buckets) + 1)
+        child.counts[bisect_left(self.buckets, value)] += 1
+        child.sum += value
+        child.count += 1
+
+    def samples(self) -> Iterable[str]:
+        for labels, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(child.sum)}"
+            yield f"{self.name}_count{label_text} {child.count}"
+
+
+class CallbackMetric:
+    """抓取时由回调生成取值的指标（gauge 或 counter）"""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        callback: Callable[[], Dict[Tuple[str, ...], float]],
+        labelnames: Sequence[str] = (),
+        type: str = "gauge",
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.type = type
+        self.callback = callback
+
+    def samples(self) -> Iterable[str]:
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"[Warning] Metrics callback {self.name} failed: {e}")
+            return
+        for labels, value in values.items():
+            if value is None:
+                continue
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    """指标注册表，按注册顺序输出"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics: Dict[str, object] = {}
+
+    @classmethod
+    def from_env(cls) -> "MetricsRegistry":
+        return cls(enabled=env_flag("METRICS_ENABLED", True))
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def callback(
+        self,
+        name: str,
+        help: str,
+        callback: Callable[[], Dict[Tuple[str, ...], float]],
+        labelnames: Sequence[str] = (),
+        type: str = "gauge",
+    ) -> CallbackMetric:
+        """注册抓取时计算的指标，callback 返回 {标签值元组: 数值}"""
+        return self._register(CallbackMetric(name, help, callback, labelnames, type))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        lines.append("")
+        return "\n".join(lines)
+
+
+def error_status(error: BaseException) -> str:
+    """上游错误的状态标签：HTTP 状态码、timeout、connect_error、transport_error 或 other"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return str(error.response.status_code)
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, httpx.ConnectError):
+        return "connect_error"
+    if isinstance(error, httpx.TransportError):
+        return "transport_error"
+    return "other"
+
+
+# 进程级单例
+metrics = MetricsRegistry.from_env()
+
+# ============== 采集点直接累加的指标 ==============
+
+http_request_duration = metrics.histogram(
+    "http_request_duration_seconds",
+    "HTTP request duration by route (streaming responses until the last byte)",
+    ("method", "route", "status"),
+)
+llm_ttft = metrics.histogram(
+    "llm_time_to_first_token_seconds",
+    "Upstream time to first token",
+    ("provider", "model"),
+    TTFT_BUCKETS,
+)
+llm_output_rate = metrics.histogram(
+    "llm_output_tokens_per_second",
+    "Upstream streaming output rate after the first token",
+    ("provider", "model"),
+    RATE_BUCKETS,
+)
+llm_tokens = metrics.counter(
+    "llm_tokens_total",
+    "Tokens reported by upstream providers (type: prompt, completion, cached, cache_creation)",
+    ("provider", "model", "type"),
+)
+llm_requests = metrics.counter(
+    "llm_requests_total",
+    "Upstream calls by final status (ok, error, aborted)",
+    ("provider", "model", "status"),
+)
+llm_upstream_errors = metrics.counter(
+    "llm_upstream_errors_total",
+    "Failed upstream attempts (including retried ones) by status",
+    ("provider", "status"),
+)
+sqlite_query_duration = metrics.histogram(
+    "sqlite_query_duration_seconds",
+    "projects.db operation duration",
+    ("operation",),
+    DB_BUCKETS,
+)
+
+
+def timed_query(operation: str) -> Callable:
+    """记录 project_service 数据库操作耗时的装饰器（支持同步和异步函数，采样的请求中同时记录 db.<operation> span）"""
+    attributes = {"db.system": "sqlite", "db.operation": operation}
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    with tracer.span(f"db.{operation}", "CLIENT", **attributes):
+                        return await func(*args, **kwargs)
+                finally:
+                    sqlite_query_duration.observe(time.perf_counter() - started, operation)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with tracer.span(f"db.{operation}", "CLIENT", **attributes):
+                    return func(*args, **kwargs)
+            finally:
+                sqlite_query_duration.observe(time.perf_counter() - started, operation)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """
+    ASGI 中间件：按路由模板记录请求耗时
+
+    使用匹配到的路由模板（如 /api/projects/{project_id}）作为标签，
+    未匹配的路径统一记为 "unmatched"，避免标签基数膨胀。
+    """
+
+    def __init__(self, app, registry: Optional[MetricsRegistry] = None):
+        self.app = app
+        self.registry = registry or metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.registry.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], path, status)
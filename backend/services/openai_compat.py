@@ -0,0 +1,227 @@
+"""
+OpenAI-Compatible Transport - OpenAI 兼容格式的共享传输层
+
+DeepSeek、豆包以及 Claude 的 OpenAI 兼容代理都使用相同的 /chat/completions 协议。
+本模块统一负责：
+- 请求头和请求体构建
+- 非流式响应解析
+- 流式 SSE 解码
+- tokens 用量和上游请求 ID 记录（流式请求通过 stream_options.include_usage 获取用量）
+- 上游错误映射（提取上游返回的错误信息）
+
+连接池、JSON 解码、SSE 解析等优化只需要在这里修改一次。
+"""
+
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+import httpx
+
+from services.sse import aiter_sse, json_loads
+from services.usage import Usage
+
+
+def build_headers(api_key: str) -> Dict[str, str]:
+    """构建 Bearer 认证请求头"""
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+def build_chat_payload(
+    model: str,
+    prompt: str,
+    stream: bool,
+    system_prompt: Optional[str] = None,
+    temperature: float = 0.7,
+    max_tokens: int = 2048,
+    turns: Optional[List[Dict[str, str]]] = None,
+    stream_usage: bool = False,
+) -> Dict[str, Any]:
+    """
+    构建 /chat/completions 请求体
+
+    Args:
+        model: 模型名称或接入点 ID
+        prompt: 用户消息（提供 turns 时忽略）
+        stream: 是否流式输出
+        system_prompt: 系统提示词（为空时不发送 system 消息）
+        temperature: 生成温度
+        max_tokens: 最大生成 tokens
+        turns: 多轮对话消息（user / assistant），按原样发送以便命中上游前缀缓存
+        stream_usage: 流式请求是否要求上游在最后一个分片中返回 usage
+    """
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    if turns is None:
+        messages.append({"role": "user", "content": prompt})
+    else:
+        messages.extend(turns)
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": stream
+    }
+    if stream and stream_usage:
+        payload["stream_options"] = {"include_usage": True}
+    return payload
+
+
+def extract_message_content(data: Dict[str, Any]) -> str:
+    """解析非流式响应：{"choices": [{"message": {"content": "..."}}]}"""
+    return data["choices"][0]["message"]["content"]
+
+
+def extract_delta_content(chunk: Dict[str, Any]) -> str:
+    """解析流式分片：{"choices": [{"delta": {"content": "..."}}]}"""
+    choices = chunk.get("choices")
+    if not choices:
+        return ""
+    return (choices[0].get("delta") or {}).get("content") or ""
+
+
+class UpstreamHTTPError(httpx.HTTPStatusError):
+    """
+    上游返回错误状态码
+
+    继承 httpx.HTTPStatusError，熔断、重试和故障转移逻辑保持不变；
+    额外携带提供商名称和上游返回的错误信息。
+    """
+
+    def __init__(self, provider: str, response: httpx.Response, upstream_message: str):
+        self.provider = provider
+        self.status_code = response.status_code
+        self.upstream_message = upstream_message
+        message = f"{provider} API error {response.status_code}"
+        if upstream_message:
+            message += f": {upstream_message}"
+        super().__init__(message, request=response.request, response=response)
+
+
+def _error_message(body: bytes) -> str:
+    """从错误响应体中提取错误信息（兼容 OpenAI / Anthropic 格式）"""
+    if not body:
+        return ""
+    try:
+        data = json_loads(body)
+    except ValueError:
+        return body[:200].decode("utf-8", errors="replace")
+    error = data.get("error") if isinstance(data, dict) else None
+    if isinstance(error, dict):
+        return str(error.get("message") or error.get("type") or "")[:200]
+    if isinstance(error, str):
+        return error[:200]
+    if isinstance(data, dict) and data.get("message"):
+        return str(data["message"])[:200]
+    return ""
+
+
+async def raise_for_status(response: httpx.Response, provider: str) -> None:
+    """
+    检查响应状态码，失败时抛出 UpstreamHTTPError
+
+    流式响应会先读取错误响应体，以便获取上游错误信息。
+    """
+    if response.is_success:
+        return
+    body = await response.aread()
+    raise UpstreamHTTPError(provider, response, _error_message(body))
+
+
+async def iter_sse_json(
+    response: httpx.Response,
+    provider: str = "upstream",
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    增量解析 SSE 流并解码每个事件的 JSON，遇到 [DONE] 结束
+
+    部分代理用单个换行分隔事件，会被规范解析为一个多行 data 事件，
+    此时按行分别解码。无法解码的内容会记录警告后跳过，不中断整个流。
+
+    Yields:
+        解码后的 JSON 对象
+    """
+    async for event in aiter_sse(response):
+        data = event.data
+        if data == "[DONE]":
+            break
+        try:
+            yield json_loads(data)
+            continue
+        except ValueError as e:
+            if "\n" not in data:
+                print(f"[Warning] Malformed SSE event from {provider} (event={event.event}): {e}; data={data[:120]!r}")
+                continue
+
+        for line in data.split("\n"):
+            if line.startswith("data:"):
+                line = line[5:].lstrip()
+            if not line:
+                continue
+            if line == "[DONE]":
+                return
+            try:
+                yield json_loads(line)
+            except ValueError as e:
+                print(f"[Warning] Malformed SSE data line from {provider}: {e}; data={line[:120]!r}")
+
+
+class OpenAICompatTransport:
+    """
+    OpenAI 兼容 /chat/completions 接口的传输层
+
+    Usage:
+        transport = OpenAICompatTransport("deepseek", "https://api.deepseek.com/v1/chat/completions", api_key)
+        text = await transport.complete(client, payload)
+    """
+
+    def __init__(self, provider: str, url: str, api_key: str):
+        self.provider = provider
+        self.url = url
+        self.headers = build_headers(api_key)
+
+    async def complete(
+        self,
+        client: httpx.AsyncClient,
+        payload: Dict[str, Any],
+        usage: Optional[Usage] = None,
+        timeout: Any = httpx.USE_CLIENT_DEFAULT,
+    ) -> str:
+        """
+        发送非流式请求并返回生成文本，用量写入 usage
+
+        默认使用共享客户端按 {PROVIDER}_HTTP_TIMEOUT 配置的超时
+        """
+        response = await client.post(self.url, headers=self.headers, json=payload, timeout=timeout)
+        await raise_for_status(response, self.provider)
+        data = response.json()
+        if usage is not None:
+            usage.update(data.get("usage"))
+            usage.set_request_id(response, data.get("id"))
+        return extract_message_content(data)
+
+    async def stream(
+        self,
+        client: httpx.AsyncClient,
+        payload: Dict[str, Any],
+        usage: Optional[Usage] = None,
+        timeout: Any = httpx.USE_CLIENT_DEFAULT,
+    ) -> AsyncGenerator[str, None]:
+        """发送流式请求并逐个返回文本分片，用量写入 usage（超时同 complete）"""
+        async with client.stream("POST", self.url, headers=self.headers, json=payload, timeout=timeout) as response:
+            await raise_for_status(response, self.provider)
+            if usage is not None:
+                usage.set_request_id(response)
+            async for chunk in iter_sse_json(response, self.provider):
+                if usage is not None:
+                    # include_usage 时最后一个分片的 choices 为空，只带 usage
+                    if chunk.get("usage"):
+                        usage.update(chunk["usage"])
+                    if usage.request_id is None:
+                        usage.set_request_id(fallback=chunk.get("id"))
+                content = extract_delta_content(chunk)
+                if content:
+                    yield content
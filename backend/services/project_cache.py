@@ -0,0 +1,247 @@
+"""
+Project Cache - 项目对象的进程内读穿缓存
+
+每次带 project_id 的生成请求、以及项目接口中的归属校验都会读取并解析项目
+（persona_settings 需要 JSON 解码和 Pydantic 校验）。本模块缓存解析好的 Project：
+- 按项目ID缓存单个项目，按 user_id 缓存项目列表及当前激活的项目ID，均为 LRU
+- project_service 在 create / update / delete / set_active 提交后精确失效相关项
+- 读未命中时记录缓存代数，期间发生过失效则不回填，避免把旧数据写回缓存
+- Project 是可变的 pydantic 模型：回填时保存副本，命中时返回副本（深拷贝），
+  调用方修改返回的对象不会影响缓存
+- 多个 uvicorn worker 共用同一个 projects.db 时，后台任务按 PROJECT_CACHE_POLL_INTERVAL
+  在数据库线程中检查 SQLite 的 PRAGMA data_version（Database.changed_externally_async）；
+  其它进程提交过修改则清空整个缓存并通知项目变更监听器（如 System Prompt 缓存），
+  无需外部服务。本进程的提交由 Database 在提交时记录，不会触发清空
+- 后台任务在事件循环中首次读缓存时启动；没有事件循环的线程（同步接口）中
+  读缓存时直接检查（按同样的间隔）
+
+配置（环境变量）：
+    PROJECT_CACHE_ENABLED: 是否启用，默认 true
+    PROJECT_CACHE_MAX_PROJECTS: 最多缓存的项目数，默认 4096
+    PROJECT_CACHE_MAX_USERS: 最多缓存的用户项目列表数，默认 1024
+    PROJECT_CACHE_POLL_INTERVAL: data_version 检查间隔（秒），默认 1，0 表示关闭（单 worker 部署）
+"""
+
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from models.project import Project
+from services.database import Database
+from services.settings import env_float, env_int, env_flag
+
+
+class ProjectCache:
+    """按项目ID / user_id 缓存 Project 对象"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_projects: int = 4096,
+        max_users: int = 1024,
+        poll_interval: float = 1.0,
+    ):
+        self.enabled = enabled
+        self.max_projects = max(1, max_projects)
+        self.max_users = max(1, max_users)
+        self.poll_interval = max(0.0, poll_interval)
+        # 每次失效递增，读未命中回填前用于检测并发写入
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.external_changes = 0
+        self._projects: "OrderedDict[str, Project]" = OrderedDict()
+        # user_id -> (项目列表, 激活的项目ID)
+        self._lists: "OrderedDict[str, Tuple[List[Project], Optional[UUID]]]" = OrderedDict()
+        self._database: Optional[Database] = None
+        self._on_external_change: Optional[Callable[[], None]] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self._watch_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._next_poll = 0.0
+        self._poll_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ProjectCache":
+        return cls(
+            enabled=env_flag("PROJECT_CACHE_ENABLED", True),
+            max_projects=env_int("PROJECT_CACHE_MAX_PROJECTS", 4096),
+            max_users=env_int("PROJECT_CACHE_MAX_USERS", 1024),
+            poll_interval=env_float("PROJECT_CACHE_POLL_INTERVAL", 1.0),
+        )
+
+    def watch(self, database: Database, on_external_change: Optional[Callable[[], None]] = None) -> None:
+        """
+        设置跨进程失效检测
+
+        Args:
+            database: 项目数据库（提供 changed_externally / changed_externally_async）
+            on_external_change: 检测到其它进程提交修改并清空缓存后调用
+        """
+        self._database = database
+        self._on_external_change = on_external_change
+
+    def _poll(self) -> None:
+        """事件循环中确保后台检查任务在运行；没有事件循环时按间隔直接检查"""
+        if self._database is None or self.poll_interval <= 0:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            if self._watch_loop is not loop or self._watch_task is None or self._watch_task.done():
+                self._watch_loop = loop
+                self._watch_task = loop.create_task(self._watch())
+            return
+        
+        now = time.monotonic()
+        if now < self._next_poll or not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_poll = now + self.poll_interval
+            changed = self._database.changed_externally()
+        except Exception as e:
+            print(f"[Warning] Project cache data_version check failed: {e}")
+            return
+        finally:
+            self._poll_lock.release()
+        if changed:
+            self._external_change()
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                changed = await self._database.changed_externally_async()
+            except Exception as e:
+                print(f"[Warning] Project cache data_version check failed: {e}")
+                continue
+            if changed:
+                self._external_change()
+
+    def _external_change(self) -> None:
+        self.external_changes += 1
+        self.clear()
+        if self._on_external_change is not None:
+            self._on_external_change()
+
+    async def aclose(self) -> None:
+        """停止后台检查任务"""
+        task, self._watch_task = self._watch_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def get(self, project_id: UUID) -> Optional[Project]:
+        if not self.enabled:
+            return None
+        self._poll()
+        key = str(project_id)
+        project = self._projects.get(key)
+        if project is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._projects.move_to_end(key)
+        return project.model_copy(deep=True)
+
+    def get_list(self, user_id: str) -> Optional[Tuple[List[Project], Optional[UUID]]]:
+        """Returns: (项目列表, 激活的项目ID)，未缓存时为 None"""
+        if not self.enabled:
+            return None
+        self._poll()
+        entry = self._lists.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._lists.move_to_end(user_id)
+        projects, active_project_id = entry
+        return [project.model_copy(deep=True) for project in projects], active_project_id
+
+    def put(self, project: Optional[Project], generation: int) -> None:
+        """
+        回填单个项目
+
+        Args:
+            project: 读取到的项目，None（不存在）不缓存
+            generation: 读取数据库前的 self.generation
+        """
+        if not self.enabled or project is None or generation != self.generation:
+            return
+        self._put_project(project.model_copy(deep=True))
+
+    def put_list(
+        self,
+        user_id: str,
+        projects: List[Project],
+        active_project_id: Optional[UUID],
+        generation: int,
+    ) -> None:
+        """回填用户的项目列表和激活的项目ID（同时回填其中的每个项目）"""
+        if not self.enabled or generation != self.generation:
+            return
+        copies = [project.model_copy(deep=True) for project in projects]
+        self._lists[user_id] = (copies, active_project_id)
+        self._lists.move_to_end(user_id)
+        while len(self._lists) > self.max_users:
+            self._lists.popitem(last=False)
+        for project in copies:
+            self._put_project(project)
+
+    def _put_project(self, project: Project) -> None:
+        """缓存 project（调用方传入的副本，单个项目回填时由 put() 复制）"""
+        key = str(project.id)
+        self._projects[key] = project
+        self._projects.move_to_end(key)
+        while len(self._projects) > self.max_projects:
+            self._projects.popitem(last=False)
+
+    def invalidate(self, project_id: Optional[UUID] = None, user_id: Optional[str] = None) -> None:
+        """
+        使项目及其所属用户的列表失效
+
+        Args:
+            project_id: 被修改的项目
+            user_id: 项目所属用户；为空时从缓存的项目中获取，仍未知时清空所有列表
+        """
+        self.generation += 1
+        self.invalidations += 1
+        if project_id is not None:
+            project = self._projects.pop(str(project_id), None)
+            if user_id is None and project is not None:
+                user_id = project.user_id
+        if user_id is not None:
+            self._lists.pop(user_id, None)
+        elif project_id is not None:
+            self._lists.clear()
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._projects.clear()
+        self._lists.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "projects": len(self._projects),
+            "users": len(self._lists),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+            "external_changes": self.external_changes,
+            "poll_interval": self.poll_interval,
+        }
+
+
+# 进程级单例
+project_cache = ProjectCache.from_env()
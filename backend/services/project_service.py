@@ -2,68 +2,123 @@
 Project Service - 项目数据持久化服务
 
 使用 SQLite 存储项目数据，支持 CRUD 操作
+
+查询在连接池（services.database）的专用数据库线程中执行：
+- 异步接口（*_async）供路由使用，不阻塞事件循环；写操作进入单写线程队列，
+  并发的小写入合并为一个事务提交
+- 同名的同步函数保留原有签名，在调用线程中借用池中连接执行
+
+解析后的 Project 由 services.project_cache 缓存（按项目ID和用户），写操作提交后失效。
+
+路由使用的 *_owned_* 写操作把归属校验放进语句本身（WHERE id = ? AND user_id = ?
+RETURNING *），一次调用只执行一条语句；只有未命中时才再查一次以区分
+ProjectNotFound（404）和 ProjectForbidden（403）。
 """
 
 import sqlite3
 import json
+import base64
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Callable, Dict, Optional, List, Tuple, Union
 from uuid import UUID, uuid4
 from pathlib import Path
 
 from models.project import Project, ProjectCreate, ProjectUpdate, PersonaSettings
+from services.metrics import timed_query
+from services.database import Database
+from services.project_cache import project_cache
 
 
 # 数据库文件路径
 DB_PATH = Path(__file__).parent.parent / "projects.db"
 
+# 连接池（长连接 + 预编译语句缓存 + 专用数据库线程）
+db = Database.from_env(DB_PATH)
+
+# 列表投影可选的字段（与 projects 表的列一一对应）
+PROJECT_FIELDS = tuple(Project.model_fields)
+
+# fields=summary：除人设配置外的全部字段，不解码 persona_settings
+SUMMARY_FIELDS = tuple(field for field in PROJECT_FIELDS if field != "persona_settings")
+
+# 分页每页最大条数
+MAX_PAGE_SIZE = 200
+
+class ProjectNotFound(LookupError):
+    """项目不存在"""
+
+
+class ProjectForbidden(PermissionError):
+    """项目不属于当前用户"""
+
+
+# 项目变更监听器（如 System Prompt 缓存），项目被修改或删除后以项目ID调用；
+# 检测到其它进程修改了数据库时以 None 调用（表示全部失效）
+_change_listeners: List[Callable[[Optional[UUID]], None]] = []
+
+
+def add_change_listener(listener: Callable[[Optional[UUID]], None]) -> None:
+    """注册项目变更监听器"""
+    _change_listeners.append(listener)
+
+
+def _notify_change(project_id: Optional[UUID]) -> None:
+    for listener in _change_listeners:
+        try:
+            listener(project_id)
+        except Exception as e:
+            print(f"[Warning] Project change listener failed: {e}")
+
 
 def get_db_connection():
-    """获取数据库连接"""
+    """获取独立的数据库连接（不经过连接池，调用方负责关闭）"""
     conn = sqlite3.connect(str(DB_PATH))
     conn.row_factory = sqlite3.Row
     return conn
 
 
-def init_db():
-    """初始化数据库表"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS projects (
-            id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            industry TEXT DEFAULT '通用',
-            avatar_letter TEXT DEFAULT '',
-            avatar_color TEXT DEFAULT '#3B82F6',
-            persona_settings TEXT DEFAULT '{}',
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            is_active INTEGER DEFAULT 0
-        )
-    """)
-    
-    # 创建用户-活跃项目映射表
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_active_project (
-            user_id TEXT PRIMARY KEY,
-            project_id TEXT NOT NULL,
-            updated_at TEXT NOT NULL
-        )
-    """)
+def init_db(database: Optional[Database] = None):
+    """初始化数据库：启用 WAL 等连接参数，创建表和索引（默认为进程级连接池）"""
+    database = database or db
+    database.bootstrap()
     
-    # 创建索引
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_projects_user_id ON projects(user_id)
-    """)
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_projects_updated_at ON projects(updated_at DESC)
-    """)
-    
-    conn.commit()
-    conn.close()
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS projects (
+                id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                industry TEXT DEFAULT '通用',
+                avatar_letter TEXT DEFAULT '',
+                avatar_color TEXT DEFAULT '#3B82F6',
+                persona_settings TEXT DEFAULT '{}',
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                is_active INTEGER DEFAULT 0
+            )
+        """)
+        
+        # 创建用户-活跃项目映射表
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_active_project (
+                user_id TEXT PRIMARY KEY,
+                project_id TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        
+        # 创建索引（用户项目列表按 (updated_at, id) 倒序分页，复合索引覆盖原 user_id 单列索引）
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_projects_user_updated ON projects(user_id, updated_at DESC, id DESC)
+        """)
+        cursor.execute("""
+            DROP INDEX IF EXISTS idx_projects_user_id
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_projects_updated_at ON projects(updated_at DESC)
+        """)
 
 
 def row_to_project(row: sqlite3.Row) -> Project:
@@ -84,44 +139,81 @@ def row_to_project(row: sqlite3.Row) -> Project:
     )
 
 
-def get_projects_by_user(user_id: str) -> List[Project]:
-    """获取用户的所有项目，按更新时间倒序"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT * FROM projects 
-        WHERE user_id = ? 
-        ORDER BY updated_at DESC
-    """, (user_id,))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
-    return [row_to_project(row) for row in rows]
+def row_to_fields(row: sqlite3.Row, fields: Tuple[str, ...]) -> Dict[str, Any]:
+    """
+    将数据库行转换为只包含指定字段的字典
 
+    不包含 persona_settings 时跳过人设 JSON 解码和校验。
+    """
+    result: Dict[str, Any] = {}
+    for field in fields:
+        value = row[field]
+        if field == 'id':
+            value = UUID(value)
+        elif field in ('created_at', 'updated_at'):
+            value = datetime.fromisoformat(value)
+        elif field == 'is_active':
+            value = bool(value)
+        elif field == 'persona_settings':
+            value = PersonaSettings(**(json.loads(value) if value else {}))
+        elif field == 'industry':
+            value = value or '通用'
+        elif field == 'avatar_color':
+            value = value or '#3B82F6'
+        elif field == 'avatar_letter':
+            value = value or ''
+        result[field] = value
+    return result
 
-def get_project_by_id(project_id: UUID) -> Optional[Project]:
-    """根据 ID 获取项目"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM projects WHERE id = ?", (str(project_id),))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return row_to_project(row)
-    return None
 
+def parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """
+    解析列表投影参数
 
-def create_project(user_id: str, data: ProjectCreate) -> Project:
-    """创建新项目"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+    Args:
+        fields: "summary" 或逗号分隔的字段名；为空时返回 None（完整项目）
+
+    Returns:
+        字段元组（始终包含 id，按 PROJECT_FIELDS 顺序）
+
+    Raises:
+        ValueError: 包含未知字段
+    """
+    if not fields:
+        return None
+    if fields.strip() == "summary":
+        return SUMMARY_FIELDS
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(PROJECT_FIELDS)
+    if unknown:
+        raise ValueError(f"未知字段: {', '.join(sorted(unknown))}。可选字段: {', '.join(PROJECT_FIELDS)}")
+    requested.add("id")
+    return tuple(field for field in PROJECT_FIELDS if field in requested)
+
+
+def encode_cursor(updated_at: str, project_id: str) -> str:
+    """分页游标：最后一条记录的 (updated_at, id)"""
+    return base64.urlsafe_b64encode(f"{updated_at}|{project_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    Raises:
+        ValueError: 游标格式无效
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        updated_at, project_id = raw.split("|", 1)
+        datetime.fromisoformat(updated_at)
+        UUID(project_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("无效的分页游标")
+    return updated_at, project_id
+
+
+def new_project(user_id: str, data: ProjectCreate) -> Project:
+    """根据创建请求构建新项目（尚未写入数据库）"""
     now = datetime.now()
-    project_id = uuid4()
     
     # 提取首字母作为头像显示
     avatar_letter = data.name[0].upper() if data.name else 'P'
@@ -131,54 +223,123 @@ def create_project(user_id: str, data: ProjectCreate) -> Project:
     import random
     avatar_color = random.choice(colors)
     
-    # 处理人设配置
-    persona_settings = data.persona_settings or PersonaSettings()
-    
-    cursor.execute("""
-        INSERT INTO projects (id, user_id, name, industry, avatar_letter, avatar_color, persona_settings, created_at, updated_at, is_active)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        str(project_id),
-        user_id,
-        data.name,
-        data.industry,
-        avatar_letter,
-        avatar_color,
-        json.dumps(persona_settings.model_dump()),
-        now.isoformat(),
-        now.isoformat(),
-        0
-    ))
-    
-    conn.commit()
-    conn.close()
-    
     return Project(
-        id=project_id,
+        id=uuid4(),
         user_id=user_id,
         name=data.name,
         industry=data.industry,
         avatar_letter=avatar_letter,
         avatar_color=avatar_color,
-        persona_settings=persona_settings,
+        persona_settings=data.persona_settings or PersonaSettings(),
         created_at=now,
         updated_at=now,
         is_active=False
     )
 
 
-def update_project(project_id: UUID, data: ProjectUpdate) -> Optional[Project]:
-    """更新项目"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+# ============== 查询实现（第一个参数为池中连接，可在数据库线程中执行） ==============
+
+# 激活项目ID作为标量子查询随列表一起返回（用户没有项目时为空列表，激活项目ID为 None）
+_ACTIVE_PROJECT_COLUMN = "(SELECT project_id FROM user_active_project WHERE user_id = :user_id) AS active_project_id"
+
+
+def _select_projects_by_user(conn: sqlite3.Connection, user_id: str) -> List[Project]:
+    rows = conn.execute("""
+        SELECT * FROM projects 
+        WHERE user_id = ? 
+        ORDER BY updated_at DESC, id DESC
+    """, (user_id,)).fetchall()
     
-    # 先获取现有项目
-    project = get_project_by_id(project_id)
-    if not project:
-        conn.close()
-        return None
+    return [row_to_project(row) for row in rows]
+
+
+def _select_projects_with_active(conn: sqlite3.Connection, user_id: str) -> Tuple[List[Project], Optional[UUID]]:
+    """一条语句同时读取用户的项目列表和激活的项目ID"""
+    rows = conn.execute(f"""
+        SELECT *, {_ACTIVE_PROJECT_COLUMN} FROM projects 
+        WHERE user_id = :user_id 
+        ORDER BY updated_at DESC, id DESC
+    """, {"user_id": user_id}).fetchall()
+    
+    active_project_id = UUID(rows[0]['active_project_id']) if rows and rows[0]['active_project_id'] else None
+    return [row_to_project(row) for row in rows], active_project_id
+
+
+def _select_projects_page(
+    conn: sqlite3.Connection,
+    user_id: str,
+    limit: Optional[int],
+    after: Optional[Tuple[str, str]],
+    fields: Optional[Tuple[str, ...]],
+) -> Tuple[List[Union[Project, Dict[str, Any]]], Optional[str], Optional[UUID]]:
+    """
+    按 (updated_at, id) 倒序的 keyset 分页，使用 idx_projects_user_updated
+
+    Returns:
+        (项目列表, 下一页游标, 激活的项目ID)；空页的激活项目ID为 None
+    """
+    if fields is None:
+        columns = "*"
+    else:
+        # 游标需要 updated_at 和 id；字段名来自 PROJECT_FIELDS 白名单
+        columns = ", ".join(dict.fromkeys(fields + ("id", "updated_at")))
+    where = "user_id = :user_id"
+    params: Dict[str, Any] = {"user_id": user_id}
+    if after is not None:
+        where += " AND (updated_at, id) < (:after_updated_at, :after_id)"
+        params["after_updated_at"], params["after_id"] = after
+    sql = f"SELECT {columns}, {_ACTIVE_PROJECT_COLUMN} FROM projects WHERE {where} ORDER BY updated_at DESC, id DESC"
+    if limit is not None:
+        # 多取一条判断是否还有下一页
+        sql += " LIMIT :limit"
+        params["limit"] = limit + 1
+    rows = conn.execute(sql, params).fetchall()
+    
+    active_project_id = UUID(rows[0]['active_project_id']) if rows and rows[0]['active_project_id'] else None
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['updated_at'], rows[-1]['id'])
+    if fields is None:
+        return [row_to_project(row) for row in rows], next_cursor, active_project_id
+    return [row_to_fields(row, fields) for row in rows], next_cursor, active_project_id
+
+
+def _select_project(conn: sqlite3.Connection, project_id: UUID) -> Optional[Project]:
+    row = conn.execute("SELECT * FROM projects WHERE id = ?", (str(project_id),)).fetchone()
     
-    # 构建更新字段
+    if row:
+        return row_to_project(row)
+    return None
+
+
+def _insert_project(conn: sqlite3.Connection, project: Project) -> Project:
+    conn.execute("""
+        INSERT INTO projects (id, user_id, name, industry, avatar_letter, avatar_color, persona_settings, created_at, updated_at, is_active)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        str(project.id),
+        project.user_id,
+        project.name,
+        project.industry,
+        project.avatar_letter,
+        project.avatar_color,
+        json.dumps(project.persona_settings.model_dump()),
+        project.created_at.isoformat(),
+        project.updated_at.isoformat(),
+        0
+    ))
+    return project
+
+
+def _ownership_error(conn: sqlite3.Connection, project_id: UUID) -> Exception:
+    """限定 user_id 的语句未命中时，区分项目不存在和不属于当前用户"""
+    row = conn.execute("SELECT 1 FROM projects WHERE id = ?", (str(project_id),)).fetchone()
+    return ProjectForbidden(str(project_id)) if row else ProjectNotFound(str(project_id))
+
+
+def _update_assignments(data: ProjectUpdate) -> Tuple[List[str], List[Any]]:
+    """构建 UPDATE 的 SET 子句；没有字段被修改时为空"""
     updates = []
     params = []
     
@@ -200,77 +361,446 @@ def update_project(project_id: UUID, data: ProjectUpdate) -> Optional[Project]:
         now = datetime.now()
         updates.append("updated_at = ?")
         params.append(now.isoformat())
-        params.append(str(project_id))
-        
-        cursor.execute(f"""
+    
+    return updates, params
+
+
+def _update_project(conn: sqlite3.Connection, project_id: UUID, data: ProjectUpdate) -> Tuple[Optional[Project], bool]:
+    """Returns: (更新后的项目, 是否有字段被修改)"""
+    updates, params = _update_assignments(data)
+    if not updates:
+        return _select_project(conn, project_id), False
+    
+    row = conn.execute(f"""
+        UPDATE projects 
+        SET {', '.join(updates)}
+        WHERE id = ?
+        RETURNING *
+    """, params + [str(project_id)]).fetchone()
+    
+    return (row_to_project(row), True) if row else (None, False)
+
+
+def _update_owned_project(
+    conn: sqlite3.Connection, project_id: UUID, user_id: str, data: ProjectUpdate
+) -> Tuple[Project, bool]:
+    """
+    Returns: (更新后的项目, 是否有字段被修改)
+
+    Raises:
+        ProjectNotFound / ProjectForbidden
+    """
+    updates, params = _update_assignments(data)
+    if updates:
+        row = conn.execute(f"""
             UPDATE projects 
             SET {', '.join(updates)}
-            WHERE id = ?
-        """, params)
-        
-        conn.commit()
-    
-    conn.close()
-    
-    return get_project_by_id(project_id)
+            WHERE id = ? AND user_id = ?
+            RETURNING *
+        """, params + [str(project_id), user_id]).fetchone()
+    else:
+        row = conn.execute(
+            "SELECT * FROM projects WHERE id = ? AND user_id = ?", (str(project_id), user_id)
+        ).fetchone()
+    
+    if row is None:
+        raise _ownership_error(conn, project_id)
+    return row_to_project(row), bool(updates)
 
 
-def delete_project(project_id: UUID) -> bool:
-    """删除项目"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("DELETE FROM projects WHERE id = ?", (str(project_id),))
-    deleted = cursor.rowcount > 0
-    
-    conn.commit()
-    conn.close()
-    
-    return deleted
+def _delete_project(conn: sqlite3.Connection, project_id: UUID) -> Optional[str]:
+    """Returns: 被删除项目的 user_id，项目不存在时为 None"""
+    row = conn.execute("DELETE FROM projects WHERE id = ? RETURNING user_id", (str(project_id),)).fetchone()
+    return row['user_id'] if row else None
 
 
-def get_active_project(user_id: str) -> Optional[UUID]:
-    """获取用户当前激活的项目ID"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
+def _delete_owned_project(conn: sqlite3.Connection, project_id: UUID, user_id: str) -> None:
+    """
+    Raises:
+        ProjectNotFound / ProjectForbidden
+    """
+    row = conn.execute(
+        "DELETE FROM projects WHERE id = ? AND user_id = ? RETURNING id", (str(project_id), user_id)
+    ).fetchone()
+    if row is None:
+        raise _ownership_error(conn, project_id)
+
+
+def _select_active_project(conn: sqlite3.Connection, user_id: str) -> Optional[UUID]:
+    row = conn.execute("""
         SELECT project_id FROM user_active_project WHERE user_id = ?
-    """, (user_id,))
-    
-    row = cursor.fetchone()
-    conn.close()
+    """, (user_id,)).fetchone()
     
     if row:
         return UUID(row['project_id'])
     return None
 
 
-def set_active_project(user_id: str, project_id: UUID) -> bool:
-    """设置用户当前激活的项目"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+def _select_active_project_detail(conn: sqlite3.Connection, user_id: str) -> Tuple[Optional[UUID], Optional[Project]]:
+    """
+    一条语句读取激活的项目
+
+    Returns:
+        (激活的项目ID, 项目)；没有激活项目时均为 None，激活的项目已被删除时项目为 None
+    """
+    row = conn.execute("""
+        SELECT a.project_id AS active_project_id, p.*
+        FROM user_active_project a
+        LEFT JOIN projects p ON p.id = a.project_id
+        WHERE a.user_id = ?
+    """, (user_id,)).fetchone()
+    
+    if row is None:
+        return None, None
+    return UUID(row['active_project_id']), row_to_project(row) if row['id'] else None
+
+
+def _upsert_active_project(conn: sqlite3.Connection, user_id: str, project_id: UUID) -> Optional[str]:
+    """Returns: 项目的 user_id（用于失效缓存），项目不存在时为 None"""
     now = datetime.now()
     
     # 使用 REPLACE INTO 实现 upsert
-    cursor.execute("""
+    conn.execute("""
         REPLACE INTO user_active_project (user_id, project_id, updated_at)
         VALUES (?, ?, ?)
     """, (user_id, str(project_id), now.isoformat()))
     
     # 更新项目的 updated_at 时间
-    cursor.execute("""
-        UPDATE projects SET updated_at = ? WHERE id = ?
-    """, (now.isoformat(), str(project_id)))
+    row = conn.execute("""
+        UPDATE projects SET updated_at = ? WHERE id = ? RETURNING user_id
+    """, (now.isoformat(), str(project_id))).fetchone()
     
-    conn.commit()
-    conn.close()
+    return row['user_id'] if row else None
+
+
+def _activate_owned_project(conn: sqlite3.Connection, user_id: str, project_id: UUID) -> Project:
+    """
+    校验归属并设置为激活项目（同一事务中的两条语句）
+
+    Returns: 更新了 updated_at 的项目
+
+    Raises:
+        ProjectNotFound / ProjectForbidden
+    """
+    now = datetime.now().isoformat()
+    row = conn.execute("""
+        UPDATE projects SET updated_at = ? WHERE id = ? AND user_id = ? RETURNING *
+    """, (now, str(project_id), user_id)).fetchone()
+    if row is None:
+        raise _ownership_error(conn, project_id)
+    
+    conn.execute("""
+        REPLACE INTO user_active_project (user_id, project_id, updated_at)
+        VALUES (?, ?, ?)
+    """, (user_id, str(project_id), now))
+    return row_to_project(row)
+
+
+# ============== 数据库读取（计入 sqlite_query_duration，缓存命中不计入） ==============
+
+@timed_query("get_projects_by_user")
+async def _load_projects_by_user_async(user_id: str) -> Tuple[List[Project], Optional[UUID]]:
+    return await db.run(_select_projects_with_active, user_id)
+
+
+@timed_query("get_project_by_id")
+async def _load_project_async(project_id: UUID) -> Optional[Project]:
+    return await db.run(_select_project, project_id)
+
+
+@timed_query("get_projects_by_user")
+def _load_projects_by_user(user_id: str) -> Tuple[List[Project], Optional[UUID]]:
+    with db.connection() as conn:
+        return _select_projects_with_active(conn, user_id)
+
+
+@timed_query("get_project_by_id")
+def _load_project(project_id: UUID) -> Optional[Project]:
+    with db.connection() as conn:
+        return _select_project(conn, project_id)
+
+
+def _invalidate(project_id: Optional[UUID], user_id: Optional[str], notify: bool = True) -> None:
+    """
+    写操作提交后失效项目缓存，并通知变更监听器
+
+    异步写操作通过 db.write(on_commit=...) 在提交后由写队列调用，
+    请求在提交后被取消（客户端断开、服务关闭）时也不会漏掉失效
+    """
+    project_cache.invalidate(project_id, user_id)
+    if notify and project_id is not None:
+        _notify_change(project_id)
+
+
+# ============== 异步接口（读操作在数据库线程池、写操作在单写线程中执行） ==============
+
+async def get_projects_with_active_async(user_id: str) -> Tuple[List[Project], Optional[UUID]]:
+    """获取用户的所有项目（按更新时间倒序）和当前激活的项目ID"""
+    entry = project_cache.get_list(user_id)
+    if entry is None:
+        generation = project_cache.generation
+        entry = await _load_projects_by_user_async(user_id)
+        project_cache.put_list(user_id, *entry, generation)
+    return entry
+
+
+async def get_projects_by_user_async(user_id: str) -> List[Project]:
+    """获取用户的所有项目，按更新时间倒序"""
+    projects, _ = await get_projects_with_active_async(user_id)
+    return projects
+
+
+@timed_query("get_projects_page")
+async def get_projects_page_async(
+    user_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+) -> Tuple[List[Union[Project, Dict[str, Any]]], Optional[str], Optional[UUID]]:
+    """
+    分页获取用户的项目（按更新时间倒序）和当前激活的项目ID，可只返回部分字段
+
+    Args:
+        user_id: 用户ID
+        limit: 每页条数（最多 MAX_PAGE_SIZE），为空时返回游标之后的全部项目
+        cursor: 上一页返回的 next_cursor
+        fields: "summary" 或逗号分隔的字段名，为空时返回完整项目
+
+    Returns:
+        (项目列表, 下一页游标, 激活的项目ID)；没有更多项目时游标为 None，
+        空页的激活项目ID为 None
+
+    Raises:
+        ValueError: 游标或字段无效
+    """
+    limit = min(limit, MAX_PAGE_SIZE) if limit is not None else None
+    after = decode_cursor(cursor) if cursor else None
+    return await db.run(_select_projects_page, user_id, limit, after, parse_fields(fields))
+
+
+async def get_project_by_id_async(project_id: UUID) -> Optional[Project]:
+    """根据 ID 获取项目"""
+    project = project_cache.get(project_id)
+    if project is None:
+        generation = project_cache.generation
+        project = await _load_project_async(project_id)
+        project_cache.put(project, generation)
+    return project
+
+
+@timed_query("create_project")
+async def create_project_async(user_id: str, data: ProjectCreate) -> Project:
+    """创建新项目"""
+    return await db.write(
+        _insert_project,
+        new_project(user_id, data),
+        on_commit=lambda _: _invalidate(None, user_id),
+    )
+
+
+@timed_query("update_project")
+async def update_project_async(project_id: UUID, data: ProjectUpdate) -> Optional[Project]:
+    """更新项目"""
+    def on_commit(result: Tuple[Optional[Project], bool]) -> None:
+        project, changed = result
+        if changed:
+            _invalidate(project_id, project.user_id if project else None)
     
+    project, _ = await db.write(_update_project, project_id, data, on_commit=on_commit)
+    return project
+
+
+@timed_query("delete_project")
+async def delete_project_async(project_id: UUID) -> bool:
+    """删除项目"""
+    def on_commit(owner: Optional[str]) -> None:
+        if owner is not None:
+            _invalidate(project_id, owner)
+    
+    owner = await db.write(_delete_project, project_id, on_commit=on_commit)
+    return owner is not None
+
+
+@timed_query("get_active_project")
+async def get_active_project_async(user_id: str) -> Optional[UUID]:
+    """获取用户当前激活的项目ID"""
+    return await db.run(_select_active_project, user_id)
+
+
+@timed_query("get_active_project")
+async def get_active_project_detail_async(user_id: str) -> Tuple[Optional[UUID], Optional[Project]]:
+    """获取用户当前激活的项目ID及项目（激活的项目已被删除时项目为 None）"""
+    return await db.run(_select_active_project_detail, user_id)
+
+
+@timed_query("set_active_project")
+async def set_active_project_async(user_id: str, project_id: UUID) -> bool:
+    """设置用户当前激活的项目"""
+    # 只更新了 updated_at（影响列表排序），人设内容不变，无需通知监听器
+    await db.write(
+        _upsert_active_project,
+        user_id,
+        project_id,
+        on_commit=lambda owner: _invalidate(project_id, owner or user_id, notify=False),
+    )
     return True
 
 
+@timed_query("update_project")
+async def update_owned_project_async(project_id: UUID, user_id: str, data: ProjectUpdate) -> Project:
+    """
+    更新属于 user_id 的项目
+
+    Raises:
+        ProjectNotFound: 项目不存在
+        ProjectForbidden: 项目不属于该用户
+    """
+    def on_commit(result: Tuple[Project, bool]) -> None:
+        if result[1]:
+            _invalidate(project_id, user_id)
+    
+    project, _ = await db.write(_update_owned_project, project_id, user_id, data, on_commit=on_commit)
+    return project
+
+
+@timed_query("delete_project")
+async def delete_owned_project_async(project_id: UUID, user_id: str) -> None:
+    """删除属于 user_id 的项目（异常同 update_owned_project_async）"""
+    await db.write(
+        _delete_owned_project,
+        project_id,
+        user_id,
+        on_commit=lambda _: _invalidate(project_id, user_id),
+    )
+
+
+@timed_query("set_active_project")
+async def activate_owned_project_async(user_id: str, project_id: UUID) -> Project:
+    """将属于 user_id 的项目设置为激活项目，返回该项目（异常同 update_owned_project_async）"""
+    return await db.write(
+        _activate_owned_project,
+        user_id,
+        project_id,
+        on_commit=lambda _: _invalidate(project_id, user_id, notify=False),
+    )
+
+
+# ============== 同步接口（在调用线程中执行，保留原有签名） ==============
+
+def get_projects_with_active(user_id: str) -> Tuple[List[Project], Optional[UUID]]:
+    """获取用户的所有项目（按更新时间倒序）和当前激活的项目ID"""
+    entry = project_cache.get_list(user_id)
+    if entry is None:
+        generation = project_cache.generation
+        entry = _load_projects_by_user(user_id)
+        project_cache.put_list(user_id, *entry, generation)
+    return entry
+
+
+def get_projects_by_user(user_id: str) -> List[Project]:
+    """获取用户的所有项目，按更新时间倒序"""
+    projects, _ = get_projects_with_active(user_id)
+    return projects
+
+
+@timed_query("get_projects_page")
+def get_projects_page(
+    user_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+) -> Tuple[List[Union[Project, Dict[str, Any]]], Optional[str], Optional[UUID]]:
+    """分页获取用户的项目和当前激活的项目ID（参数同 get_projects_page_async）"""
+    limit = min(limit, MAX_PAGE_SIZE) if limit is not None else None
+    after = decode_cursor(cursor) if cursor else None
+    with db.connection() as conn:
+        return _select_projects_page(conn, user_id, limit, after, parse_fields(fields))
+
+
+def get_project_by_id(project_id: UUID) -> Optional[Project]:
+    """根据 ID 获取项目"""
+    project = project_cache.get(project_id)
+    if project is None:
+        generation = project_cache.generation
+        project = _load_project(project_id)
+        project_cache.put(project, generation)
+    return project
+
+
+@timed_query("create_project")
+def create_project(user_id: str, data: ProjectCreate) -> Project:
+    """创建新项目"""
+    with db.connection() as conn:
+        project = _insert_project(conn, new_project(user_id, data))
+    _invalidate(None, user_id)
+    return project
+
+
+@timed_query("update_project")
+def update_project(project_id: UUID, data: ProjectUpdate) -> Optional[Project]:
+    """更新项目"""
+    with db.connection() as conn:
+        project, changed = _update_project(conn, project_id, data)
+    if changed:
+        _invalidate(project_id, project.user_id if project else None)
+    return project
+
+
+@timed_query("delete_project")
+def delete_project(project_id: UUID) -> bool:
+    """删除项目"""
+    with db.connection() as conn:
+        owner = _delete_project(conn, project_id)
+    if owner is not None:
+        _invalidate(project_id, owner)
+    return owner is not None
+
+
+@timed_query("get_active_project")
+def get_active_project(user_id: str) -> Optional[UUID]:
+    """获取用户当前激活的项目ID"""
+    with db.connection() as conn:
+        return _select_active_project(conn, user_id)
+
+
+@timed_query("set_active_project")
+def set_active_project(user_id: str, project_id: UUID) -> bool:
+    """设置用户当前激活的项目"""
+    with db.connection() as conn:
+        owner = _upsert_active_project(conn, user_id, project_id)
+    _invalidate(project_id, owner or user_id, notify=False)
+    return True
+
+
+@timed_query("update_project")
+def update_owned_project(project_id: UUID, user_id: str, data: ProjectUpdate) -> Project:
+    """更新属于 user_id 的项目（异常同 update_owned_project_async）"""
+    with db.connection() as conn:
+        project, changed = _update_owned_project(conn, project_id, user_id, data)
+    if changed:
+        _invalidate(project_id, user_id)
+    return project
+
+
+@timed_query("delete_project")
+def delete_owned_project(project_id: UUID, user_id: str) -> None:
+    """删除属于 user_id 的项目（异常同 update_owned_project_async）"""
+    with db.connection() as conn:
+        _delete_owned_project(conn, project_id, user_id)
+    _invalidate(project_id, user_id)
+
+
+@timed_query("set_active_project")
+def activate_owned_project(user_id: str, project_id: UUID) -> Project:
+    """将属于 user_id 的项目设置为激活项目（异常同 update_owned_project_async）"""
+    with db.connection() as conn:
+        project = _activate_owned_project(conn, user_id, project_id)
+    _invalidate(project_id, user_id, notify=False)
+    return project
+
+
 # 初始化数据库
 init_db()
 
-
+# 其它 worker 修改数据库后清空项目缓存，并通知监听器全部失效
+project_cache.watch(db, lambda: _notify_change(None))
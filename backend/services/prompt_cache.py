@@ -0,0 +1,253 @@
+"""
+Prompt Cache - 编译后的 System Prompt 缓存
+
+每次 /api/generate/chat 请求都会读取 SQLite 获取项目、重新拼接 IP 人设和智能体提示词，
+而这些内容只在项目被编辑时才会变化。本模块按 (智能体, 项目) 缓存编译结果：
+- 缓存项包含分段的 System Prompt、拼接后的完整前缀及其估算 tokens
+- 项目经 project_service 读取（命中项目缓存时不访问数据库），缓存项记录项目的
+  updated_at 作为版本，与读取到的项目不一致时重新编译；项目缓存按 data_version
+  检测其它 worker 的修改，因此多 worker 部署也不会返回旧的人设
+- update_project / delete_project 通过 project_service 的变更通知立即释放对应项目，
+  并由 PROMPT_CACHE_TTL 兜底过期
+
+配置（环境变量）：
+    PROMPT_CACHE_ENABLED: 是否启用，默认 true
+    PROMPT_CACHE_MAX_PROJECTS: 最多缓存的项目数，默认 1024
+    PROMPT_CACHE_TTL: 缓存项有效期（秒），默认 300，0 表示仅按变更通知失效
+"""
+
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from services.settings import env_float, env_int, env_flag
+from services.rate_limit import estimate_tokens
+from services import project_service
+
+
+def build_ip_persona_prompt(project) -> str:
+    """
+    从项目信息构建IP人设提示词
+
+    Args:
+        project: 项目对象
+
+    Returns:
+        IP人设提示词字符串
+    """
+    if not project:
+        return ""
+
+    persona = project.persona_settings
+    parts = []
+
+    parts.append(f"【IP信息】")
+    parts.append(f"- IP名称：{project.name}")
+    parts.append(f"- 所属赛道：{project.industry}")
+
+    if persona.introduction:
+        parts.append(f"- IP简介：{persona.introduction}")
+
+    if persona.tone:
+        parts.append(f"- 语气风格：{persona.tone}")
+
+    if persona.target_audience:
+        parts.append(f"- 目标受众：{persona.target_audience}")
+
+    if persona.content_style:
+        parts.append(f"- 内容风格：{persona.content_style}")
+
+    if persona.catchphrase:
+        parts.append(f"- 常用口头禅：{persona.catchphrase}")
+
+    if persona.keywords:
+        parts.append(f"- 常用关键词：{', '.join(persona.keywords)}")
+
+    if persona.taboos:
+        parts.append(f"- 内容禁忌：{', '.join(persona.taboos)}")
+
+    if persona.benchmark_accounts:
+        parts.append(f"- 对标账号：{', '.join(persona.benchmark_accounts)}")
+
+    return "\n".join(parts)
+
+
+def build_system_segments(
+    agent_system_prompt: str,
+    ip_persona_prompt: str,
+) -> List[str]:
+    """
+    构建分段的System Prompt：智能体提示词、IP人设
+
+    各段内容按智能体/项目保持不变，支持提示词缓存的模型（Claude）
+    会为每段设置缓存断点。
+
+    Args:
+        agent_system_prompt: 智能体基础系统提示词
+        ip_persona_prompt: IP人设提示词
+
+    Returns:
+        System Prompt 分段列表，直接拼接即为完整提示词
+    """
+    segments = [agent_system_prompt]
+
+    if ip_persona_prompt:
+        segments.append("".join([
+            "\n\n" + "=" * 40,
+            "\n在创作时，请严格遵循以下IP人设设定，确保内容符合该IP的风格特点：\n",
+            ip_persona_prompt,
+            "\n" + "=" * 40,
+            "\n请在保持智能体专业能力的同时，融入以上IP的人设特点进行创作。",
+        ]))
+
+    return segments
+
+
+class CompiledPrompt:
+    """编译完成的 System Prompt（只读，多个请求共享）"""
+
+    __slots__ = ("segments", "text", "tokens", "version")
+
+    def __init__(self, segments: List[str], version: Optional[datetime] = None):
+        self.segments = segments
+        self.text = "".join(segments)
+        self.tokens = estimate_tokens(self.text)
+        self.version = version
+
+
+class _ProjectEntry:
+    __slots__ = ("version", "persona", "expires_at", "prompts")
+
+    def __init__(self, version: Optional[datetime], persona: str, expires_at: float):
+        self.version = version
+        self.persona = persona
+        self.expires_at = expires_at
+        self.prompts: Dict[str, CompiledPrompt] = {}
+
+
+class PromptCache:
+    """按 (智能体, 项目版本) 缓存编译后的 System Prompt"""
+
+    def __init__(self, enabled: bool = True, max_projects: int = 1024, ttl: float = 300.0):
+        self.enabled = enabled
+        self.max_projects = max(1, max_projects)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._agents: Dict[str, CompiledPrompt] = {}
+        self._projects: "OrderedDict[str, _ProjectEntry]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "PromptCache":
+        return cls(
+            enabled=env_flag("PROMPT_CACHE_ENABLED", True),
+            max_projects=env_int("PROMPT_CACHE_MAX_PROJECTS", 1024),
+            ttl=env_float("PROMPT_CACHE_TTL", 300.0),
+        )
+
+    def get(self, agent_type: str, agent_system_prompt: str, project_id: Optional[UUID] = None) -> CompiledPrompt:
+        """
+        获取智能体（及项目 IP 人设）的编译结果
+
+        Args:
+            agent_type: 智能体类型
+            agent_system_prompt: 智能体基础系统提示词（未命中时使用）
+            project_id: 项目ID，为空时只包含智能体提示词
+
+        Returns:
+            编译后的 System Prompt；项目不存在时只包含智能体提示词
+        """
+        project = project_service.get_project_by_id(project_id) if project_id is not None else None
+        return self._compile(agent_type, agent_system_prompt, project_id, project)
+
+    async def get_async(
+        self,
+        agent_type: str,
+        agent_system_prompt: str,
+        project_id: Optional[UUID] = None,
+    ) -> CompiledPrompt:
+        """与 get() 相同，项目缓存未命中时在数据库线程中读取项目，不阻塞事件循环"""
+        project = await project_service.get_project_by_id_async(project_id) if project_id is not None else None
+        return self._compile(agent_type, agent_system_prompt, project_id, project)
+
+    def _compile(self, agent_type: str, agent_system_prompt: str, project_id: Optional[UUID], project) -> CompiledPrompt:
+        """查找缓存，缓存项的版本与项目的 updated_at 不一致时重新编译"""
+        if project_id is None:
+            compiled = self._agents.get(agent_type)
+            if compiled is None or not self.enabled:
+                compiled = CompiledPrompt(build_system_segments(agent_system_prompt, ""))
+                if self.enabled:
+                    self._agents[agent_type] = compiled
+            return compiled
+        if project is None:
+            print(f"[Warning] 项目不存在: {project_id}")
+            return self._compile(agent_type, agent_system_prompt, None, None)
+
+        key = str(project_id)
+        entry = self._projects.get(key)
+        if entry is not None and (
+            entry.version != project.updated_at
+            or (self.ttl > 0 and time.monotonic() >= entry.expires_at)
+        ):
+            del self._projects[key]
+            entry = None
+        if entry is not None:
+            compiled = entry.prompts.get(agent_type)
+            if compiled is not None:
+                self.hits += 1
+                self._projects.move_to_end(key)
+                return compiled
+        self.misses += 1
+
+        if entry is None:
+            entry = _ProjectEntry(
+                version=project.updated_at,
+                persona=build_ip_persona_prompt(project),
+                expires_at=time.monotonic() + self.ttl,
+            )
+        # 项目已缓存时只需为该智能体重新拼接
+        compiled = CompiledPrompt(build_system_segments(agent_system_prompt, entry.persona), entry.version)
+        if not self.enabled:
+            return compiled
+        entry.prompts[agent_type] = compiled
+        self._projects[key] = entry
+        self._projects.move_to_end(key)
+        while len(self._projects) > self.max_projects:
+            self._projects.popitem(last=False)
+        return compiled
+
+    def invalidate(self, project_id: Optional[UUID] = None) -> int:
+        """
+        使项目的缓存失效，project_id 为空时清空全部缓存
+
+        Returns:
+            删除的项目缓存数量
+        """
+        if project_id is None:
+            removed = len(self._projects)
+            self._projects.clear()
+            self._agents.clear()
+        else:
+            removed = 1 if self._projects.pop(str(project_id), None) is not None else 0
+        self.invalidations += removed
+        return removed
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "projects": len(self._projects),
+            "agents": len(self._agents),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+        }
+
+
+# 进程级单例
+prompt_cache = PromptCache.from_env()
+project_service.add_change_listener(prompt_cache.invalidate)
@@ -0,0 +1,150 @@
+"""
+Provider Stats - 上游 LLM 提供商的延迟统计
+
+按提供商记录最近 N 次调用的首字延迟（TTFT）和总耗时，计算 p50/p95/p99，
+供路由模型（model_type="auto"）调整提供商顺序，并通过接口对外暴露。
+
+同时累计上游返回的 tokens 用量（含提示词缓存的读取/写入 tokens），
+并按是否命中提示词缓存分别统计首字延迟，用于验证缓存效果。
+"""
+
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+
+DEFAULT_WINDOW = 200
+
+# 累计的 tokens 用量字段（services/usage.py 统一后的格式，prompt_tokens 含缓存部分）
+USAGE_FIELDS = (
+    "prompt_tokens",
+    "completion_tokens",
+    "cached_tokens",
+    "cache_creation_tokens",
+)
+
+
+def percentile(samples: List[float], pct: float) -> Optional[float]:
+    """
+    计算百分位数（最近秩法）
+
+    Args:
+        samples: 样本列表
+        pct: 百分位，0-100
+
+    Returns:
+        百分位数值，无样本时返回 None
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class ProviderLatency:
+    """单个提供商的滚动窗口统计"""
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self.ttft: Deque[float] = deque(maxlen=window)
+        self.total: Deque[float] = deque(maxlen=window)
+        self.successes = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_error_at: Optional[float] = None
+        self.usage: Dict[str, int] = {field: 0 for field in USAGE_FIELDS}
+        self.ttft_cache_hit: Deque[float] = deque(maxlen=window)
+        self.ttft_cache_miss: Deque[float] = deque(maxlen=window)
+
+    def cache_hit_ratio(self) -> Optional[float]:
+        """提示词缓存读取 tokens 占全部输入 tokens 的比例"""
+        total = self.usage["prompt_tokens"]
+        return round(self.usage["cached_tokens"] / total, 4) if total else None
+
+    def snapshot(self) -> Dict:
+        ttft = list(self.ttft)
+        total = list(self.total)
+        usage = {}
+        if any(self.usage.values()):
+            usage = {
+                "usage": dict(self.usage),
+                "cache_hit_ratio": self.cache_hit_ratio(),
+                "ttft_cache_hit_p50": percentile(list(self.ttft_cache_hit), 50),
+                "ttft_cache_miss_p50": percentile(list(self.ttft_cache_miss), 50),
+            }
+        return {
+            "samples": len(ttft),
+            "successes": self.successes,
+            "failures": self.failures,
+            "ttft_p50": percentile(ttft, 50),
+            "ttft_p95": percentile(ttft, 95),
+            "ttft_p99": percentile(ttft, 99),
+            "total_p50": percentile(total, 50),
+            "total_p95": percentile(total, 95),
+            "last_error": self.last_error,
+            **usage,
+        }
+
+
+class LatencyTracker:
+    """按提供商汇总的延迟统计"""
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self.window = window
+        self._providers: Dict[str, ProviderLatency] = {}
+
+    def _get(self, provider: str) -> ProviderLatency:
+        stats = self._providers.get(provider)
+        if stats is None:
+            stats = self._providers[provider] = ProviderLatency(self.window)
+        return stats
+
+    def record_first_token(self, provider: str, seconds: float) -> None:
+        """记录首字延迟"""
+        self._get(provider).ttft.append(seconds)
+
+    def record_success(self, provider: str, seconds: float) -> None:
+        """记录一次成功调用的总耗时"""
+        stats = self._get(provider)
+        stats.total.append(seconds)
+        stats.successes += 1
+
+    def record_failure(self, provider: str, error: BaseException) -> None:
+        """记录一次失败调用"""
+        stats = self._get(provider)
+        stats.failures += 1
+        stats.last_error = f"{type(error).__name__}: {error}"[:200]
+        stats.last_error_at = time.time()
+
+    def record_usage(self, provider: str, usage: Dict[str, Any], first_token: Optional[float] = None) -> None:
+        """
+        累计一次调用的 tokens 用量
+
+        Args:
+            provider: 提供商名称
+            usage: 统一格式的 usage（prompt_tokens / completion_tokens / cached_tokens / cache_creation_tokens）
+            first_token: 流式调用的首字延迟，按是否命中提示词缓存分别统计
+        """
+        stats = self._get(provider)
+        for field in USAGE_FIELDS:
+            stats.usage[field] += int(usage.get(field) or 0)
+        if first_token is not None:
+            if usage.get("cached_tokens"):
+                stats.ttft_cache_hit.append(first_token)
+            else:
+                stats.ttft_cache_miss.append(first_token)
+
+    def ttft_percentile(self, provider: str, pct: float, min_samples: int = 1) -> Optional[float]:
+        """查询首字延迟百分位，样本不足时返回 None"""
+        stats = self._providers.get(provider)
+        if stats is None or len(stats.ttft) < min_samples:
+            return None
+        return percentile(list(stats.ttft), pct)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """返回所有提供商的统计快照"""
+        return {name: stats.snapshot() for name, stats in self._providers.items()}
+
+
+# 进程级单例
+provider_latency = LatencyTracker()
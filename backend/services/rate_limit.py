@@ -0,0 +1,237 @@
+"""
+Rate Limit - 上游 LLM 提供商的客户端限流与并发控制
+
+高峰期容易超出 DeepSeek / 火山方舟的 RPM、TPM 配额，引发大量 429。
+本模块按提供商在本地进行限流：
+- 令牌桶：每分钟请求数（RPM）和每分钟估算 tokens（TPM）
+- 信号量：最大并发请求/流数
+- 有界等待队列：队列已满或预计等待超时时立即拒绝（返回 429），不再打到上游
+
+配置（环境变量，{PROVIDER}_* 优先，其次 LLM_*，0 表示不限制）：
+    DEEPSEEK_RPM / DEEPSEEK_TPM: 每分钟请求数 / tokens
+    DEEPSEEK_MAX_CONCURRENCY: 最大并发数
+    DEEPSEEK_MAX_QUEUE: 最大排队请求数，默认 100
+    DEEPSEEK_QUEUE_TIMEOUT: 最长排队时间（秒），默认 30
+"""
+
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from services.settings import provider_setting
+
+
+class RateLimitExceeded(Exception):
+    """本地限流拒绝请求（队列已满或等待超时）"""
+
+    def __init__(self, provider: str, reason: str):
+        self.provider = provider
+        self.reason = reason
+        super().__init__(f"Provider '{provider}' rate limited: {reason}")
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    粗略估算文本 tokens：中日韩字符按 1 个 token，其它字符按 4 个字符 1 个 token
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if "⺀" <= ch <= "鿿" or "가" <= ch <= "힯" or "＀" <= ch <= "￯")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class TokenBucket:
+    """
+    令牌桶（预约模式）
+
+    令牌不足时预约未来的令牌并返回需要等待的时间，保证排队请求按先后顺序放行。
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        预约令牌
+
+        Returns:
+            需要等待的秒数（0 表示立即可用）
+        """
+        now = time.monotonic()
+        self._refill(now)
+        # 单次请求超过桶容量时按桶容量计，避免永远无法放行
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def refund(self, amount: float) -> None:
+        """归还未使用的预约令牌"""
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+
+class ProviderLimiter:
+    """单个提供商的限流器"""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        rpm = provider_setting(provider, "RPM", 0.0)
+        tpm = provider_setting(provider, "TPM", 0.0)
+        concurrency = provider_setting(provider, "MAX_CONCURRENCY", 0, int)
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+        self.max_concurrency = concurrency
+        self.max_queue = provider_setting(provider, "MAX_QUEUE", 100, int)
+        self.queue_timeout = provider_setting(provider, "QUEUE_TIMEOUT", 30.0)
+
+        # 指标
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None or self.semaphore is not None
+
+    def _reject(self, reason: str) -> RateLimitExceeded:
+        self.rejected += 1
+        return RateLimitExceeded(self.provider, reason)
+
+    @asynccontextmanager
+    async def acquire(self, estimated_tokens: int = 0) -> AsyncIterator[None]:
+        """
+        获取一次上游调用的许可，退出上下文时释放并发槽位
+
+        Args:
+            estimated_tokens: 预估的 tokens 数（prompt + max_tokens）
+
+        Raises:
+            RateLimitExceeded: 队列已满或预计等待超过 QUEUE_TIMEOUT
+        """
+        if not self.enabled:
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+            return
+
+        started = time.monotonic()
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+
+        def refund() -> None:
+            if self.requests is not None:
+                self.requests.refund(1)
+            if self.tokens is not None:
+                self.tokens.refund(estimated_tokens)
+
+        holding = False
+        if wait == 0 and self.semaphore is not None and not self.semaphore.locked():
+            # 无竞争时直接获取（不会挂起），不占用排队名额
+            await self.semaphore.acquire()
+            holding = True
+
+        must_queue = wait > 0 or (self.semaphore is not None and not holding)
+        if must_queue and self.queue_depth >= self.max_queue:
+            refund()
+            raise self._reject("queue full")
+        if wait > self.queue_timeout:
+            refund()
+            raise self._reject(f"estimated wait {wait:.1f}s exceeds {self.queue_timeout:.0f}s")
+
+        if must_queue:
+            self.queue_depth += 1
+            try:
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                if self.semaphore is not None:
+                    remaining = self.queue_timeout - (time.monotonic() - started)
+                    # 显式任务代替 wait_for：在超时或取消的同一时刻获取成功时，
+                    # wait_for 可能丢失这次获取，槽位永远不会释放
+                    acquire = asyncio.ensure_future(self.semaphore.acquire())
+                    try:
+                        done, _ = await asyncio.wait({acquire}, timeout=max(0.0, remaining))
+                    except BaseException:
+                        self._drop_acquire(acquire)
+                        raise
+                    if not done:
+                        self._drop_acquire(acquire)
+                        raise self._reject("timed out waiting for a concurrency slot")
+                    holding = True
+            except BaseException:
+                # 超时或排队中被取消（客户端断开、对冲请求落败）：请求未发出，退还预留的额度
+                if not holding:
+                    refund()
+                raise
+            finally:
+                self.queue_depth -= 1
+
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            if holding:
+                self.semaphore.release()
+
+    def _drop_acquire(self, acquire: "asyncio.Future") -> None:
+        """放弃排队中的获取；若已经获取成功（或在取消生效前成功），立即释放槽位"""
+        def release_if_acquired(task: "asyncio.Future") -> None:
+            if not task.cancelled() and task.exception() is None:
+                self.semaphore.release()
+
+        acquire.cancel()
+        acquire.add_done_callback(release_if_acquired)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+            "max_wait": round(self.max_wait, 4),
+        }
+
+
+class RateLimiterRegistry:
+    """按提供商管理限流器"""
+
+    def __init__(self):
+        self._limiters: Dict[str, ProviderLimiter] = {}
+
+    def get(self, provider: str) -> ProviderLimiter:
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            limiter = self._limiters[provider] = ProviderLimiter(provider)
+        return limiter
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """返回所有提供商的队列和等待指标"""
+        return {name: limiter.snapshot() for name, limiter in self._limiters.items()}
+
+
+# 进程级单例
+rate_limiters = RateLimiterRegistry()
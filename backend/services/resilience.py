@@ -0,0 +1,335 @@
+"""
+Resilience - 上游 LLM 调用的熔断器与自适应重试
+
+- 熔断器：按提供商统计滚动时间窗口内的错误率，超过阈值后熔断（open），
+  冷却时间结束后进入半开（half_open）状态放行少量探测请求，成功则恢复（closed）
+- 重试：429/5xx/网络错误使用带抖动的指数退避重试，并遵循上游返回的 Retry-After
+
+熔断状态通过 /health 暴露，所有提供商都熔断时负载均衡器可摘除该实例。
+"""
+
+import time
+import random
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+import httpx
+
+from services.settings import provider_setting
+from services.metrics import error_status, llm_upstream_errors
+from services.rate_limit import RateLimitExceeded
+
+
+# 需要重试/计入熔断的 HTTP 状态码
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """提供商已熔断，请求被快速拒绝"""
+
+    def __init__(self, provider: str, retry_in: float):
+        self.provider = provider
+        self.retry_in = retry_in
+        super().__init__(f"Provider '{provider}' circuit is open, retry in {retry_in:.1f}s")
+
+
+def is_provider_failure(error: BaseException) -> bool:
+    """错误是否说明提供商不可用（计入熔断并可重试）"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS
+    return isinstance(error, httpx.TransportError)
+
+
+def parse_retry_after(error: BaseException) -> Optional[float]:
+    """
+    解析上游响应中的 Retry-After（秒数或 HTTP 日期）
+
+    Returns:
+        需要等待的秒数，无该响应头时返回 None
+    """
+    if not isinstance(error, httpx.HTTPStatusError):
+        return None
+    value = error.response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class CircuitBreaker:
+    """
+    单个提供商的熔断器（closed / open / half_open）
+
+    配置（环境变量，可用 DEEPSEEK_BREAKER_* 等按提供商覆盖 LLM_BREAKER_*）：
+        LLM_BREAKER_FAILURE_RATE: 触发熔断的错误率，默认 0.5
+        LLM_BREAKER_WINDOW: 错误率统计窗口（秒），默认 60
+        LLM_BREAKER_MIN_REQUESTS: 窗口内最少请求数，默认 10
+        LLM_BREAKER_OPEN_SECONDS: 熔断冷却时间（秒），默认 30
+        LLM_BREAKER_HALF_OPEN_CALLS: 半开状态允许的探测请求数，默认 1
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.failure_rate = provider_setting(provider, "BREAKER_FAILURE_RATE", 0.5)
+        self.window = provider_setting(provider, "BREAKER_WINDOW", 60.0)
+        self.min_requests = provider_setting(provider, "BREAKER_MIN_REQUESTS", 10, int)
+        self.open_seconds = provider_setting(provider, "BREAKER_OPEN_SECONDS", 30.0)
+        self.half_open_calls = provider_setting(provider, "BREAKER_HALF_OPEN_CALLS", 1, int)
+
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._events: Deque[Tuple[float, bool]] = deque()
+        self._probes = 0
+
+    def _trim(self, now: float) -> None:
+        cutoff = now - self.window
+        while self._events and self._events[0][0] < cutoff:
+            self._events.popleft()
+
+    def _error_rate(self) -> float:
+        if not self._events:
+            return 0.0
+        failures = sum(1 for _, ok in self._events if not ok)
+        return failures / len(self._events)
+
+    def _current_state(self, now: float) -> str:
+        if self.state == self.OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = self.HALF_OPEN
+            self._probes = 0
+        return self.state
+
+    def before_call(self) -> None:
+        """
+        请求前检查，熔断时抛出 CircuitOpenError
+
+        每次通过检查的调用之后必须调用 record_success / record_failure / release 之一。
+        """
+        now = time.monotonic()
+        state = self._current_state(now)
+        if state == self.OPEN:
+            raise CircuitOpenError(self.provider, self.open_seconds - (now - self.opened_at))
+        if state == self.HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                raise CircuitOpenError(self.provider, 0.0)
+            self._probes += 1
+
+    def record_success(self) -> None:
+        """记录成功调用"""
+        now = time.monotonic()
+        if self.state == self.HALF_OPEN:
+            # 探测成功，恢复正常并清空历史
+            self.state = self.CLOSED
+            self._events.clear()
+            self._probes = 0
+        self._events.append((now, True))
+        self._trim(now)
+
+    def record_failure(self) -> None:
+        """记录失败调用，必要时熔断"""
+        now = time.monotonic()
+        if self.state == self.HALF_OPEN:
+            self._trip(now)
+            return
+        self._events.append((now, False))
+        self._trim(now)
+        if len(self._events) >= self.min_requests and self._error_rate() >= self.failure_rate:
+            self._trip(now)
+
+    def release(self) -> None:
+        """调用被取消（如客户端断开），不计入统计"""
+        if self.state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def _trip(self, now: float) -> None:
+        if self.state != self.OPEN:
+            print(f"[Warning] Circuit breaker opened for provider '{self.provider}'")
+        self.state = self.OPEN
+        self.opened_at = now
+        self._probes = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._trim(now)
+        state = self._current_state(now)
+        return {
+            "state": state,
+            "error_rate": round(self._error_rate(), 4),
+            "requests_in_window": len(self._events),
+            "retry_in": round(max(0.0, self.open_seconds - (now - self.opened_at)), 1) if state == self.OPEN else 0.0,
+        }
+
+
+class RetryPolicy:
+    """
+    带抖动的指数退避重试策略
+
+    配置（环境变量，可按提供商覆盖）：
+        LLM_RETRY_MAX_ATTEMPTS: 最大尝试次数（含首次），默认 3
+        LLM_RETRY_BASE_DELAY: 初始退避时间（秒），默认 0.5
+        LLM_RETRY_MAX_DELAY: 单次退避上限（秒），默认 8
+        LLM_RETRY_MAX_RETRY_AFTER: 可接受的 Retry-After 上限（秒），超过则不再重试，默认 30
+    """
+
+    def __init__(self, provider: str):
+        self.max_attempts = max(1, provider_setting(provider, "RETRY_MAX_ATTEMPTS", 3, int))
+        self.base_delay = provider_setting(provider, "RETRY_BASE_DELAY", 0.5)
+        self.max_delay = provider_setting(provider, "RETRY_MAX_DELAY", 8.0)
+        self.max_retry_after = provider_setting(provider, "RETRY_MAX_RETRY_AFTER", 30.0)
+
+    def next_delay(self, attempt: int, error: BaseException) -> Optional[float]:
+        """
+        计算第 attempt 次失败后的等待时间
+
+        Returns:
+            等待秒数；返回 None 表示不再重试
+        """
+        if attempt >= self.max_attempts or not is_provider_failure(error):
+            return None
+        retry_after = parse_retry_after(error)
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after else None
+        # Full jitter: [0, min(max_delay, base * 2^(attempt-1))]
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class ResilienceRegistry:
+    """按提供商管理熔断器和重试策略"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._policies: Dict[str, RetryPolicy] = {}
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            breaker = self._breakers[provider] = CircuitBreaker(provider)
+        return breaker
+
+    def policy(self, provider: str) -> RetryPolicy:
+        policy = self._policies.get(provider)
+        if policy is None:
+            policy = self._policies[provider] = RetryPolicy(provider)
+        return policy
+
+    async def call(
+        self,
+        provider: str,
+        factory: Callable[[], Awaitable[Any]],
+        retry: bool = True,
+    ) -> Any:
+        """
+        在熔断器和重试策略保护下执行非流式调用
+
+        Args:
+            provider: 提供商名称
+            factory: 发起上游调用的协程工厂（每次重试重新调用）
+            retry: 是否重试（路由模型故障转移时关闭）
+        """
+        breaker = self.breaker(provider)
+        policy = self.policy(provider)
+        attempt = 0
+        while True:
+            attempt += 1
+            breaker.before_call()
+            try:
+                result = await factory()
+            except RateLimitExceeded:
+                # 本地限流拒绝，请求未发出，不计入熔断统计
+                breaker.release()
+                raise
+            except Exception as e:
+                llm_upstream_errors.inc(provider, error_status(e))
+                if not is_provider_failure(e):
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                delay = policy.next_delay(attempt, e) if retry else None
+                if delay is None:
+                    raise
+                print(f"[Warning] Provider '{provider}' call failed ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return result
+
+    async def stream(
+        self,
+        provider: str,
+        factory: Callable[[], AsyncGenerator[str, None]],
+        retry: bool = True,
+    ) -> AsyncGenerator[str, None]:
+        """
+        在熔断器和重试策略保护下执行流式调用
+
+        只有在尚未输出任何分片时才会重试，避免向客户端输出重复内容。
+        """
+        breaker = self.breaker(provider)
+        policy = self.policy(provider)
+        attempt = 0
+        while True:
+            attempt += 1
+            breaker.before_call()
+            started = False
+            outcome = None
+            chunks = factory()
+            try:
+                async for chunk in chunks:
+                    started = True
+                    yield chunk
+                outcome = "success"
+            except RateLimitExceeded:
+                raise
+            except Exception as e:
+                llm_upstream_errors.inc(provider, error_status(e))
+                if not is_provider_failure(e):
+                    outcome = "success"
+                    raise
+                outcome = "failure"
+                delay = policy.next_delay(attempt, e) if retry and not started else None
+                if delay is None:
+                    raise
+                print(f"[Warning] Provider '{provider}' stream failed ({e}), retrying in {delay:.2f}s")
+            finally:
+                # 立即关闭本次尝试（释放其限流槽位和上游连接），不等待垃圾回收
+                await chunks.aclose()
+                if outcome == "success":
+                    breaker.record_success()
+                elif outcome == "failure":
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+            if outcome == "success":
+                return
+            await asyncio.sleep(delay)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """返回所有提供商的熔断状态"""
+        return {name: breaker.snapshot() for name, breaker in self._breakers.items()}
+
+    def all_open(self) -> bool:
+        """是否所有已使用的提供商都处于熔断状态"""
+        states = [breaker.snapshot()["state"] for breaker in self._breakers.values()]
+        return bool(states) and all(state == CircuitBreaker.OPEN for state in states)
+
+
+# 进程级单例
+resilience = ResilienceRegistry()
@@ -0,0 +1,283 @@
+"""
+Response Cache - 非流式生成结果的精确匹配缓存
+
+相同的请求（系统提示词、prompt、模型、温度、最大长度完全一致）直接返回缓存结果，
+避免重复调用 LLM。
+
+缓存分两级：
+- 内存 LRU + TTL（进程内，默认开启）
+- SQLite 磁盘缓存（可选，设置 RESPONSE_CACHE_DB 后启用，进程重启后仍可命中）
+
+缓存策略：temperature 为 0 的请求默认缓存，其它请求需要显式 opt-in (cache=True)。
+"""
+
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple, AsyncGenerator
+
+from services.settings import env_float, env_int, env_flag, env_str
+
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 3600.0
+
+# 缓存回放参数：每个分片的字符数和分片间隔（秒），保留前端打字机效果
+DEFAULT_REPLAY_CHUNK_SIZE = 4
+DEFAULT_REPLAY_INTERVAL = 0.02
+
+
+def make_cache_key(payload: Dict[str, Any]) -> str:
+    """
+    根据规范化后的请求参数生成稳定的缓存键
+
+    Args:
+        payload: 请求参数（provider、model、prompt、system_prompt 等）
+
+    Returns:
+        SHA-256 十六进制摘要
+    """
+    normalized = {
+        key: (value.strip() if isinstance(value, str) else value)
+        for key, value in payload.items()
+        if value is not None
+    }
+    raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheTier:
+    """进程内 LRU + TTL 缓存"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCacheTier:
+    """SQLite 磁盘缓存，读写在线程池中执行，不阻塞事件循环"""
+
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return row[0]
+
+    def _set(self, key: str, value: str, ttl: Optional[float]) -> None:
+        expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._conn.execute(
+                "REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+            self._conn.commit()
+
+    def _clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+            self._conn.commit()
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def clear(self) -> None:
+        await asyncio.to_thread(self._clear)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """
+    两级响应缓存，带命中/未命中统计
+
+    配置（环境变量）：
+        RESPONSE_CACHE_ENABLED: 总开关，默认 true
+        RESPONSE_CACHE_MAX_ENTRIES: 内存缓存条目上限，默认 1024
+        RESPONSE_CACHE_TTL: 缓存有效期（秒），默认 3600
+        RESPONSE_CACHE_DB: SQLite 缓存文件路径，为空时不启用磁盘缓存
+        RESPONSE_CACHE_DISABLED_NAMESPACES: 关闭缓存的接口命名空间，逗号分隔
+        RESPONSE_CACHE_REPLAY_CHUNK_SIZE: 流式回放每个分片的字符数，默认 4
+        RESPONSE_CACHE_REPLAY_INTERVAL: 流式回放分片间隔（秒），默认 0.02
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl: float = DEFAULT_TTL,
+        db_path: Optional[str] = None,
+        disabled_namespaces: Optional[set] = None,
+        replay_chunk_size: int = DEFAULT_REPLAY_CHUNK_SIZE,
+        replay_interval: float = DEFAULT_REPLAY_INTERVAL,
+    ):
+        self.enabled = enabled
+        self.replay_chunk_size = max(1, replay_chunk_size)
+        self.replay_interval = max(0.0, replay_interval)
+        self.memory = MemoryCacheTier(max_entries=max_entries, ttl=ttl)
+        self.disk: Optional[SQLiteCacheTier] = SQLiteCacheTier(db_path, ttl=ttl) if db_path else None
+        self.disabled_namespaces = disabled_namespaces or set()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        """从环境变量构建缓存实例"""
+        disabled = env_str("RESPONSE_CACHE_DISABLED_NAMESPACES", "")
+        return cls(
+            enabled=env_flag("RESPONSE_CACHE_ENABLED", True),
+            max_entries=env_int("RESPONSE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES),
+            ttl=env_float("RESPONSE_CACHE_TTL", DEFAULT_TTL),
+            db_path=env_str("RESPONSE_CACHE_DB"),
+            disabled_namespaces={name.strip() for name in disabled.split(",") if name.strip()},
+            replay_chunk_size=env_int("RESPONSE_CACHE_REPLAY_CHUNK_SIZE", DEFAULT_REPLAY_CHUNK_SIZE),
+            replay_interval=env_float("RESPONSE_CACHE_REPLAY_INTERVAL", DEFAULT_REPLAY_INTERVAL),
+        )
+
+    def should_cache(
+        self,
+        temperature: Optional[float],
+        cache: Optional[bool] = None,
+        namespace: str = "default",
+    ) -> bool:
+        """
+        判断请求是否可缓存
+
+        Args:
+            temperature: 生成温度
+            cache: 显式开关；None 时仅缓存 temperature == 0 的请求
+            namespace: 接口命名空间，用于按接口关闭缓存
+        """
+        if not self.enabled or cache is False or namespace in self.disabled_namespaces:
+            return False
+        if cache is True:
+            return True
+        return temperature is not None and temperature == 0
+
+    def _count(self, namespace: str, field: str) -> None:
+        stats = self._stats.get(namespace)
+        if stats is None:
+            stats = self._stats[namespace] = {"hits": 0, "misses": 0}
+        stats[field] += 1
+
+    async def get(self, key: str, namespace: str = "default") -> Optional[str]:
+        """查询缓存（先内存，后磁盘；磁盘命中会回填内存）"""
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = await self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        self._count(namespace, "hits" if value is not None else "misses")
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """写入缓存"""
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            await self.disk.set(key, value, ttl)
+
+    async def replay(
+        self,
+        text: str,
+        chunk_size: Optional[int] = None,
+        interval: Optional[float] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        将缓存的完整文本按固定大小分片回放，模拟上游流式输出
+
+        Args:
+            text: 缓存的完整生成结果
+            chunk_size: 每个分片的字符数，默认使用配置值
+            interval: 分片之间的间隔（秒），0 表示不等待
+
+        Yields:
+            文本分片
+        """
+        size = chunk_size or self.replay_chunk_size
+        delay = self.replay_interval if interval is None else interval
+        for start in range(0, len(text), size):
+            if start and delay:
+                await asyncio.sleep(delay)
+            yield text[start:start + size]
+
+    async def clear(self) -> None:
+        """清空所有缓存"""
+        self.memory.clear()
+        if self.disk is not None:
+            await self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中统计"""
+        hits = sum(s["hits"] for s in self._stats.values())
+        misses = sum(s["misses"] for s in self._stats.values())
+        total = hits + misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.memory),
+            "disk": self.disk is not None,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "namespaces": {name: dict(s) for name, s in self._stats.items()},
+        }
+
+
+# 进程级单例
+response_cache = ResponseCache.from_env()
@@ -0,0 +1,97 @@
+"""
+Settings - 服务模块共用的环境变量解析
+
+各服务模块在导入时通过 from_env() 读取配置；.env 由 main.py 在导入服务模块之前
+统一加载（load_dotenv），此处只负责解析。无效的值打印警告并使用默认值，
+不会在导入时抛出异常。
+"""
+
+import os
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+_TRUE = ("1", "true", "yes", "on")
+_FALSE = ("0", "false", "no", "off")
+
+
+def _warn_invalid(key: str, value: str, default: Any) -> None:
+    print(f"[Warning] Invalid {key}={value!r}, using {default}")
+
+
+def env_float(key: str, default: float) -> float:
+    """读取数值配置，未设置或无效时返回 default"""
+    value = os.getenv(key)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        _warn_invalid(key, value, default)
+        return default
+
+
+def env_int(key: str, default: int) -> int:
+    """读取整数配置（允许 "4.0" 这样的写法），未设置或无效时返回 default"""
+    return int(env_float(key, default))
+
+
+def parse_flag(value: str) -> bool:
+    """
+    解析开关值（true/false、1/0、yes/no、on/off）
+
+    Raises:
+        ValueError: 无法识别的值
+    """
+    normalized = value.strip().lower()
+    if normalized in _TRUE:
+        return True
+    if normalized in _FALSE:
+        return False
+    raise ValueError(f"invalid flag: {value!r}")
+
+
+def env_flag(key: str, default: bool) -> bool:
+    """读取开关配置（true/false、1/0、yes/no、on/off），未设置或无效时返回 default"""
+    value = os.getenv(key)
+    if not value:
+        return default
+    try:
+        return parse_flag(value)
+    except ValueError:
+        _warn_invalid(key, value, default)
+        return default
+
+
+def env_str(key: str, default: Optional[str] = None) -> Optional[str]:
+    """读取字符串配置，未设置或为空时返回 default"""
+    return os.getenv(key) or default
+
+
+def provider_setting(
+    provider: str,
+    key: str,
+    default: T,
+    cast: Callable[[str], Any] = float,
+) -> T:
+    """
+    读取提供商级别配置 {PROVIDER}_{KEY}，回退到全局配置 LLM_{KEY}
+
+    Args:
+        provider: 提供商名称，如 'deepseek'
+        key: 配置名（不含前缀），如 'RPM'、'HTTP_TIMEOUT'
+        default: 未设置或无效时的默认值
+        cast: 类型转换函数（开关配置使用 parse_flag）
+    """
+    name = f"{provider.upper()}_{key}"
+    value = os.getenv(name)
+    if not value:
+        name = f"LLM_{key}"
+        value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        _warn_invalid(name, value, default)
+        return default
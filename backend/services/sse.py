@@ -0,0 +1,158 @@
+"""
+SSE Decoder - 上游流式响应的增量 SSE 解析器
+
+直接处理 response.aiter_bytes() 的字节块，按 SSE 规范解析：
+- 支持 \\n、\\r\\n、\\r 三种换行
+- 支持 event / id / retry 字段和注释行
+- 多行 data 按规范用 \\n 拼接为一个事件
+- 跨字节块的多字节 UTF-8 字符（中文）正确解码
+
+JSON 解码优先使用 orjson（如已安装），否则回退到标准库 json。
+"""
+
+import codecs
+import json
+from typing import AsyncGenerator, List, Optional
+
+import httpx
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:  # pragma: no cover - depends on optional dependency
+    json_loads = json.loads
+    JSON_BACKEND = "json"
+
+
+class SSEEvent:
+    """一个完整的 SSE 事件"""
+
+    __slots__ = ("event", "data", "id", "retry")
+
+    def __init__(self, data: str, event: str = "message", id: Optional[str] = None, retry: Optional[int] = None):
+        self.data = data
+        self.event = event
+        self.id = id
+        self.retry = retry
+
+    def json(self):
+        """将 data 解码为 JSON"""
+        return json_loads(self.data)
+
+    def __repr__(self) -> str:
+        return f"SSEEvent(event={self.event!r}, id={self.id!r}, data={self.data[:40]!r})"
+
+
+class SSEDecoder:
+    """
+    增量 SSE 解析器
+
+    Usage:
+        decoder = SSEDecoder()
+        for chunk in chunks:
+            for event in decoder.feed(chunk):
+                ...
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._pending = ""
+        self._data: List[str] = []
+        self._event = ""
+        self._retry: Optional[int] = None
+        # id 在事件之间保持（Last-Event-ID 语义）
+        self.last_event_id: Optional[str] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """
+        输入一个字节块，返回其中已完整的事件
+
+        Args:
+            chunk: 原始字节块
+
+        Returns:
+            解析出的事件列表（可能为空）
+        """
+        text = self._pending + self._decoder.decode(chunk)
+        # 末尾的 \r 可能与下一个块开头的 \n 组成 \r\n，先保留
+        if text.endswith("\r"):
+            self._pending = "\r"
+            text = text[:-1]
+        else:
+            self._pending = ""
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+        lines = text.split("\n")
+        # 最后一段是不完整的行
+        self._pending = lines.pop() + self._pending
+        events = []
+        for line in lines:
+            event = self._process_line(line)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def flush(self) -> None:
+        """
+        流结束时调用，重置解析状态
+
+        按规范，流结束时未以空行结尾的事件不会被分发。
+        """
+        self._decoder.decode(b"", final=True)
+        self._pending = ""
+        self._data = []
+        self._event = ""
+
+    def _process_line(self, line: str) -> Optional[SSEEvent]:
+        if not line:
+            return self._dispatch()
+        if line[0] == ":":
+            # 注释行（常用于心跳）
+            return None
+
+        name, sep, value = line.partition(":")
+        if sep and value.startswith(" "):
+            value = value[1:]
+
+        if name == "data":
+            self._data.append(value)
+        elif name == "event":
+            self._event = value
+        elif name == "id":
+            if "\0" not in value:
+                self.last_event_id = value
+        elif name == "retry":
+            if value.isdigit():
+                self._retry = int(value)
+        return None
+
+    def _dispatch(self) -> Optional[SSEEvent]:
+        if not self._data:
+            self._event = ""
+            return None
+        event = SSEEvent(
+            data="\n".join(self._data),
+            event=self._event or "message",
+            id=self.last_event_id,
+            retry=self._retry,
+        )
+        self._data = []
+        self._event = ""
+        return event
+
+
+async def aiter_sse(response: httpx.Response) -> AsyncGenerator[SSEEvent, None]:
+    """
+    从 httpx 流式响应中增量解析 SSE 事件
+
+    Yields:
+        SSEEvent
+    """
+    decoder = SSEDecoder()
+    async for chunk in response.aiter_bytes():
+        for event in decoder.feed(chunk):
+            yield event
+    decoder.flush()
@@ -0,0 +1,207 @@
+"""
+SSE Framer - 下游 SSE 输出的合并发送与心跳
+
+上游（尤其是 DeepSeek）每个分片往往只有 1-3 个汉字，逐片发送会产生大量小事件，
+增加系统调用和代理开销。本模块在时间窗口/字节阈值内合并分片：
+- 首个分片立即发送，保证首字延迟不变
+- 之后缓冲的分片达到 SSE_FLUSH_BYTES 字节或距首个缓冲分片超过 SSE_FLUSH_INTERVAL 秒时发送
+- 长时间无输出时发送 SSE 注释心跳，防止代理断开空闲连接
+- 事件在合并后一次性编码为 bytes
+- 采样的请求记录 sse.relay span，每次发送记录一个 flush 事件
+
+配置（环境变量）：
+    SSE_FLUSH_INTERVAL: 合并时间窗口（秒），默认 0.03，0 表示每个分片立即发送
+    SSE_FLUSH_BYTES: 合并字节阈值，默认 64
+    SSE_HEARTBEAT_INTERVAL: 心跳间隔（秒），默认 15，0 表示关闭
+"""
+
+import json
+import asyncio
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, List, Optional
+
+from services.settings import env_float, env_int
+from services.tracing import tracer
+
+
+HEARTBEAT = b": ping\n\n"
+
+
+def encode_event(data: str, event: Optional[str] = None, id: Optional[str] = None) -> bytes:
+    """
+    编码一个 SSE 事件
+
+    data 中的换行按 SSE 规范拆分为多行 data 字段，客户端会用 \\n 拼接还原。
+    """
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    if id is not None:
+        lines.append(f"id: {id}")
+    if "\r" in data:
+        data = data.replace("\r\n", "\n").replace("\r", "\n")
+    for line in data.split("\n"):
+        lines.append(f"data: {line}")
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+def encode_json_event(payload: Any) -> bytes:
+    """编码 data 为 JSON 的 SSE 事件"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+class _Failure:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_END = object()
+
+
+class SSEFramer:
+    """
+    合并上游分片并编码为 SSE 字节流
+
+    Usage:
+        async for frame in sse_framer.frame(llm.generate_stream(...), encode):
+            yield frame
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = 0.03,
+        flush_bytes: int = 64,
+        heartbeat_interval: float = 15.0,
+    ):
+        self.flush_interval = max(0.0, flush_interval)
+        self.flush_bytes = max(0, flush_bytes)
+        self.heartbeat_interval = max(0.0, heartbeat_interval)
+
+    @classmethod
+    def from_env(cls) -> "SSEFramer":
+        return cls(
+            flush_interval=env_float("SSE_FLUSH_INTERVAL", 0.03),
+            flush_bytes=env_int("SSE_FLUSH_BYTES", 64),
+            heartbeat_interval=env_float("SSE_HEARTBEAT_INTERVAL", 15.0),
+        )
+
+    async def frame(
+        self,
+        chunks: AsyncIterator[str],
+        encode: Callable[[str], bytes],
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        按刷新策略合并文本分片
+
+        上游出错时先发送已缓冲的内容，再将异常抛给调用方。
+
+        Args:
+            chunks: 上游文本分片
+            encode: 将合并后的文本编码为一个 SSE 事件
+
+        Yields:
+            编码后的 SSE 事件或心跳注释
+        """
+        span = tracer.start_span("sse.relay", **{
+            "sse.flush_interval": self.flush_interval,
+            "sse.flush_bytes": self.flush_bytes,
+        })
+        frames = self._frame(chunks, encode)
+        try:
+            async for frame in frames:
+                if span is not None:
+                    if frame is HEARTBEAT:
+                        span.event("heartbeat")
+                    else:
+                        span.event("flush", **{"sse.bytes": len(frame)})
+                yield frame
+        except BaseException as e:
+            if span is not None and not isinstance(e, GeneratorExit):
+                span.error(e)
+            raise
+        finally:
+            await frames.aclose()
+            if span is not None:
+                span.set(**{"sse.events": len(span.events) + span.dropped_events})
+                span.end()
+
+    async def _frame(
+        self,
+        chunks: AsyncIterator[str],
+        encode: Callable[[str], bytes],
+    ) -> AsyncGenerator[bytes, None]:
+        if self.flush_interval <= 0 and self.heartbeat_interval <= 0:
+            async for chunk in chunks:
+                if chunk:
+                    yield encode(chunk)
+            return
+
+        # 上游生成器始终在同一个任务中迭代（httpx 流的上下文管理器不能跨任务退出）
+        queue: asyncio.Queue = asyncio.Queue()
+        pump = asyncio.create_task(self._pump(chunks, queue))
+        loop = asyncio.get_running_loop()
+        buffer: List[str] = []
+        size = 0
+        first = True
+        deadline = 0.0
+        last_sent = loop.time()
+        try:
+            while True:
+                now = loop.time()
+                if buffer:
+                    timeout: Optional[float] = max(0.0, deadline - now)
+                elif self.heartbeat_interval > 0:
+                    timeout = max(0.0, last_sent + self.heartbeat_interval - now)
+                else:
+                    timeout = None
+
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    if buffer:
+                        yield encode("".join(buffer))
+                        buffer, size = [], 0
+                    else:
+                        yield HEARTBEAT
+                    last_sent = loop.time()
+                    continue
+
+                if item is _END or isinstance(item, _Failure):
+                    if buffer:
+                        yield encode("".join(buffer))
+                    if isinstance(item, _Failure):
+                        raise item.error
+                    return
+                if not item:
+                    continue
+
+                if not buffer:
+                    deadline = loop.time() + self.flush_interval
+                buffer.append(item)
+                size += len(item.encode("utf-8"))
+                if first or size >= self.flush_bytes or self.flush_interval <= 0:
+                    yield encode("".join(buffer))
+                    buffer, size = [], 0
+                    first = False
+                    last_sent = loop.time()
+        finally:
+            if not pump.done():
+                pump.cancel()
+                try:
+                    await pump
+                except asyncio.CancelledError:
+                    pass
+
+    async def _pump(self, chunks: AsyncIterator[str], queue: asyncio.Queue) -> None:
+        try:
+            async for chunk in chunks:
+                queue.put_nowait(chunk)
+        except Exception as e:
+            queue.put_nowait(_Failure(e))
+        else:
+            queue.put_nowait(_END)
+
+
+# 进程级单例
+sse_framer = SSEFramer.from_env()
@@ -0,0 +1,205 @@
+"""
+Stream Monitor - 流式接口的客户端断开检测与会话记录
+
+小程序用户中途离开页面时，StreamingResponse 的生成器仍会持续读取上游直到 max_tokens，
+浪费配额并占用连接。本模块为每个流式响应：
+- 定期检测客户端是否断开（Request.is_disconnected），断开后立即取消上游流，
+  上游 httpx 流随之关闭，限流并发槽位和熔断探测名额在取消时释放
+- 记录已输出的部分内容、结束原因和耗时，最近的中断会话通过 /api/streams/stats 暴露
+- 可续传的流（stream_resume）由生产端的 guard 记录整次生成（宽限期后无人重连记为
+  client_disconnected），每个连接（含续传连接）只用 watch() 做断开检测
+
+结束原因：completed / error / client_disconnected / cancelled / aborted
+
+配置（环境变量）：
+    STREAM_DISCONNECT_POLL_INTERVAL: 断开检测间隔（秒），默认 0.5
+    STREAM_PARTIAL_MAX_CHARS: 中断会话保留的部分输出最大字符数，默认 2000
+    STREAM_RECENT_LIMIT: 保留最近中断会话数，默认 50
+"""
+
+import time
+import uuid
+import asyncio
+from collections import deque
+from typing import Any, AsyncGenerator, AsyncIterator, Deque, Dict, List, Optional
+
+from fastapi import Request
+
+from services.settings import env_float, env_int
+
+
+class StreamSession:
+    """一次流式响应的会话状态"""
+
+    def __init__(self, endpoint: str, model_type: str):
+        self.id = uuid.uuid4().hex
+        self.endpoint = endpoint
+        self.model_type = model_type
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.parts: List[str] = []
+        self.chars = 0
+        self.error: Optional[str] = None
+        self.disconnected = False
+        # 是否正在等待上游输出（此时取消任务不会打断向客户端的发送）
+        self.pulling = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    async def tap(self, chunks: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+        """记录经过的文本分片"""
+        try:
+            async for chunk in chunks:
+                self.parts.append(chunk)
+                self.chars += len(chunk)
+                yield chunk
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"[:200]
+            raise
+
+
+class StreamMonitor:
+    """流式会话登记、断开检测和结束原因统计"""
+
+    def __init__(self, poll_interval: float = 0.5, partial_max_chars: int = 2000, recent_limit: int = 50):
+        self.poll_interval = poll_interval
+        self.partial_max_chars = partial_max_chars
+        self.active: Dict[str, StreamSession] = {}
+        self.outcomes: Dict[str, int] = {}
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=recent_limit)
+
+    @classmethod
+    def from_env(cls) -> "StreamMonitor":
+        return cls(
+            poll_interval=env_float("STREAM_DISCONNECT_POLL_INTERVAL", 0.5),
+            partial_max_chars=env_int("STREAM_PARTIAL_MAX_CHARS", 2000),
+            recent_limit=env_int("STREAM_RECENT_LIMIT", 50),
+        )
+
+    def open(self, endpoint: str, model_type: str) -> StreamSession:
+        """登记一个新的流式会话"""
+        session = StreamSession(endpoint, model_type)
+        self.active[session.id] = session
+        return session
+
+    async def guard(
+        self,
+        session: StreamSession,
+        body: AsyncIterator[bytes],
+        request: Optional[Request] = None,
+        record: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        包装响应体生成器：客户端断开时取消上游，并在结束时记录会话
+
+        Args:
+            session: open() 返回的会话
+            body: 编码后的 SSE 响应体
+            request: 当前请求，为空时不做断开检测
+            record: 结束时是否记录会话
+        """
+        task = asyncio.current_task()
+        watcher = None
+        if request is not None and self.poll_interval > 0:
+            watcher = asyncio.create_task(self._watch(request, session, task))
+
+        reason = "completed"
+        iterator = body.__aiter__()
+        try:
+            while not session.disconnected:
+                session.pulling = True
+                try:
+                    frame = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    session.pulling = False
+                yield frame
+            if session.disconnected:
+                reason = "client_disconnected"
+            elif session.error:
+                reason = "error"
+        except asyncio.CancelledError:
+            if session.disconnected:
+                # 由断开检测发起的取消，正常结束响应
+                reason = "client_disconnected"
+                uncancel = getattr(task, "uncancel", None)
+                if uncancel is not None:
+                    uncancel()
+            else:
+                # 服务器侧取消（Starlette 检测到断开或服务关闭）
+                reason = "client_disconnected" if await self._probe(request) else "cancelled"
+                raise
+        except GeneratorExit:
+            # 响应发送失败后生成器被关闭
+            reason = "client_disconnected" if session.disconnected else "aborted"
+            raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None and reason != "completed":
+                try:
+                    await aclose()
+                except Exception:
+                    pass
+            if record:
+                self._finish(session, reason)
+
+    def watch(self, body: AsyncIterator[bytes], request: Optional[Request]) -> AsyncGenerator[bytes, None]:
+        """只做断开检测：客户端断开时结束 body（如可续传流的一个订阅），不记录会话"""
+        return self.guard(StreamSession("connection", ""), body, request, record=False)
+
+    async def _watch(self, request: Request, session: StreamSession, task: asyncio.Task) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if await request.is_disconnected():
+                session.disconnected = True
+                if session.pulling:
+                    task.cancel()
+                return
+
+    @staticmethod
+    async def _probe(request: Optional[Request]) -> bool:
+        if request is None:
+            return False
+        try:
+            return await request.is_disconnected()
+        except (asyncio.CancelledError, Exception):
+            return False
+
+    def _finish(self, session: StreamSession, reason: str) -> None:
+        self.active.pop(session.id, None)
+        self.outcomes[reason] = self.outcomes.get(reason, 0) + 1
+        if reason == "completed":
+            return
+        elapsed = time.monotonic() - session.started
+        print(
+            f"[Warning] Stream {session.id[:8]} ({session.endpoint}, {session.model_type}) "
+            f"ended: {reason} after {session.chars} chars, {elapsed:.1f}s"
+        )
+        self.recent.append({
+            "id": session.id,
+            "endpoint": session.endpoint,
+            "model_type": session.model_type,
+            "reason": reason,
+            "error": session.error,
+            "started_at": session.started_at,
+            "duration": round(elapsed, 3),
+            "chars": session.chars,
+            "partial": session.text[:self.partial_max_chars],
+        })
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回活跃流数量、结束原因统计和最近的中断会话"""
+        return {
+            "active": len(self.active),
+            "outcomes": dict(self.outcomes),
+            "recent": list(self.recent),
+        }
+
+
+# 进程级单例
+stream_monitor = StreamMonitor.from_env()
@@ -0,0 +1,306 @@
+"""
+Stream Resume - 可断点续传的生成流
+
+移动网络经常中断 SSE 连接。生成流不再绑定在某一个连接上：
+- 上游生成在独立任务中运行，编码好的 SSE 事件写入按流 ID 索引的环形缓冲区，
+  每个事件带有 `id: <stream_id>:<序号>`
+- 客户端携带 Last-Event-ID 重连时，先回放缺失的事件，再继续接收仍在运行的生成，
+  不会重新发起付费的 LLM 调用
+- 所有连接都断开后保留 STREAM_RESUME_GRACE 秒等待重连，超时则取消上游生成；
+  宽限期内上游仍在计费，因此默认关闭，由请求的 resumable 字段按需开启
+- 生成结束后会话保留 STREAM_RESUME_TTL 秒；缓冲区有单流和全局内存上限，
+  超过全局上限时优先淘汰已结束的会话
+
+配置（环境变量）：
+    STREAM_RESUME_ENABLED: 未指定 resumable 的流式请求是否可续传，默认 false
+    STREAM_RESUME_TTL: 生成结束后会话保留时间（秒），默认 300
+    STREAM_RESUME_GRACE: 无连接时等待重连的时间（秒），默认 10
+    STREAM_RESUME_BUFFER_BYTES: 单个流的缓冲上限（字节），默认 262144
+    STREAM_RESUME_MAX_BYTES: 所有流的缓冲总上限（字节），默认 67108864
+"""
+
+import time
+import uuid
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+from services.settings import env_float, env_int, env_flag
+from services.sse_framer import HEARTBEAT, encode_json_event
+
+
+class StreamGone(Exception):
+    """流不存在、已过期，或所需事件已被淘汰出缓冲区"""
+
+
+def parse_last_event_id(value: str) -> Tuple[str, int]:
+    """
+    解析 Last-Event-ID（格式 `<stream_id>:<序号>`）
+
+    Raises:
+        ValueError: 格式无效
+    """
+    stream_id, sep, seq = value.strip().rpartition(":")
+    if not sep or not stream_id or not seq.isdigit():
+        raise ValueError(f"Invalid Last-Event-ID: {value!r}")
+    return stream_id, int(seq)
+
+
+class ResumableStream:
+    """一次生成的事件缓冲区及其上游生产任务"""
+
+    def __init__(
+        self,
+        registry: "ResumableStreamRegistry",
+        meta: Dict[str, Any],
+        on_abandon: Optional[Callable[[], None]] = None,
+    ):
+        self.id = uuid.uuid4().hex
+        self.meta = meta
+        self._on_abandon = on_abandon
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._registry = registry
+        self._events: Deque[Tuple[int, bytes]] = deque()
+        self._next_seq = 0
+        self.buffered_bytes = 0
+        self.subscribers = 0
+        self.done = False
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._grace: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def first_seq(self) -> int:
+        """缓冲区中最早事件的序号"""
+        return self._events[0][0] if self._events else self._next_seq
+
+    def start(self, body: AsyncIterator[bytes]) -> None:
+        self._task = asyncio.create_task(self._produce(body))
+
+    async def _produce(self, body: AsyncIterator[bytes]) -> None:
+        try:
+            async for frame in body:
+                # 心跳由每个连接各自发送，不进入缓冲区
+                if frame.startswith(b":"):
+                    continue
+                self._append(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"[Warning] Resumable stream {self.id[:8]} failed: {e}")
+        finally:
+            self.done = True
+            self.finished_at = time.time()
+            self._cancel_grace()
+            self._notify()
+
+    def _append(self, frame: bytes) -> None:
+        seq = self._next_seq
+        self._next_seq += 1
+        data = f"id: {self.id}:{seq}\n".encode("utf-8") + frame
+        self._events.append((seq, data))
+        self.buffered_bytes += len(data)
+        self._registry._grow(len(data))
+        while self.buffered_bytes > self._registry.buffer_bytes and len(self._events) > 1:
+            self.trim_oldest()
+        self._registry._enforce_cap(self)
+        self._notify()
+
+    def trim_oldest(self) -> int:
+        """淘汰最早的事件，返回释放的字节数"""
+        _, data = self._events.popleft()
+        self.buffered_bytes -= len(data)
+        self._registry._grow(-len(data))
+        return len(data)
+
+    def release(self) -> None:
+        """释放全部缓冲区"""
+        self._registry._grow(-self.buffered_bytes)
+        self._events.clear()
+        self.buffered_bytes = 0
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def cancel(self) -> None:
+        """取消上游生成"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    def _cancel_grace(self) -> None:
+        if self._grace is not None:
+            self._grace.cancel()
+            self._grace = None
+
+    def _abandon(self) -> None:
+        self._grace = None
+        if self.subscribers == 0 and not self.done:
+            print(f"[Warning] Resumable stream {self.id[:8]} abandoned, cancelling upstream generation")
+            if self._on_abandon is not None:
+                self._on_abandon()
+            self.cancel()
+
+    def subscribe(self, after: int = -1, heartbeat: float = 15.0) -> AsyncGenerator[bytes, None]:
+        """
+        从序号 after 之后开始读取事件（-1 表示从头读取），无事件时按 heartbeat 间隔发送心跳
+
+        Raises:
+            StreamGone: 需要回放的事件已被淘汰
+        """
+        if after + 1 < self.first_seq:
+            raise StreamGone(f"events after {after} are no longer buffered")
+        return self._subscribe(after, heartbeat)
+
+    async def _subscribe(self, after: int, heartbeat: float) -> AsyncGenerator[bytes, None]:
+        self.subscribers += 1
+        self._cancel_grace()
+        pos = after + 1
+        try:
+            while True:
+                changed = self._changed
+                if pos < self.first_seq:
+                    # 慢速连接落后于缓冲区，无法保证内容连续：响应已开始，
+                    # 以错误事件（与生成错误格式相同、不带 id）结束本连接
+                    print(f"[Warning] Resumable stream {self.id[:8]}: subscriber fell behind the buffer at {pos - 1}")
+                    yield encode_json_event({"error": "生成错误: 连接过慢，部分内容已被淘汰，请重新发起请求"})
+                    return
+                if pos < self._next_seq:
+                    # 每次重新定位，回放期间缓冲区可能被裁剪
+                    seq, data = self._events[pos - self.first_seq]
+                    pos = seq + 1
+                    yield data
+                    continue
+                if self.done:
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), heartbeat if heartbeat > 0 else None)
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done and self._registry.grace > 0:
+                loop = asyncio.get_running_loop()
+                self._grace = loop.call_later(self._registry.grace, self._abandon)
+            elif self.subscribers == 0 and not self.done:
+                self._abandon()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            **self.meta,
+            "events": self._next_seq,
+            "buffered_events": len(self._events),
+            "buffered_bytes": self.buffered_bytes,
+            "subscribers": self.subscribers,
+            "done": self.done,
+        }
+
+
+class ResumableStreamRegistry:
+    """按流 ID 管理可续传的生成流"""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        ttl: float = 300.0,
+        grace: float = 10.0,
+        buffer_bytes: int = 256 * 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.grace = grace
+        self.buffer_bytes = buffer_bytes
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.resumed = 0
+        self.expired = 0
+        self._streams: "OrderedDict[str, ResumableStream]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "ResumableStreamRegistry":
+        return cls(
+            enabled=env_flag("STREAM_RESUME_ENABLED", False),
+            ttl=env_float("STREAM_RESUME_TTL", 300.0),
+            grace=env_float("STREAM_RESUME_GRACE", 10.0),
+            buffer_bytes=env_int("STREAM_RESUME_BUFFER_BYTES", 256 * 1024),
+            max_bytes=env_int("STREAM_RESUME_MAX_BYTES", 64 * 1024 * 1024),
+        )
+
+    def create(
+        self,
+        body: AsyncIterator[bytes],
+        on_abandon: Optional[Callable[[], None]] = None,
+        **meta: Any,
+    ) -> ResumableStream:
+        """
+        在后台任务中开始消费 body，返回可订阅的流
+
+        Args:
+            body: 编码后的 SSE 事件（每个元素为一个完整事件）
+            on_abandon: 宽限期内无人重连、取消上游生成之前调用
+            **meta: 附加信息（如 endpoint、model_type），用于统计
+        """
+        self._purge()
+        stream = ResumableStream(self, meta, on_abandon)
+        self._streams[stream.id] = stream
+        stream.start(body)
+        return stream
+
+    def get(self, stream_id: str) -> ResumableStream:
+        self._purge()
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            raise StreamGone(f"stream {stream_id} not found or expired")
+        self.resumed += 1
+        return stream
+
+    def _purge(self) -> None:
+        now = time.time()
+        for stream_id, stream in list(self._streams.items()):
+            if stream.done and stream.subscribers == 0 and now - stream.finished_at >= self.ttl:
+                self._remove(stream_id)
+                self.expired += 1
+
+    def _remove(self, stream_id: str) -> None:
+        stream = self._streams.pop(stream_id)
+        stream.release()
+
+    def _grow(self, delta: int) -> None:
+        self.total_bytes += delta
+
+    def _enforce_cap(self, current: ResumableStream) -> None:
+        if self.total_bytes <= self.max_bytes:
+            return
+        # 先淘汰已结束且无连接的会话（最早创建的优先）
+        for stream_id, stream in list(self._streams.items()):
+            if self.total_bytes <= self.max_bytes:
+                return
+            if stream.done and stream.subscribers == 0:
+                self._remove(stream_id)
+                self.expired += 1
+        # 仍超限时从最早的流开始淘汰旧事件
+        for stream in list(self._streams.values()):
+            while self.total_bytes > self.max_bytes and len(stream._events) > (1 if stream is current else 0):
+                stream.trim_oldest()
+            if self.total_bytes <= self.max_bytes:
+                return
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._purge()
+        return {
+            "enabled": self.enabled,
+            "streams": len(self._streams),
+            "running": sum(1 for stream in self._streams.values() if not stream.done),
+            "buffered_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "resumed": self.resumed,
+            "expired": self.expired,
+            "running_streams": [stream.snapshot() for stream in self._streams.values() if not stream.done],
+        }
+
+
+# 进程级单例
+resumable_streams = ResumableStreamRegistry.from_env()
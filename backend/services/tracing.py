@@ -0,0 +1,399 @@
+"""
+Tracing - 请求 ID 与轻量级链路追踪
+
+- RequestIdMiddleware：每个请求分配请求 ID（沿用客户端的 X-Request-ID），
+  写入响应头，并按采样率开启一条追踪
+- 追踪按 OpenTelemetry span 字段（trace_id / span_id / parent_span_id /
+  start_time_unix_nano / end_time_unix_nano / attributes / events / status）
+  以 JSON Lines 输出到标准输出或本地文件，可直接导入 OTel Collector 等工具
+- 结束的 span 放入有界队列，由后台线程序列化并写出，事件循环不做文件 I/O；
+  队列满时丢弃并计数
+- 支持 W3C traceparent：上游已采样的请求沿用其 trace_id 并强制采样
+- 未采样的请求只有一次 ContextVar 读取的开销；SSE 合并发送的事件只在采样时记录
+
+生成链路中的 span：
+    HTTP 请求（根 span）
+        > prompt.compile > db.get_project_by_id（未命中编译缓存时，在数据库线程中执行）
+        > llm.factory.create
+        > llm.upstream（事件：rate_limit_acquired / response_headers / first_token，结束于最后一个字节）
+        > sse.relay（事件：flush / heartbeat）
+
+配置（环境变量）：
+    TRACE_SAMPLE_RATE: 采样率 0-1，默认 0（仅在携带已采样 traceparent 时追踪）
+    TRACE_OUTPUT: stdout 或 JSON Lines 文件路径，默认 stdout
+    TRACE_SERVICE_NAME: resource 中的 service.name，默认 huoyuan-backend
+    TRACE_MAX_EVENTS: 单个 span 最多记录的事件数，默认 128
+    TRACE_QUEUE_SIZE: 等待写出的 span 数上限，默认 10000
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import random
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, TextIO
+
+from services.settings import env_float, env_int, env_str
+
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+def current_span() -> Optional["Span"]:
+    """当前请求的活动 span，未采样时为 None"""
+    return _current_span.get()
+
+
+def current_request_id() -> Optional[str]:
+    """当前请求的请求 ID"""
+    return _request_id.get()
+
+
+def parse_traceparent(value: Optional[str]):
+    """
+    解析 W3C traceparent（00-<trace_id>-<parent_id>-<flags>）
+
+    Returns:
+        (trace_id, parent_span_id, sampled)，格式无效时返回 None
+    """
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+
+
+class Span:
+    """一个 span；end() 时写出"""
+
+    __slots__ = (
+        "tracer", "name", "kind", "trace_id", "span_id", "parent_span_id",
+        "start_ns", "_start_mono", "end_ns", "attributes", "events", "dropped_events",
+        "status", "status_message", "_token",
+    )
+
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: str,
+        trace_id: str,
+        parent_span_id: Optional[str] = None,
+        kind: str = "INTERNAL",
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.start_ns = time.time_ns()
+        self._start_mono = time.monotonic()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.events: List[Dict[str, Any]] = []
+        self.dropped_events = 0
+        self.status = "UNSET"
+        self.status_message = ""
+
+    def _at(self, monotonic: Optional[float]) -> int:
+        """将 time.monotonic() 时刻换算为 Unix 纳秒"""
+        if monotonic is None:
+            return time.time_ns()
+        return self.start_ns + int((monotonic - self._start_mono) * 1e9)
+
+    def child(self, name: str, kind: str = "INTERNAL", **attributes: Any) -> "Span":
+        return Span(self.tracer, name, self.trace_id, self.span_id, kind, attributes)
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def event(self, name: str, at: Optional[float] = None, **attributes: Any) -> None:
+        """
+        记录事件
+
+        Args:
+            name: 事件名称
+            at: 事件发生的 time.monotonic() 时刻，默认为当前时间
+        """
+        if len(self.events) >= self.tracer.max_events:
+            self.dropped_events += 1
+            return
+        event: Dict[str, Any] = {"name": name, "time_unix_nano": self._at(at)}
+        if attributes:
+            event["attributes"] = attributes
+        self.events.append(event)
+
+    def error(self, error: BaseException) -> None:
+        self.status = "ERROR"
+        self.status_message = f"{type(error).__name__}: {error}"[:200]
+
+    def end(self, at: Optional[float] = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = self._at(at)
+        if self.status == "UNSET":
+            self.status = "OK"
+        self.tracer.export(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            _current_span.set(None)
+        if exc is not None and not isinstance(exc, GeneratorExit):
+            self.error(exc)
+        self.end()
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id or "",
+            "name": self.name,
+            "kind": f"SPAN_KIND_{self.kind}",
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "attributes": self.attributes,
+            "status": {"code": f"STATUS_CODE_{self.status}", "message": self.status_message},
+            "resource": self.tracer.resource,
+        }
+        if self.events:
+            data["events"] = self.events
+        if self.dropped_events:
+            data["dropped_events_count"] = self.dropped_events
+        return data
+
+
+class _NoopSpan:
+    """未采样时使用的空 span"""
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+class Tracer:
+    """按采样率创建追踪并以 JSON Lines 输出"""
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        output: str = "stdout",
+        service_name: str = "huoyuan-backend",
+        max_events: int = 128,
+        queue_size: int = 10000,
+    ):
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.output = output
+        self.max_events = max(0, max_events)
+        self.resource = {"service.name": service_name}
+        self.exported = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(max(1, queue_size))
+        self._lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+        self._file: Optional[TextIO] = None
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        return cls(
+            sample_rate=env_float("TRACE_SAMPLE_RATE", 0.0),
+            output=env_str("TRACE_OUTPUT", "stdout"),
+            service_name=env_str("TRACE_SERVICE_NAME", "huoyuan-backend"),
+            max_events=env_int("TRACE_MAX_EVENTS", 128),
+            queue_size=env_int("TRACE_QUEUE_SIZE", 10000),
+        )
+
+    def start_trace(
+        self,
+        name: str,
+        traceparent: Optional[str] = None,
+        kind: str = "SERVER",
+        **attributes: Any,
+    ) -> Optional[Span]:
+        """
+        按采样决策开启一条追踪（根 span），未采样时返回 None
+
+        携带 traceparent 时沿用其 trace_id；上游已采样的请求总是追踪。
+        """
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_span_id, sampled = parent
+        else:
+            trace_id, parent_span_id, sampled = None, None, False
+        if not sampled and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return None
+        return Span(self, name, trace_id or uuid.uuid4().hex, parent_span_id, kind, attributes)
+
+    def start_span(self, name: str, kind: str = "INTERNAL", **attributes: Any) -> Optional[Span]:
+        """
+        创建当前 span 的子 span（不切换当前 span），未采样时返回 None
+
+        用于跨越多次 yield 的生成器，由调用方负责 end()。
+        """
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        return parent.child(name, kind, **attributes)
+
+    def span(self, name: str, kind: str = "INTERNAL", **attributes: Any):
+        """
+        当前 span 的子 span（上下文管理器），未采样时为空操作
+
+        Usage:
+            with tracer.span("llm.factory.create", model_type=model_type):
+                llm = LLMFactory.create(model_type)
+        """
+        return self.start_span(name, kind, **attributes) or _NOOP
+
+    def export(self, span: Span) -> None:
+        """放入写出队列（不阻塞），队列满时丢弃"""
+        if self._writer is None:
+            self._start_writer()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.exported += 1
+
+    def _start_writer(self) -> None:
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self) -> None:
+        while True:
+            span = self._queue.get()
+            if span is None:
+                self._flush()
+                return
+            try:
+                self._write(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+                # 队列清空时再刷新，突发的 span 合并为一次写入
+                if self._queue.empty():
+                    self._flush()
+            except Exception as e:
+                print(f"[Warning] Trace export failed: {e}")
+
+    def _write(self, line: str) -> None:
+        if self.output == "stdout":
+            sys.stdout.write(line + "\n")
+            return
+        if self._file is None:
+            self._file = open(self.output, "a", encoding="utf-8")
+        self._file.write(line + "\n")
+
+    def _flush(self) -> None:
+        stream = sys.stdout if self.output == "stdout" else self._file
+        if stream is not None:
+            stream.flush()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """写出队列中剩余的 span 并关闭文件"""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join(timeout)
+            if writer.is_alive():
+                print("[Warning] Trace writer did not finish before shutdown")
+                return
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class RequestIdMiddleware:
+    """
+    ASGI 中间件：请求 ID 与根 span
+
+    请求 ID 取自 X-Request-ID 请求头（不存在时生成），写入响应头；
+    采样的请求在整个响应（含流式输出）期间保持一个 SERVER span。
+    """
+
+    def __init__(self, app, tracer: Optional["Tracer"] = None):
+        self.app = app
+        self.tracer = tracer or globals()["tracer"]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {}
+        for key, value in scope.get("headers") or []:
+            if key in (b"x-request-id", b"traceparent"):
+                headers[key] = value.decode("latin-1")
+        request_id = (headers.get(b"x-request-id") or "")[:128] or uuid.uuid4().hex
+        span = self.tracer.start_trace(
+            f"{scope['method']} {scope.get('path', '')}",
+            headers.get(b"traceparent"),
+            **{
+                "http.request.method": scope["method"],
+                "url.path": scope.get("path", ""),
+                "request.id": request_id,
+            },
+        )
+        request_token = _request_id.set(request_id)
+        span_token = _current_span.set(span) if span is not None else None
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (REQUEST_ID_HEADER.lower().encode("latin-1"), request_id.encode("latin-1"))
+                ]
+                if span is not None:
+                    span.event("response_start")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            if span is not None:
+                span.error(e)
+            raise
+        finally:
+            if span is not None:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    span.name = f"{scope['method']} {route}"
+                    span.set(**{"http.route": route})
+                span.set(**{"http.response.status_code": status})
+                if status >= 500 and span.status == "UNSET":
+                    span.status = "ERROR"
+                span.end()
+                _current_span.reset(span_token)
+            _request_id.reset(request_token)
+
+
+# 进程级单例
+tracer = Tracer.from_env()
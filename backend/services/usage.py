@@ -0,0 +1,421 @@
+"""
+Usage - 上游调用的 tokens 用量与耗时记录
+
+每次实际发生的上游调用（不含响应缓存命中）生成一条 Usage：
+- 提示词 / 生成 / 缓存命中 / 缓存写入 tokens（统一 OpenAI、DeepSeek、Anthropic 的 usage 格式）
+- 首字延迟（TTFT）、总耗时、上游请求 ID
+- 上游未返回 usage 时（流被中断、代理不支持 stream_options）按本地估算补齐并标记 estimated
+
+调用方通过 UsageScope 传入项目和智能体，用量按 (项目, 智能体, 模型) 汇总，
+用于定位成本和延迟较高的智能体与 IP 人设。合并到同一次上游调用的跟随请求
+（services.coalescing）在各自的 UsageScope 中记录一份标记为 coalesced 的用量，
+汇总中计入其项目/智能体，并单独统计 coalesced 次数；Prometheus 指标只统计实际的上游调用。设置 USAGE_DB 后每次调用同时写入 SQLite，
+便于离线分析。
+
+配置（环境变量）：
+    USAGE_DB: 调用明细 SQLite 文件路径，为空时只在内存中汇总
+    USAGE_MAX_GROUPS: 内存中保留的汇总分组数上限，默认 5000
+"""
+
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from services.settings import env_int, env_str
+from services.rate_limit import estimate_tokens
+from services.provider_stats import provider_latency
+from services.metrics import llm_output_rate, llm_requests, llm_tokens, llm_ttft
+
+
+# 上游请求 ID 响应头（OpenAI / DeepSeek / 豆包 / Anthropic）
+REQUEST_ID_HEADERS = ("x-request-id", "request-id", "x-client-request-id")
+
+
+class Usage:
+    """一次上游调用的用量"""
+
+    __slots__ = (
+        "provider", "model", "stream", "started", "_raw",
+        "prompt_tokens", "completion_tokens", "cached_tokens", "cache_creation_tokens",
+        "ttft", "latency", "request_id", "estimated", "status", "connected_at", "coalesced",
+    )
+
+    def __init__(self, provider: str, model: Optional[str] = None, stream: bool = False):
+        self.provider = provider
+        self.model = model
+        self.stream = stream
+        self.started = time.monotonic()
+        self._raw: Dict[str, Any] = {}
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.cached_tokens = 0
+        self.cache_creation_tokens = 0
+        self.ttft: Optional[float] = None
+        self.latency: Optional[float] = None
+        self.request_id: Optional[str] = None
+        self.estimated = False
+        self.status = "ok"
+        self.connected_at: Optional[float] = None
+        # 合并请求的跟随者共享的用量（没有单独的上游调用）
+        self.coalesced = False
+
+    def share(self) -> "Usage":
+        """返回供合并请求跟随者记录的副本"""
+        shared = Usage(self.provider, self.model, self.stream)
+        for name in self.__slots__:
+            setattr(shared, name, getattr(self, name))
+        shared._raw = dict(self._raw)
+        shared.coalesced = True
+        return shared
+
+    def start(self) -> None:
+        """开始计时（在取得限流名额之后调用，排队时间不计入延迟）"""
+        self.started = time.monotonic()
+
+    def update(self, raw: Optional[Dict[str, Any]]) -> None:
+        """
+        合并上游返回的 usage
+
+        Anthropic 流式响应分两次返回（message_start 带输入 tokens，message_delta 带输出 tokens），
+        因此按字段合并后重新计算。
+        """
+        if not raw:
+            return
+        self._raw.update({key: value for key, value in raw.items() if value is not None})
+        raw = self._raw
+        if "input_tokens" in raw or "output_tokens" in raw:
+            # Anthropic：input_tokens 不含缓存读取/写入的 tokens
+            self.cached_tokens = int(raw.get("cache_read_input_tokens") or 0)
+            self.cache_creation_tokens = int(raw.get("cache_creation_input_tokens") or 0)
+            self.prompt_tokens = int(raw.get("input_tokens") or 0) + self.cached_tokens + self.cache_creation_tokens
+            self.completion_tokens = int(raw.get("output_tokens") or 0)
+        elif "prompt_tokens" in raw:
+            # OpenAI 兼容：prompt_tokens 已包含缓存命中的 tokens
+            details = raw.get("prompt_tokens_details") or {}
+            self.prompt_tokens = int(raw.get("prompt_tokens") or 0)
+            self.completion_tokens = int(raw.get("completion_tokens") or 0)
+            self.cached_tokens = int(details.get("cached_tokens") or raw.get("prompt_cache_hit_tokens") or 0)
+
+    def set_request_id(self, response: Optional[httpx.Response] = None, fallback: Optional[str] = None) -> None:
+        """
+        从响应头（优先）或响应体 ID 中记录上游请求 ID
+
+        传入 response 时同时记录收到响应头的时刻（time.monotonic()），供链路追踪使用。
+        """
+        if response is not None and self.connected_at is None:
+            self.connected_at = time.monotonic()
+        if self.request_id:
+            return
+        if response is not None:
+            for header in REQUEST_ID_HEADERS:
+                value = response.headers.get(header)
+                if value:
+                    self.request_id = value
+                    return
+        if fallback:
+            self.request_id = fallback
+
+    def first_token(self) -> None:
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.started
+
+    def finish(self, prompt_estimate: int, output: str, status: str = "ok") -> None:
+        """
+        结束计时，上游未返回 usage 时按本地估算补齐
+
+        Args:
+            prompt_estimate: 本地估算的输入 tokens
+            output: 已生成的文本
+            status: ok / error / aborted
+        """
+        self.latency = time.monotonic() - self.started
+        if self.ttft is None and not self.stream:
+            self.ttft = self.latency
+        self.status = status
+        if self.prompt_tokens is None:
+            self.prompt_tokens = prompt_estimate
+            self.estimated = True
+        if self.completion_tokens is None:
+            self.completion_tokens = estimate_tokens(output)
+            self.estimated = True
+
+    def tokens(self) -> Dict[str, int]:
+        return {
+            "prompt_tokens": self.prompt_tokens or 0,
+            "completion_tokens": self.completion_tokens or 0,
+            "cached_tokens": self.cached_tokens,
+            "cache_creation_tokens": self.cache_creation_tokens,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider,
+            "model": self.model,
+            **self.tokens(),
+            "total_tokens": (self.prompt_tokens or 0) + (self.completion_tokens or 0),
+            "ttft": round(self.ttft, 4) if self.ttft is not None else None,
+            "latency": round(self.latency, 4) if self.latency is not None else None,
+            "request_id": self.request_id,
+            "estimated": self.estimated,
+            "coalesced": self.coalesced,
+            "status": self.status,
+        }
+
+
+class UsageScope:
+    """
+    一次 API 请求的用量归属（项目、智能体、接口），收集其中发生的全部上游调用
+
+    作为 generate_text / generate_stream 的 usage_scope 参数传入。
+    """
+
+    def __init__(self, endpoint: str, project_id: Optional[str] = None, agent_type: Optional[str] = None):
+        self.endpoint = endpoint
+        self.project_id = project_id
+        self.agent_type = agent_type
+        self.calls: List[Usage] = []
+        # 合并到本请求上游调用的其它请求，记录用量时各自记录一份共享的用量
+        self.followers: List["UsageScope"] = []
+
+    def summary(self) -> Optional[Dict[str, Any]]:
+        """汇总本次请求的用量，没有上游调用（如命中响应缓存）时返回 None"""
+        if not self.calls:
+            return None
+        if len(self.calls) == 1:
+            result = self.calls[0].to_dict()
+            result.pop("status")
+            return result
+        first, last = self.calls[0], self.calls[-1]
+        totals = {key: 0 for key in first.tokens()}
+        for usage in self.calls:
+            for key, value in usage.tokens().items():
+                totals[key] += value
+        return {
+            "provider": last.provider,
+            "model": last.model,
+            **totals,
+            "total_tokens": totals["prompt_tokens"] + totals["completion_tokens"],
+            "ttft": round(first.ttft, 4) if first.ttft is not None else None,
+            "latency": round(sum(usage.latency or 0 for usage in self.calls), 4),
+            "request_id": last.request_id,
+            "estimated": any(usage.estimated for usage in self.calls),
+            "coalesced": any(usage.coalesced for usage in self.calls),
+            "calls": len(self.calls),
+        }
+
+
+class SQLiteUsageLog:
+    """调用明细写入 SQLite，写入在线程池中执行，不阻塞事件循环"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.failed = 0
+        self._lock = threading.Lock()
+        # 尚未完成的写入，aclose() 时等待其完成
+        self._pending: Set[asyncio.Future] = set()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_usage (
+                created_at REAL NOT NULL,
+                endpoint TEXT,
+                project_id TEXT,
+                agent_type TEXT,
+                provider TEXT NOT NULL,
+                model TEXT,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                cached_tokens INTEGER NOT NULL,
+                cache_creation_tokens INTEGER NOT NULL,
+                ttft REAL,
+                latency REAL,
+                request_id TEXT,
+                estimated INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                coalesced INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(llm_usage)")}
+        if "coalesced" not in columns:
+            # 早期版本创建的表
+            self._conn.execute("ALTER TABLE llm_usage ADD COLUMN coalesced INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_llm_usage_project ON llm_usage(project_id, agent_type)
+        """)
+        self._conn.commit()
+
+    def _insert(self, row: Tuple) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO llm_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row
+            )
+            self._conn.commit()
+
+    def write(self, usage: Usage, scope: Optional[UsageScope]) -> None:
+        row = (
+            time.time(),
+            scope.endpoint if scope else None,
+            scope.project_id if scope else None,
+            scope.agent_type if scope else None,
+            usage.provider,
+            usage.model,
+            *usage.tokens().values(),
+            usage.ttft,
+            usage.latency,
+            usage.request_id,
+            int(usage.estimated),
+            usage.status,
+            int(usage.coalesced),
+        )
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            try:
+                self._insert(row)
+            except Exception as e:
+                self._failed(e)
+            return
+        future = loop.run_in_executor(None, self._insert, row)
+        self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future: asyncio.Future) -> None:
+        self._pending.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            self._failed(future.exception())
+
+    def _failed(self, error: BaseException) -> None:
+        self.failed += 1
+        print(f"[Warning] Usage log write failed ({self.path}): {error}")
+
+    async def aclose(self) -> None:
+        """等待未完成的写入后关闭"""
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class UsageTracker:
+    """按 (项目, 智能体, 模型) 汇总用量"""
+
+    def __init__(self, db_path: Optional[str] = None, max_groups: int = 5000):
+        self.max_groups = max(1, max_groups)
+        self.log: Optional[SQLiteUsageLog] = SQLiteUsageLog(db_path) if db_path else None
+        self._groups: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "UsageTracker":
+        return cls(
+            db_path=env_str("USAGE_DB"),
+            max_groups=env_int("USAGE_MAX_GROUPS", 5000),
+        )
+
+    def record(self, usage: Usage, scope: Optional[UsageScope] = None) -> None:
+        """记录一次已结束的上游调用，并为合并到该调用的跟随请求各记录一份共享的用量"""
+        tokens = usage.tokens()
+        provider_latency.record_usage(usage.provider, tokens, usage.ttft if usage.stream else None)
+        self._observe(usage, tokens)
+        self._add(usage, scope, tokens)
+        if scope is not None:
+            for follower in scope.followers:
+                self._add(usage.share(), follower, tokens)
+
+    def _add(self, usage: Usage, scope: Optional[UsageScope], tokens: Dict[str, int]) -> None:
+        key = (
+            (scope.project_id if scope else None) or "",
+            (scope.agent_type if scope else None) or "",
+            f"{usage.provider}/{usage.model}" if usage.model else usage.provider,
+        )
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = {
+                "requests": 0, "estimated": 0, "errors": 0, "coalesced": 0,
+                **{field: 0 for field in tokens},
+                "ttft_sum": 0.0, "ttft_count": 0, "latency_sum": 0.0,
+            }
+            while len(self._groups) > self.max_groups:
+                self._groups.popitem(last=False)
+        else:
+            self._groups.move_to_end(key)
+        group["requests"] += 1
+        group["estimated"] += int(usage.estimated)
+        group["errors"] += int(usage.status != "ok")
+        group["coalesced"] += int(usage.coalesced)
+        for field, value in tokens.items():
+            group[field] += value
+        if usage.ttft is not None:
+            group["ttft_sum"] += usage.ttft
+            group["ttft_count"] += 1
+        group["latency_sum"] += usage.latency or 0.0
+
+        if scope is not None:
+            scope.calls.append(usage)
+        if self.log is not None:
+            self.log.write(usage, scope)
+
+    @staticmethod
+    def _observe(usage: Usage, tokens: Dict[str, int]) -> None:
+        model = usage.model or ""
+        llm_requests.inc(usage.provider, model, usage.status)
+        for field, value in tokens.items():
+            if value:
+                llm_tokens.inc(usage.provider, model, field[:-len("_tokens")], amount=value)
+        if usage.ttft is not None:
+            llm_ttft.observe(usage.ttft, usage.provider, model)
+            generating = (usage.latency or 0.0) - usage.ttft
+            if usage.stream and generating > 0 and usage.completion_tokens:
+                llm_output_rate.observe(usage.completion_tokens / generating, usage.provider, model)
+
+    def snapshot(self, group_by: str = "all") -> List[Dict[str, Any]]:
+        """
+        返回汇总用量，按总 tokens 倒序
+
+        Args:
+            group_by: all（项目+智能体+模型）/ project / agent / model
+        """
+        dimensions = {"all": (0, 1, 2), "project": (0,), "agent": (1,), "model": (2,)}[group_by]
+        names = ("project_id", "agent_type", "model")
+        rolled: Dict[Tuple, Dict[str, Any]] = {}
+        for key, group in self._groups.items():
+            rolled_key = tuple(key[index] for index in dimensions)
+            target = rolled.get(rolled_key)
+            if target is None:
+                rolled[rolled_key] = dict(group)
+            else:
+                for field, value in group.items():
+                    target[field] += value
+
+        rows = []
+        for rolled_key, group in rolled.items():
+            requests = group["requests"] or 1
+            rows.append({
+                **{names[index]: value or None for index, value in zip(dimensions, rolled_key)},
+                "requests": group["requests"],
+                "prompt_tokens": group["prompt_tokens"],
+                "completion_tokens": group["completion_tokens"],
+                "cached_tokens": group["cached_tokens"],
+                "cache_creation_tokens": group["cache_creation_tokens"],
+                "total_tokens": group["prompt_tokens"] + group["completion_tokens"],
+                "estimated": group["estimated"],
+                "errors": group["errors"],
+                "coalesced": group["coalesced"],
+                "avg_ttft": round(group["ttft_sum"] / group["ttft_count"], 4) if group["ttft_count"] else None,
+                "avg_latency": round(group["latency_sum"] / requests, 4),
+            })
+        rows.sort(key=lambda row: row["total_tokens"], reverse=True)
+        return rows
+
+
+# 进程级单例
+usage_tracker = UsageTracker.from_env()